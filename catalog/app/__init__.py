@@ -1,6 +1,6 @@
 from flask import Flask
 from database_setup import Base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy import create_engine
 from flask import session as login_session
 from flask.ext.heroku import Heroku
@@ -11,8 +11,26 @@ app = Flask(__name__)
 heroku = Heroku(app)
 
 # Connect to Database and create database session
-engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+# The pool is shared by the worker threads: pool_size connections are kept
+# open, up to max_overflow more are opened under load, and connections are
+# recycled before the server side drops them as idle.
+database_uri = app.config['SQLALCHEMY_DATABASE_URI']
+if database_uri.startswith('sqlite'):
+    # SQLite, as used by catalog_test.py, opens a connection per checkout
+    engine = create_engine(database_uri)
+else:
+    engine = create_engine(database_uri,
+                           pool_size=10, max_overflow=20, pool_recycle=300)
 Base.metadata.bind = engine
 
 DBSession = sessionmaker(bind=engine)
-db_session = DBSession()
+
+# One session per thread, so per request; it is closed when the request's
+# app context is torn down, which returns its connection to the pool and
+# drops every object it loaded.
+db_session = scoped_session(DBSession)
+
+
+@app.teardown_appcontext
+def remove_db_session(exception=None):
+    db_session.remove()
@@ -0,0 +1,87 @@
+from app import db_session
+from database_setup import Category
+from sqlalchemy import asc
+from collections import OrderedDict, namedtuple
+import threading
+
+
+# In-process cache backend: the catalog version, a counter bumped whenever
+# categories or items change, and an LRU of cached values. Any object with
+# the same four methods, e.g. one keeping them in memcached or redis, can
+# be plugged in with set_backend() so that several worker processes share
+# the version and the values.
+class LocalBackend(object):
+
+    def __init__(self, size=16):
+        self.size = size
+        self.version = 0
+        self.values = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_version(self):
+        return self.version
+
+    def bump_version(self):
+        with self.lock:
+            self.version += 1
+
+    def get(self, key):
+        with self.lock:
+            value = self.values.pop(key, None)
+            if value is not None:
+                self.values[key] = value
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.values.pop(key, None)
+            self.values[key] = value
+            while len(self.values) > self.size:
+                self.values.popitem(last=False)
+
+
+backend = LocalBackend()
+
+
+# Replace the cache backend, e.g. with a shared one
+def set_backend(new_backend):
+    global backend
+    backend = new_backend
+
+
+# Current version of the catalog
+def catalog_version():
+    return backend.get_version()
+
+
+# To be called by every view changing categories or items, once committed
+def catalog_changed():
+    backend.bump_version()
+
+
+# Cached value for name at the given catalog version, or None
+def get_cached(name, version):
+    return backend.get('%s:%d' % (name, version))
+
+
+# Cache value for name at the given catalog version
+def set_cached(name, version, value):
+    backend.set('%s:%d' % (name, version), value)
+
+
+# Sidebar entry for a category, plain data so that it can be cached across
+# requests, unlike a Category loaded by one request's session
+SidebarCategory = namedtuple('SidebarCategory', ['id', 'name'])
+
+
+# Categories for the sidebar, ordered by name. They are read once per
+# catalog version and shared by every request.
+def get_sidebar_categories():
+    version = catalog_version()
+    categories = get_cached('sidebar', version)
+    if categories is None:
+        categories = [SidebarCategory(*row) for row in
+                      db_session.query(Category.id, Category.name)
+                      .order_by(asc(Category.name))]
+        set_cached('sidebar', version, categories)
+    return categories
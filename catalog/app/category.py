@@ -1,11 +1,17 @@
 from app import app, login_session, db_session
-from database_setup import Category, CategoryItem, local_storage
+from database_setup import Category, CategoryItem, ItemPicture, \
+    THUMBNAIL_WIDTH, local_storage
 from flask import render_template, request, redirect, jsonify, url_for, flash
-from sqlalchemy import asc, desc
+from sqlalchemy import and_, asc, desc
+from sqlalchemy.orm import aliased, subqueryload
 from sqlalchemy_imageattach.entity import store_context
 from app.user import getUserInfo
+from app.cache import catalog_version, catalog_changed, get_cached, \
+    set_cached, get_sidebar_categories
 from app.category_item import *
-from flask import Response
+from flask import Response, json, stream_with_context
+import hashlib
+import itertools
 
 
 # Helper function to return an XML response
@@ -20,33 +26,150 @@ def xml_response(data, status_code=200):
     return res
 
 
-# Helper function to get data for xml and json catalog dumpers
+# Helper function to get data for xml and json catalog dumpers. Items and
+# pictures are loaded for all categories at once, so the dump takes three
+# queries however large the catalog grows.
 def get_category_data():
-    categories = db_session.query(Category).all()
-    json_dict_list = [r.serialize for r in categories]
-    for index, data in enumerate(json_dict_list):
-        items = db_session.query(CategoryItem) \
-            .filter_by(category_id=json_dict_list[index]['id']).all()
-        json_dict_list[index]['category_items'] = [i.serialize for i in items]
+    categories = db_session.query(Category).order_by(Category.id) \
+        .options(subqueryload(Category.items)).all()
+    originals = {}
+    thumbnails = {}
+    for picture in db_session.query(ItemPicture):
+        if picture.original:
+            originals[picture.item_id] = picture
+        if picture.width == THUMBNAIL_WIDTH:
+            thumbnails[picture.item_id] = picture
+    json_dict_list = []
+    for category in categories:
+        data = category.serialize
+        data['category_items'] = [
+            i.serialize_pictures(originals[i.id], thumbnails[i.id])
+            for i in category.items]
+        json_dict_list.append(data)
     return json_dict_list
 
 
-# Show the whole catalog in json
+# Helper function to stream the catalog for the xml and json dumpers.
+# Yields (category, items) pairs in category id order, items being an
+# iterator of the category's serialized items that has to be used up
+# before the next pair. Categories and items come from server-side
+# cursors, so memory use does not grow with the catalog.
+def iter_category_data(chunk_size=1000):
+    categories = db_session.query(Category).order_by(Category.id) \
+        .yield_per(chunk_size)
+    picture = aliased(ItemPicture)
+    thumbnail = aliased(ItemPicture)
+    items = db_session.query(CategoryItem, picture, thumbnail) \
+        .join(picture, and_(picture.item_id == CategoryItem.id,
+                            picture.original)) \
+        .join(thumbnail, and_(thumbnail.item_id == CategoryItem.id,
+                              thumbnail.width == THUMBNAIL_WIDTH)) \
+        .order_by(CategoryItem.category_id, CategoryItem.id) \
+        .yield_per(chunk_size)
+    groups = itertools.groupby(items, lambda row: row[0].category_id)
+    group = next(groups, None)
+    for category in categories:
+        # Skip the items of categories that are gone
+        while group is not None and group[0] < category.id:
+            group = next(groups, None)
+        if group is not None and group[0] == category.id:
+            category_items = (i.serialize_pictures(p, t)
+                              for i, p, t in group[1])
+        else:
+            category_items = iter(())
+        yield category.serialize, category_items
+
+
+# Helper function to join the many small pieces of a streamed response
+# into writes of about size bytes
+def buffered(chunks, size=65536):
+    buffer = []
+    length = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+# Helper function to stream the catalog as json; the same document as
+# catalog_json() without the indentation
+def stream_catalog_json():
+    yield '{"categories": ['
+    for index, (category, items) in enumerate(iter_category_data()):
+        yield (', ' if index else '') + '{"category_items": ['
+        for item_index, item in enumerate(items):
+            yield (', ' if item_index else '') + json.dumps(item)
+        # The category's own fields sort after category_items
+        yield '], ' + json.dumps(category)[1:]
+    yield ']}'
+
+
+# Helper function to stream the catalog as xml; the same document as
+# catalog_xml()
+def stream_catalog_xml():
+    from dicttoxml import dicttoxml
+
+    empty_items = '<category_items type="list"></category_items>'
+    yield '<?xml version="1.0" encoding="UTF-8" ?><root>'
+    for category, items in iter_category_data():
+        # The category's fields in the order dicttoxml lays them out, with
+        # the items streamed in place of an empty list
+        category['category_items'] = []
+        head, tail = dicttoxml(category, root=False).split(empty_items)
+        yield '<item type="dict">%s<category_items type="list">' % head
+        for item in items:
+            yield '<item type="dict">%s</item>' % dicttoxml(item, root=False)
+        yield '</category_items>%s</item>' % tail
+    yield '</root>'
+
+
+# Helper function to serve a catalog dump from the cache, keyed by the
+# catalog version. On a miss the body is built by build and cached, or
+# streamed by stream if the client asked for that. The hash of a cached
+# body is its ETag, so clients that already have it get a 304.
+def cached_dump(name, mimetype, build, stream):
+    version = catalog_version()
+    cached = get_cached(name, version)
+    if cached is None:
+        if request.args.get('stream'):
+            return Response(stream_with_context(buffered(stream())),
+                            mimetype=mimetype)
+        data = build()
+        cached = (hashlib.md5(data).hexdigest(), data)
+        set_cached(name, version, cached)
+    etag, data = cached
+    response = Response(data, mimetype=mimetype)
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
+# Show the whole catalog in json, streamed with ?stream=1
 @app.route('/catalog/json')
 def catalog_json():
-    return jsonify(categories=get_category_data())
+    return cached_dump(
+        'catalog.json', 'application/json',
+        lambda: jsonify(categories=get_category_data()).get_data(),
+        stream_catalog_json)
 
 
-# Show the whole catalog in xml
+# Show the whole catalog in xml, streamed with ?stream=1
 @app.route('/catalog/xml')
 def catalog_xml():
-    return xml_response(get_category_data())
+    return cached_dump(
+        'catalog.xml', 'text/xml',
+        lambda: xml_response(get_category_data()).get_data(),
+        stream_catalog_xml)
 
 
 # Show all categories
 @app.route('/')
 def show_categories():
-    categories = db_session.query(Category).order_by(asc(Category.name))
+    categories = get_sidebar_categories()
     items = db_session.query(CategoryItem).order_by(desc(CategoryItem.added))
     if 'username' in login_session:
         username = login_session["username"]
@@ -70,12 +193,11 @@ def new_category():
         flash('New Category %s Successfully Created by %s' %
               (new.name, user.name))
         db_session.commit()
-        categories = db_session.query(Category).order_by(asc(Category.name))
+        catalog_changed()
         return redirect(url_for('show_categories',
-                                username=login_session["username"],
-                                categories=categories))
+                                username=login_session["username"]))
     else:
-        categories = db_session.query(Category).order_by(asc(Category.name))
+        categories = get_sidebar_categories()
         return render_template('new_category.html',
                                username=login_session["username"],
                                categories=categories)
@@ -93,14 +215,13 @@ def edit_category(category_id):
     if request.method == 'POST':
         if request.form['name']:
             edited.name = request.form['name']
+            db_session.commit()
+            catalog_changed()
             flash('%s Category Successfully Edited ' % edited.name)
-            categories = db_session.query(Category)\
-                .order_by(asc(Category.name))
             return redirect(url_for('show_categories',
-                                    username=login_session["username"],
-                                    categories=categories))
+                                    username=login_session["username"]))
     else:
-        categories = db_session.query(Category).order_by(asc(Category.name))
+        categories = get_sidebar_categories()
         return render_template('edit_category.html',
                                category=edited,
                                username=login_session["username"],
@@ -124,17 +245,15 @@ def delete_category(category_id):
             db_session.delete(delete_me)
             flash('%s Successfully Deleted' % delete_me.name)
             db_session.commit()
+            catalog_changed()
             return redirect(url_for('show_categories',
                             category_id=category_id,
-                            username=login_session["username"],
-                            categories=db_session.
-                            query(Category).order_by(asc(Category.name))))
+                            username=login_session["username"]))
     else:
         return render_template('delete_category.html',
                                category=delete_me,
                                username=login_session["username"],
-                               categories=db_session.
-                               query(Category).order_by(asc(Category.name)))
+                               categories=get_sidebar_categories())
 
 
 # Show a category items catalog
@@ -155,17 +274,13 @@ def show_items(category_id):
                                    items=items,
                                    category=category,
                                    username=username,
-                                   categories=db_session.
-                                   query(Category).
-                                   order_by(asc(Category.name)))
+                                   categories=get_sidebar_categories())
         else:
             return render_template('items.html',
                                    items=items,
                                    category=category,
                                    username=username,
-                                   categories=db_session.
-                                   query(Category).
-                                   order_by(asc(Category.name)))
+                                   categories=get_sidebar_categories())
 
 
 # JSON APIs to view items Information
@@ -1,7 +1,9 @@
 from app import app, login_session, db_session
+from app.cache import catalog_changed, get_sidebar_categories
 from sqlalchemy_imageattach.entity import store_context
 from flask import redirect, request, render_template, url_for, flash, jsonify
-from database_setup import Category, CategoryItem, local_storage
+from database_setup import Category, CategoryItem, THUMBNAIL_WIDTH, \
+    local_storage
 from app.category import *
 
 
@@ -12,7 +14,6 @@ def new_item(category_id):
     if 'username' not in login_session:
         return redirect('/login')
     category = db_session.query(Category).filter_by(id=category_id).one()
-    all_categories = db_session.query(Category).order_by(asc(Category.name))
     if request.method == 'POST':
         try:
                 photo = request.files.get('photo')
@@ -22,22 +23,21 @@ def new_item(category_id):
                                         category_id=category_id)
                 with store_context(local_storage):
                     new_item.picture.from_file(photo)
-                    new_item.picture.generate_thumbnail(width=300)
+                    new_item.picture.generate_thumbnail(width=THUMBNAIL_WIDTH)
                     db_session.add(new_item)
                     db_session.commit()
+                    catalog_changed()
         except:
             flash("Item creation failed")
             return redirect(url_for('show_items',
-                                    category_id=category_id,
-                                    categories=all_categories))
+                                    category_id=category_id))
         flash('New %s Item Successfully Created' % (new_item.name))
         return redirect(url_for('show_items',
-                                category_id=category_id,
-                                categories=all_categories))
+                                category_id=category_id))
     else:
         return render_template('new_item.html',
                                category_id=category_id,
-                               categories=all_categories)
+                               categories=get_sidebar_categories())
 
 
 # Edit an item
@@ -63,23 +63,23 @@ def edit_item(category_id, item_id):
         if photo:
             with store_context(local_storage):
                     edited_item.picture.from_file(photo)
-                    edited_item.picture.generate_thumbnail(width=300)
+                    edited_item.picture.generate_thumbnail(
+                        width=THUMBNAIL_WIDTH)
                     db_session.add(edited_item)
                     db_session.commit()
         else:
             db_session.add(edited_item)
             db_session.commit()
+        catalog_changed()
         flash('Item Successfully Edited')
         return redirect(url_for('show_items',
                                 category_id=category_id))
     else:
-        all_categories = db_session.query(Category).\
-                                        order_by(asc(Category.name))
         return render_template('edit_item.html',
                                category_id=category_id,
                                item_id=item_id,
                                item=edited_item,
-                               categories=all_categories)
+                               categories=get_sidebar_categories())
 
 
 # Delete an item
@@ -90,17 +90,17 @@ def delete_item(category_id, item_id):
         return redirect('/login')
     db_session.query(Category).filter_by(id=category_id).one()
     delete_me = db_session.query(CategoryItem).filter_by(id=item_id).one()
-    all_categories = db_session.query(Category).order_by(asc(Category.name))
     if request.method == 'POST':
         with store_context(local_storage):
             db_session.delete(delete_me)
             db_session.commit()
+            catalog_changed()
             flash('item Item Successfully Deleted')
             return redirect(url_for('show_items',
-                                    category_id=category_id,
-                                    categories=all_categories))
+                                    category_id=category_id))
     else:
-        return render_template('delete_item.html', item=delete_me)
+        return render_template('delete_item.html', item=delete_me,
+                               categories=get_sidebar_categories())
 
 
 # json dump of item
@@ -125,6 +125,5 @@ def single_item(category_id, item_id):
         return render_template('single_item.html',
                                category_id=category_id,
                                item=item,
-                               categories=db_session.
-                               query(Category).order_by(asc(Category.name)),
+                               categories=get_sidebar_categories(),
                                username=username)
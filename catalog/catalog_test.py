@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+#
+# Test cases for the catalog app, run against a throwaway SQLite database:
+#
+#     python catalog_test.py
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+DATABASE_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(DATABASE_DIR,
+                                                         'catalog.db')
+
+# The category and item views only; signing in through Google or Facebook
+# needs their client secrets, which a test run has no use for
+import app.category
+from app import app, db_session, engine
+from app.cache import catalog_changed, get_sidebar_categories
+from database_setup import Base, User, Category, CategoryItem, \
+    THUMBNAIL_WIDTH, local_storage
+from sqlalchemy import event
+from sqlalchemy_imageattach.entity import store_context
+
+app.secret_key = 'catalog_test'
+local_storage.path = os.path.join(DATABASE_DIR, 'images')
+
+
+def reset():
+    """Empty every table and drop the cached catalog."""
+    for table in reversed(Base.metadata.sorted_tables):
+        db_session.execute(table.delete())
+    db_session.commit()
+    db_session.remove()
+    catalog_changed()
+
+
+def seed(categories, items):
+    """Add a user owning categories of items, each item with an original
+    picture and a thumbnail, straight to the database. Returns the user id.
+    The pictures are stored with their size given, so they need not be
+    actual images."""
+    user = User(name='Tester', email='tester@example.com')
+    db_session.add(user)
+    with store_context(local_storage):
+        for category_number in range(categories):
+            category = Category(name='Category %d' % category_number,
+                                user=user)
+            db_session.add(category)
+            for item_number in range(items):
+                item = CategoryItem(name='Item %d' % item_number,
+                                    description='Item %d of category %d' %
+                                                (item_number, category_number),
+                                    category=category, user=user)
+                db_session.add(item)
+                item.picture.from_raw_file(io.BytesIO(b'original'),
+                                           size=(1200, 900),
+                                           mimetype='image/png')
+                item.picture.from_raw_file(io.BytesIO(b'thumbnail'),
+                                           size=(THUMBNAIL_WIDTH, 225),
+                                           mimetype='image/png',
+                                           original=False)
+        db_session.commit()
+    user_id = user.id
+    db_session.remove()
+    # The views bump the catalog version on every change; this bypassed them
+    catalog_changed()
+    return user_id
+
+
+def logged_in(user_id):
+    """Return a test client logged in as the given user."""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['username'] = 'Tester'
+        session['email'] = 'tester@example.com'
+        session['user_id'] = user_id
+    return client
+
+
+def queries(function):
+    """Call function and return the SQL statements it ran."""
+    statements = []
+
+    def record(connection, cursor, statement, parameters, context,
+               executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        function()
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return statements
+
+
+def category_names():
+    names = [category.name for category in db_session.query(Category)]
+    db_session.remove()
+    return names
+
+
+def sidebar_names():
+    names = [category.name for category in get_sidebar_categories()]
+    db_session.remove()
+    return names
+
+
+def test_concurrent_requests():
+    reset()
+    user_id = seed(3, 2)
+    category_id = db_session.query(Category.id).first()[0]
+    db_session.remove()
+    failures = []
+
+    def browse(number):
+        client = logged_in(user_id)
+        # Logged in as a user that is gone, so creating a category fails
+        # half way, after its row was flushed
+        ghost = logged_in(user_id + 1000)
+        try:
+            for round_number in range(5):
+                for url in ('/', '/catalog/json', '/catalog/xml',
+                            '/category/%d/items/' % category_id):
+                    status = client.get(url).status_code
+                    if status != 200:
+                        failures.append((url, status))
+                status = client.post('/category/new/', data={
+                    'name': 'Thread %d.%d' % (number, round_number)
+                }).status_code
+                if status != 302:
+                    failures.append(('new category', status))
+                status = ghost.post('/category/new/',
+                                    data={'name': 'Ghost'}).status_code
+                if status != 500:
+                    failures.append(('ghost category', status))
+        except Exception as e:
+            failures.append(e)
+
+    threads = [threading.Thread(target=browse, args=(number,))
+               for number in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if failures:
+        raise ValueError("Concurrent requests should each get a working "
+                         "session of their own: %r" % (failures[:5],))
+    names = category_names()
+    if 'Ghost' in names or len(names) != 3 + 8 * 5:
+        raise ValueError("A failed request should roll back what it wrote, "
+                         "and only that.")
+    print("1. Concurrent requests each get a session of their own.")
+
+
+def test_dump_queries():
+    client = app.test_client()
+    counts = []
+    for categories in (4, 40):
+        reset()
+        seed(categories, 3)
+        for url in ('/catalog/json', '/catalog/xml'):
+            statements = queries(lambda: client.get(url))
+            counts.append((url, len(statements)))
+    if counts[:2] != counts[2:]:
+        raise ValueError("Dumping the catalog should take as many queries "
+                         "however large it is: %r" % (counts,))
+    print("2. The catalog is dumped with a constant number of queries.")
+
+
+def test_streamed_dump():
+    reset()
+    user_id = seed(3, 4)
+    db_session.add(Category(name='Empty', user_id=user_id))
+    db_session.commit()
+    db_session.remove()
+    catalog_changed()
+    client = app.test_client()
+    for url, parse in (('/catalog/json', json.loads),
+                       ('/catalog/xml', lambda data: data)):
+        streamed = client.get(url + '?stream=1')
+        built = client.get(url)
+        if streamed.status_code != 200 or 'ETag' in streamed.headers:
+            raise ValueError("?stream=1 should stream the dump.")
+        if parse(streamed.data) != parse(built.data) or \
+                streamed.mimetype != built.mimetype:
+            raise ValueError("The streamed dump should be the dump built "
+                             "in one go.")
+    print("3. The streamed catalog dump is the one built in one go.")
+
+
+def test_cached_dump():
+    reset()
+    user_id = seed(2, 2)
+    client = logged_in(user_id)
+    first = client.get('/catalog/json')
+    etag = first.headers.get('ETag')
+    if not etag:
+        raise ValueError("The catalog dump should carry an ETag.")
+    if queries(lambda: client.get('/catalog/json')):
+        raise ValueError("An unchanged catalog should be dumped from the "
+                         "cache.")
+    if client.get('/catalog/json', headers={
+            'If-None-Match': etag}).status_code != 304:
+        raise ValueError("A client with the current dump should get a 304.")
+    catalog_changed()
+    rebuilt = []
+    statements = queries(lambda: rebuilt.append(client.get(
+        '/catalog/json', headers={'If-None-Match': etag})))
+    if not statements or rebuilt[0].status_code != 304:
+        raise ValueError("catalog_changed() should drop the cached dump, "
+                         "and an identical one keep its ETag.")
+    client.post('/category/new/', data={'name': 'Fresh'})
+    changed = client.get('/catalog/json', headers={'If-None-Match': etag})
+    if changed.status_code != 200 or b'Fresh' not in changed.data or \
+            changed.headers.get('ETag') == etag:
+        raise ValueError("Changing the catalog should change the dump and "
+                         "its ETag.")
+    print("4. Catalog dumps are cached with an ETag until the catalog "
+          "changes.")
+
+
+def test_cached_sidebar():
+    reset()
+    user_id = seed(2, 1)
+    db_session.add(Category(name='Empty', user_id=user_id))
+    db_session.commit()
+    empty_id = db_session.query(Category.id).filter_by(name='Empty').one()[0]
+    category_id, item_id = db_session.query(CategoryItem.category_id,
+                                            CategoryItem.id).first()
+    db_session.remove()
+    catalog_changed()
+    client = logged_in(user_id)
+    pages = ['/', '/category/new/', '/category/%d/items/' % category_id,
+             '/category/%d/item/%d' % (category_id, item_id),
+             '/category/%d/item/%d/edit' % (category_id, item_id)]
+
+    def sidebar_queries(urls):
+        def get():
+            for url in urls:
+                if client.get(url).status_code != 200:
+                    raise ValueError("%s should render." % url)
+        return len([statement for statement in queries(get)
+                    if 'ORDER BY category.name' in statement])
+
+    if sidebar_queries(pages) != 1 or sidebar_queries(pages):
+        raise ValueError("Pages should share one sidebar query per catalog "
+                         "change.")
+    client.post('/category/%d/edit/' % empty_id, data={'name': 'Renamed'})
+    if sidebar_queries(['/']) != 1 or 'Renamed' not in sidebar_names():
+        raise ValueError("Editing a category should refresh the sidebar.")
+    client.post('/category/%d/delete/' % empty_id)
+    if 'Renamed' in sidebar_names():
+        raise ValueError("Deleting a category should refresh the sidebar.")
+    print("5. The category sidebar is cached until the catalog changes.")
+
+
+def run_tests():
+    test_concurrent_requests()
+    test_dump_queries()
+    test_streamed_dump()
+    test_cached_dump()
+    test_cached_sidebar()
+
+
+if __name__ == '__main__':
+    try:
+        run_tests()
+    finally:
+        shutil.rmtree(DATABASE_DIR)
+    print("Success!  All tests pass!")
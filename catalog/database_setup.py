@@ -8,6 +8,7 @@ from sqlalchemy_imageattach.stores.fs import FileSystemStore
 import os
 
 UPLOADED_PHOTOS_DEST = '/app/app/static/images'
+THUMBNAIL_WIDTH = 300
 local_storage = FileSystemStore(path=UPLOADED_PHOTOS_DEST,
                                 base_url='/static/images')
 
@@ -37,7 +38,8 @@ class Category(Base):
     name = Column(String(250), nullable=False)
     user_id = Column(Integer, ForeignKey('user.id'))
     user = relationship(User)
-    items = relationship("CategoryItem", cascade="all, delete, delete-orphan")
+    items = relationship("CategoryItem", cascade="all, delete, delete-orphan",
+                         order_by="CategoryItem.id")
     added = Column(DateTime, default=func.now())
 
     @property
@@ -66,13 +68,21 @@ class CategoryItem(Base):
     def serialize(self):
         """Return object data in easily serializable format"""
         with store_context(local_storage):
-            return {
-                'name': self.name,
-                'description': self.description,
-                'id': self.id,
-                'picture': self.picture.locate(),
-                'thumbnail': self.picture.find_thumbnail(width=300).locate()
-            }
+            return self.serialize_pictures(
+                self.picture.require_original(),
+                self.picture.find_thumbnail(width=THUMBNAIL_WIDTH))
+
+    def serialize_pictures(self, picture, thumbnail):
+        """Return object data in easily serializable format, given the
+        original and thumbnail ItemPicture, e.g. loaded for many items at
+        once"""
+        return {
+            'name': self.name,
+            'description': self.description,
+            'id': self.id,
+            'picture': picture.locate(local_storage),
+            'thumbnail': thumbnail.locate(local_storage)
+        }
 
 
 class ItemPicture(Base, Image):
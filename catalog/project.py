@@ -8,4 +8,5 @@ import os
 
 if __name__ == '__main__':
     app.secret_key = 'super_secret_key'
-    app.run(host='0.0.0.0', port=int(os.getenv("PORT")), debug=True)
+    app.run(host='0.0.0.0', port=int(os.getenv("PORT")), debug=True,
+            threaded=True)
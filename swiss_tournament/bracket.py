@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+#
+# bracket.py -- playoff bracket engine behind tournament.createBracket()
+#
+# A bracket is fully determined by its format and the number of seeds, so
+# only the seeds are stored; the matches are generated here whenever they
+# are needed, and filled in from the reported results. Every match is a
+# (number, stage, round, home, away) tuple whose home and away slots are
+# ('seed', index into the seeds), ('winner', match number) or
+# ('loser', match number). Matches come ordered by round, and a match only
+# draws on matches of earlier rounds.
+#
+# Elimination brackets are padded to a power of two with byes, handed to
+# the top seeds, and seeded so the top seeds meet as late as possible. The
+# double elimination grand final is replayed when the losers bracket
+# champion wins it. Round-robin schedules follow the circle method; with
+# an odd number of seeds somebody sits out every round.
+
+SINGLE = 'single'
+DOUBLE = 'double'
+ROUND_ROBIN = 'round_robin'
+FORMATS = (SINGLE, DOUBLE, ROUND_ROBIN)
+
+# Stages of a bracket's matches
+WINNERS = 'winners'
+LOSERS = 'losers'
+FINAL = 'final'
+RESET = 'reset'
+
+# Slot resolving to no player: the other side of the match has a bye
+_NOBODY = object()
+
+
+# noinspection PyPep8Naming
+def seedPositions(size):
+    """Seed indexes in bracket order for a bracket of size slots, a power
+    of two, e.g. [0, 7, 3, 4, 1, 6, 2, 5] for 8."""
+    order = [0]
+    while len(order) < size:
+        count = len(order) * 2
+        order = [seed for top in order for seed in (top, count - 1 - top)]
+    return order
+
+
+def _pairUp(slots, stage, matches):
+    """Pair neighbouring slots into new matches of the given stage, and
+    return the slots of their winners and of their losers."""
+    winners = []
+    losers = []
+    for index in range(0, len(slots), 2):
+        matches.append((stage, slots[index], slots[index + 1]))
+        winners.append(('winner', len(matches)))
+        losers.append(('loser', len(matches)))
+    return winners, losers
+
+
+def _knockout(count, matches):
+    """Add a winners bracket for count seeds to matches. Returns the slot
+    of its champion and the slots of the losers of each of its rounds."""
+    size = 2
+    while size < count:
+        size *= 2
+    slots = [('seed', seed) for seed in seedPositions(size)]
+    losers = []
+    while len(slots) > 1:
+        slots, round_losers = _pairUp(slots, WINNERS, matches)
+        losers.append(round_losers)
+    return slots[0], losers
+
+
+def _scheduled(matches):
+    """Number and schedule (stage, home, away) matches: a match is played
+    the round after the latest of the matches it draws on. Returns them as
+    bracket tuples, ordered by round."""
+    rounds = []
+    for _, home, away in matches:
+        rounds.append(1 + max(rounds[slot[1] - 1] if slot[0] != 'seed' else 0
+                              for slot in (home, away)))
+    order = sorted(range(len(matches)), key=lambda index: rounds[index])
+    numbers = dict((index + 1, number + 1)
+                   for number, index in enumerate(order))
+
+    def renumbered(slot):
+        if slot[0] == 'seed':
+            return slot
+        return slot[0], numbers[slot[1]]
+
+    return [(number + 1, matches[index][0], rounds[index],
+             renumbered(matches[index][1]), renumbered(matches[index][2]))
+            for number, index in enumerate(order)]
+
+
+# noinspection PyPep8Naming
+def singleElimination(count):
+    """The matches of a single elimination bracket for count seeds."""
+    matches = []
+    _knockout(count, matches)
+    return _scheduled(matches)
+
+
+# noinspection PyPep8Naming
+def doubleElimination(count):
+    """The matches of a double elimination bracket for count seeds."""
+    matches = []
+    champion, losers = _knockout(count, matches)
+    if len(losers) == 1:
+        survivor = losers[0][0]
+    else:
+        slots, _ = _pairUp(losers[0], LOSERS, matches)
+        for index, dropped in enumerate(losers[1:]):
+            # Alternate the order losers drop in, to put off rematches
+            if index % 2 == 0:
+                dropped = dropped[::-1]
+            slots, _ = _pairUp([slot for pair in zip(slots, dropped)
+                                for slot in pair], LOSERS, matches)
+            if len(slots) > 1:
+                slots, _ = _pairUp(slots, LOSERS, matches)
+        survivor = slots[0]
+    matches.append((FINAL, champion, survivor))
+    final = len(matches)
+    matches.append((RESET, ('winner', final), ('loser', final)))
+    return _scheduled(matches)
+
+
+# noinspection PyPep8Naming
+def roundRobin(count):
+    """Yields the matches of a round-robin schedule for count seeds, in
+    which every seed meets every other once."""
+    seeds = list(range(count))
+    if count % 2:
+        seeds.append(None)
+    number = 0
+    for round_number in range(1, len(seeds)):
+        for index in range(len(seeds) // 2):
+            home, away = seeds[index], seeds[-1 - index]
+            if home is not None and away is not None:
+                number += 1
+                yield (number, ROUND_ROBIN, round_number,
+                       ('seed', home), ('seed', away))
+        # Keep the first seed in place and rotate everybody else
+        seeds.insert(1, seeds.pop())
+
+
+# noinspection PyPep8Naming
+def schedule(bracket_format, count):
+    """The matches of a bracket of the given format, one of FORMATS, for
+    count seeds; an iterable ordered by round."""
+    if bracket_format == SINGLE:
+        return singleElimination(count)
+    if bracket_format == DOUBLE:
+        return doubleElimination(count)
+    if bracket_format == ROUND_ROBIN:
+        return roundRobin(count)
+    raise ValueError("unknown bracket format %r" % (bracket_format,))
+
+
+# noinspection PyPep8Naming
+def roundCount(bracket_format, count):
+    """Number of rounds a bracket of the given format takes."""
+    if bracket_format == ROUND_ROBIN:
+        return count - 1 if count % 2 == 0 else count
+    return schedule(bracket_format, count)[-1][2]
+
+
+# noinspection PyPep8Naming
+def resolve(matches, seeds, results):
+    """Fills in the players and winners of a bracket's matches.
+
+    Args:
+      matches: the bracket's matches, see schedule()
+      seeds: player ids, best seed first
+      results: dict mapping (round, lower player id, higher player id) to
+        the (winner, result) of every reported match; draws and byes do
+        not decide elimination matches
+
+    Yields:
+      A (number, stage, round, home, away, winner, decided) tuple per
+      match. home and away are player ids, or None while unknown or for a
+      bye; winner is None until the match is decided, which a bye is
+      without being played, and for a drawn round-robin match.
+    """
+    winners = {}
+    losers = {}
+    home_won = {}
+
+    def player(slot):
+        kind, reference = slot
+        if kind == 'seed':
+            return seeds[reference] if reference < len(seeds) else _NOBODY
+        return (winners if kind == 'winner' else losers).get(reference)
+
+    for number, stage, round_number, home, away in matches:
+        first, second = player(home), player(away)
+        winner = loser = None
+        decided = False
+        if first is _NOBODY or second is _NOBODY:
+            winner = second if first is _NOBODY else first
+            loser = _NOBODY
+            decided = winner is not None
+        elif first is not None and second is not None:
+            if stage == RESET and home_won[home[1]]:
+                # The winners bracket champion took the grand final, so
+                # the replay is not played
+                second = loser = _NOBODY
+                winner, decided = first, True
+            else:
+                reported = results.get(
+                    (round_number, min(first, second), max(first, second)))
+                if stage == ROUND_ROBIN:
+                    decided = reported is not None
+                    if decided and reported[1] != 'draw':
+                        winner = reported[0]
+                elif reported is not None and reported[1] in ('win',
+                                                              'forfeit'):
+                    winner, decided = reported[0], True
+                    loser = second if winner == first else first
+        if stage != ROUND_ROBIN:
+            winners[number] = winner
+            losers[number] = loser
+            home_won[number] = decided and winner == first
+        yield (number, stage, round_number,
+               None if first is _NOBODY else first,
+               None if second is _NOBODY else second,
+               None if winner is _NOBODY else winner, decided)
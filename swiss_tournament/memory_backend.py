@@ -0,0 +1,443 @@
+#!/usr/bin/env python
+#
+# memory_backend.py -- in-memory storage backend for tournament.py
+#
+# Keeps tournaments, players and matches in plain Python objects so the
+# tournament functions run without a database, e.g. for simulations:
+#
+#     tournament.setBackend(memory_backend.MemoryBackend())
+#
+# Results mirror the PostgreSQL backend; standings ties that the database
+# leaves in arbitrary order are broken by player id.
+
+import csv
+import itertools
+
+import bracket
+import pairing
+import rating
+from tournament import (_bracketMatches, _bracketPairings, _pairKey,
+                        _resultError, _sameResult, _submittedBefore)
+
+
+class _Tournament(object):
+    __slots__ = ('id', 'name', 'information', 'points', 'rating_system',
+                 'players', 'matches', 'rounds', 'pairings', 'submissions',
+                 'bracket', 'archived')
+
+    def __init__(self, tournament_id, name, information, points,
+                 rating_system):
+        self.id = tournament_id
+        self.name = name
+        self.information = information
+        # result -> (winner points, loser points)
+        self.points = points
+        self.rating_system = rating_system
+        self.players = []
+        # (id, winner, loser, result, rating period, round) tuples in the
+        # order they were reported
+        self.matches = []
+        # Number of the latest round, 0 before the first one
+        self.rounds = 0
+        # (round, pairing) -> match, see tournament._pairKey()
+        self.pairings = {}
+        # submission key -> match, see tournament.reportMatch()
+        self.submissions = {}
+        # (format, seeds, first round) once createBracket() was called
+        self.bracket = None
+        # Set by archiveTournament(), which drops the matches
+        self.archived = False
+
+
+class _Player(object):
+    __slots__ = ('id', 'tournament', 'name', 'wins', 'matches', 'points',
+                 'results', 'byes', 'rating')
+
+    def __init__(self, player_id, tournament, name):
+        self.id = player_id
+        self.tournament = tournament
+        self.name = name
+        self.wins = 0
+        self.matches = 0
+        self.points = 0
+        # (opponent id, share of the game won) per match; no byes
+        self.results = []
+        self.byes = 0
+        # (rating, deviation, volatility), see rating.py
+        self.rating = rating.INITIAL
+
+
+class MemoryBackend(object):
+    """Stores tournaments in memory. Implements the tournament functions
+    routed by tournament.setBackend() with the same signatures."""
+
+    def __init__(self):
+        self._tournaments = {}
+        self._players = {}
+        self._ids = itertools.count(1)
+        self._periods = itertools.count(1)
+
+    def _tournament(self, tournament_id):
+        if tournament_id is None:
+            if len(self._tournaments) != 1:
+                raise ValueError("tournament_id is required unless exactly "
+                                 "one tournament exists")
+            return next(iter(self._tournaments.values()))
+        return self._tournaments[tournament_id]
+
+    def _selected(self, tournament_id):
+        """The given tournament, or all of them when none is given."""
+        if tournament_id is None:
+            return list(self._tournaments.values())
+        return [self._tournaments[tournament_id]]
+
+    def _live(self, tournament_id):
+        """Like _selected(), without the archived tournaments."""
+        return [tournament for tournament in self._selected(tournament_id)
+                if not tournament.archived]
+
+    def createTournament(self, name, info, win_points=1, draw_points=0.5,
+                         loss_points=0, bye_points=1,
+                         rating_system=rating.ELO):
+        if rating_system not in rating.SYSTEMS:
+            raise ValueError("unknown rating system %r" % (rating_system,))
+        tournament_id = next(self._ids)
+        self._tournaments[tournament_id] = _Tournament(
+            tournament_id, name, info,
+            {'win': (win_points, loss_points),
+             'forfeit': (win_points, loss_points),
+             'draw': (draw_points, draw_points),
+             'bye': (bye_points, None)}, rating_system)
+        return tournament_id
+
+    def deleteTournaments(self, tournament_id=None):
+        for tournament in self._selected(tournament_id):
+            if tournament.players:
+                raise ValueError("tournament %s still has players" %
+                                 tournament.id)
+            del self._tournaments[tournament.id]
+
+    def archiveTournament(self, tournament_id=None):
+        tournament = self._tournament(tournament_id)
+        if tournament.archived:
+            raise ValueError("tournament %s does not exist or is archived "
+                             "already" % tournament.id)
+        tournament.archived = True
+        tournament.matches = []
+        tournament.pairings = {}
+        tournament.submissions = {}
+
+    @staticmethod
+    def _resetStandings(tournament):
+        tournament.matches = []
+        tournament.pairings = {}
+        for player in tournament.players:
+            player.wins = player.matches = player.points = player.byes = 0
+            player.results = []
+
+    def deleteMatches(self, tournament_id=None):
+        for tournament in self._live(tournament_id):
+            self._resetStandings(tournament)
+            tournament.submissions = {}
+            tournament.rounds = 0
+            tournament.bracket = None
+            for player in tournament.players:
+                player.rating = rating.INITIAL
+
+    def deletePlayers(self, tournament_id=None):
+        for tournament in self._selected(tournament_id):
+            if tournament.matches:
+                raise ValueError("players of tournament %s still have "
+                                 "matches" % tournament.id)
+            for player in tournament.players:
+                del self._players[player.id]
+            tournament.players = []
+
+    def countPlayers(self, tournament_id=None):
+        return sum(len(tournament.players)
+                   for tournament in self._selected(tournament_id))
+
+    def registerPlayer(self, name, tournament_id=None):
+        tournament = self._tournament(tournament_id)
+        player = _Player(next(self._ids), tournament, name)
+        tournament.players.append(player)
+        self._players[player.id] = player
+        return player.id
+
+    def registerPlayers(self, names, tournament_id=None):
+        if hasattr(names, 'read'):
+            names = (row[0] for row in csv.reader(names) if row)
+        tournament = self._tournament(tournament_id)
+        return [self.registerPlayer(name, tournament.id) for name in names]
+
+    def _ranked(self, tournament):
+        """Players best placed first, with their opponent points."""
+        players = self._players
+        ranked = []
+        for player in tournament.players:
+            opponent_points = sum(players[opponent].points
+                                  for opponent, _ in player.results)
+            ranked.append((-player.points, -opponent_points,
+                           -player.rating[0], player.id, player))
+        ranked.sort()
+        return [(row[4], -row[1]) for row in ranked]
+
+    def playerStandings(self, tournament_id=None):
+        return [(player.id, player.name, player.wins, player.matches)
+                for player, _ in self._ranked(self._tournament(tournament_id))]
+
+    def iterStandings(self, tournament_id=None, chunk_size=1000):
+        tournaments = sorted(self._selected(tournament_id),
+                             key=lambda tournament: tournament.id)
+        for tournament in tournaments:
+            for player, _ in self._ranked(tournament):
+                yield (tournament.id, player.id, player.name, player.wins,
+                       player.matches, player.points)
+
+    def playerTiebreakers(self, tournament_id=None):
+        tournament = self._tournament(tournament_id)
+        win_points = tournament.points['win'][0]
+        players = self._players
+        rows = []
+        for player in tournament.players:
+            omw = buchholz = sonneborn_berger = 0
+            for opponent_id, share in player.results:
+                opponent = players[opponent_id]
+                if opponent.matches and win_points:
+                    omw += max(opponent.points /
+                               float(opponent.matches * win_points), 1 / 3.0)
+                else:
+                    omw += 1 / 3.0
+                buchholz += opponent.points
+                sonneborn_berger += share * opponent.points
+            if player.results:
+                omw /= len(player.results)
+            rows.append((player.id, player.name, player.wins, player.matches,
+                         player.points, omw, buchholz, sonneborn_berger))
+        rows.sort(key=lambda row: (-row[4], -row[5], -row[6], -row[7],
+                                   row[0]))
+        return rows
+
+    def playerRatings(self, tournament_id=None):
+        players = sorted(self._tournament(tournament_id).players,
+                         key=lambda player: (-player.rating[0], player.id))
+        return [(player.id, player.name) + player.rating[:2]
+                for player in players]
+
+    def rebuildStandings(self, tournament_id=None):
+        for tournament in self._live(tournament_id):
+            matches = tournament.matches
+            self._resetStandings(tournament)
+            for match in matches:
+                self._record(tournament, *match)
+
+    def rebuildRatings(self, tournament_id=None):
+        for tournament in self._live(tournament_id):
+            states = rating.replay(
+                tournament.rating_system,
+                ((period, winner, loser, result)
+                 for _, winner, loser, result, period, _
+                 in tournament.matches))
+            for player in tournament.players:
+                player.rating = states.get(player.id, rating.INITIAL)
+
+    def checkStandings(self, tournament_id=None):
+        mismatches = []
+        for tournament in self._live(tournament_id):
+            # Replay the matches into a scratch backend and compare
+            replay = MemoryBackend()
+            copy = _Tournament(tournament.id, tournament.name,
+                               tournament.information, tournament.points,
+                               tournament.rating_system)
+            replay._tournaments[copy.id] = copy
+            for player in tournament.players:
+                replayed = _Player(player.id, copy, player.name)
+                copy.players.append(replayed)
+                replay._players[replayed.id] = replayed
+            for match in tournament.matches:
+                replay._record(copy, *match)
+            expected = dict((player.id, (player.wins, player.matches,
+                                         player.points, opponent_points))
+                            for player, opponent_points
+                            in replay._ranked(copy))
+            for player, opponent_points in self._ranked(tournament):
+                stored = (player.wins, player.matches, player.points,
+                          opponent_points)
+                if stored != expected[player.id]:
+                    mismatches.append((player.id, stored, expected[player.id]))
+        return mismatches
+
+    def _record(self, tournament, match_id, winner, loser, result, period,
+                round_number):
+        match = (match_id, winner, loser, result, period, round_number)
+        tournament.matches.append(match)
+        if round_number is not None:
+            tournament.pairings[
+                (round_number,) + _pairKey(winner, loser)] = match
+        winner_points, loser_points = tournament.points[result]
+        first = self._players[winner]
+        first.matches += 1
+        first.points += winner_points
+        if result != 'draw':
+            first.wins += 1
+        if loser is None:
+            first.byes += 1
+            return
+        second = self._players[loser]
+        second.matches += 1
+        second.points += loser_points
+        share = 0.5 if result == 'draw' else 1
+        first.results.append((loser, share))
+        second.results.append((winner, 1 - share))
+
+    def startRound(self, tournament_id=None):
+        tournament = self._tournament(tournament_id)
+        tournament.rounds += 1
+        return tournament.rounds
+
+    @staticmethod
+    def _round(tournament, round_number):
+        if tournament.archived:
+            raise ValueError("tournament %s is archived" % tournament.id)
+        if round_number is None:
+            return tournament.rounds or None
+        if not 1 <= round_number <= tournament.rounds:
+            raise ValueError("round %s has not been started" % round_number)
+        return round_number
+
+    @staticmethod
+    def _reportedBefore(tournament, round_number, winner, loser, result):
+        # (match_id, error) for a pairing already reported in the round, or
+        # None when it was not
+        if round_number is None:
+            return None
+        match = tournament.pairings.get(
+            (round_number,) + _pairKey(winner, loser))
+        if match is None:
+            return None
+        if _sameResult(match, winner, loser, result):
+            return match[0], None
+        return None, "a different result was already reported for this pairing"
+
+    def reportMatch(self, winner, loser, tournament_id=None, result='win',
+                    round_number=None, submission=None):
+        tournament = self._tournament(tournament_id)
+        round_number = self._round(tournament, round_number)
+        error = _resultError(winner, loser, result,
+                             self._registered(tournament, (winner, loser)))
+        if error is not None:
+            raise ValueError(error)
+        if submission in tournament.submissions:
+            reported = _submittedBefore(tournament.submissions[submission],
+                                        winner, loser, result)
+        else:
+            reported = self._reportedBefore(tournament, round_number, winner,
+                                            loser, result)
+        if reported is not None:
+            if reported[1] is not None:
+                raise ValueError(reported[1])
+            return reported[0]
+        match_id = next(self._ids)
+        self._record(tournament, match_id, winner, loser, result,
+                     next(self._periods), round_number)
+        if submission is not None:
+            tournament.submissions[submission] = tournament.matches[-1]
+        self._rate(tournament, [(winner, loser, result)])
+        return match_id
+
+    def _rate(self, tournament, results):
+        # Rate one period of (winner, loser, result) tuples
+        games = list(rating.ratedGames(results))
+        if not games:
+            return
+        players = self._players
+        states = dict((player, players[player].rating)
+                      for game in games for player in game[:2])
+        for player, state in rating.ratePeriod(
+                tournament.rating_system, states, games).items():
+            players[player].rating = state
+
+    def _registered(self, tournament, player_ids):
+        return set(player_id for player_id in player_ids
+                   if player_id in self._players and
+                   self._players[player_id].tournament is tournament)
+
+    def reportMatches(self, results, tournament_id=None, round_number=None):
+        tournament = self._tournament(tournament_id)
+        round_number = self._round(tournament, round_number)
+        results = [tuple(row) if len(row) == 3 else tuple(row) + ('win',)
+                   for row in results]
+        registered = self._registered(
+            tournament, set(player for row in results for player in row[:2]))
+        period = next(self._periods)
+        outcomes = []
+        rated = []
+        for winner, loser, result in results:
+            error = _resultError(winner, loser, result, registered)
+            if error is not None:
+                outcomes.append((None, error))
+                continue
+            reported = self._reportedBefore(tournament, round_number, winner,
+                                            loser, result)
+            if reported is not None:
+                outcomes.append(reported)
+                continue
+            match_id = next(self._ids)
+            self._record(tournament, match_id, winner, loser, result, period,
+                         round_number)
+            rated.append((winner, loser, result))
+            outcomes.append((match_id, None))
+        self._rate(tournament, rated)
+        return outcomes
+
+    def swissPairings(self, tournament_id=None):
+        tournament = self._tournament(tournament_id)
+        ranked = self._ranked(tournament)
+        history = dict((player.id, set(opponent for opponent, _
+                                       in player.results))
+                       for player, _ in ranked)
+        byes = set(player.id for player, _ in ranked if player.byes)
+        pairs, bye = pairing.pairPlayers(
+            [(player.id, player.points) for player, _ in ranked],
+            history, byes)
+        players = self._players
+        pairings = [(first, players[first].name, second, players[second].name)
+                    for first, second in pairs]
+        if bye is not None:
+            pairings.append((bye, players[bye].name, None, None))
+        return pairings
+
+    def createBracket(self, bracket_format, size=None, tournament_id=None):
+        if bracket_format not in bracket.FORMATS:
+            raise ValueError("unknown bracket format %r" % (bracket_format,))
+        tournament = self._tournament(tournament_id)
+        seeds = [player.id for player, _ in self._ranked(tournament)][:size]
+        if len(seeds) < 2:
+            raise ValueError("a bracket needs at least two players")
+        if tournament.bracket is not None:
+            raise ValueError("tournament %s already has a bracket" %
+                             tournament.id)
+        first_round = tournament.rounds + 1
+        tournament.rounds += bracket.roundCount(bracket_format, len(seeds))
+        tournament.bracket = (bracket_format, seeds, first_round)
+        return first_round
+
+    @staticmethod
+    def _bracketMatches(tournament):
+        if tournament.bracket is None:
+            raise ValueError("tournament %s has no bracket" % tournament.id)
+        bracket_format, seeds, first_round = tournament.bracket
+        return _bracketMatches(
+            bracket_format, seeds, first_round,
+            [(match[5],) + match[1:4] for match in tournament.matches
+             if match[5] is not None and match[5] >= first_round])
+
+    def bracketMatches(self, tournament_id=None):
+        return list(self._bracketMatches(self._tournament(tournament_id)))
+
+    def bracketPairings(self, tournament_id=None):
+        players = self._players
+        return [(round_number, first, players[first].name, second,
+                 players[second].name)
+                for round_number, first, second in _bracketPairings(
+                    self._bracketMatches(self._tournament(tournament_id)))]
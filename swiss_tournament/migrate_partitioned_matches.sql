@@ -0,0 +1,283 @@
+-- Migrates a tournament database set up by an earlier tournament.sql, with
+-- a single matches table, to matches partitioned by tournament. Existing
+-- matches keep their ids, and the standings and ratings are untouched.
+--
+-- Run it once, from psql, with no tournament functions running:
+--
+--     \i migrate_partitioned_matches.sql
+--
+-- Everything happens in one transaction, so a failed migration leaves the
+-- database as it was.
+
+\c "tournament";
+
+BEGIN;
+
+-- schemas
+CREATE SCHEMA archive;
+
+
+-- tables
+ALTER TABLE tournaments ADD COLUMN archived boolean  NOT NULL DEFAULT false;
+
+-- The views and triggers would follow the old table through the rename
+DROP VIEW played_matches, won_matches, match_results;
+DROP TRIGGER matches_standings_insert ON matches;
+DROP TRIGGER matches_standings_delete ON matches;
+
+ALTER TABLE matches RENAME TO unpartitioned_matches;
+ALTER TABLE unpartitioned_matches
+    RENAME CONSTRAINT matches_pk TO unpartitioned_matches_pk;
+DROP INDEX matches_tournament_winner, matches_tournament_loser,
+    matches_round_pairing;
+
+-- Table: matches
+-- See tournament.sql. The id sequence of the old table carries on.
+CREATE TABLE matches (
+    id int  NOT NULL DEFAULT nextval('matches_id_seq'),
+    winner_id int  NOT NULL,
+    loser_id int  NULL,
+    tournament_id int  NOT NULL,
+    result text  NOT NULL DEFAULT 'win',
+    rating_period int  NOT NULL DEFAULT nextval('rating_periods'),
+    round int  NULL,
+    CONSTRAINT matches_pk PRIMARY KEY (tournament_id, id),
+    CONSTRAINT matches_result
+        CHECK (result IN ('win', 'draw', 'forfeit', 'bye')),
+    CONSTRAINT matches_bye CHECK ((result = 'bye') = (loser_id IS NULL))
+) PARTITION BY LIST (tournament_id);
+
+ALTER SEQUENCE matches_id_seq OWNED BY matches.id;
+
+DO $$
+DECLARE
+    tournament int;
+BEGIN
+    FOR tournament IN SELECT id FROM tournaments ORDER BY id LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF matches FOR VALUES IN (%s)',
+            'matches_' || tournament, tournament);
+    END LOOP;
+END;
+$$;
+
+-- Copied before the indexes and triggers exist, so the rows are neither
+-- indexed one at a time nor counted into the standings a second time
+INSERT INTO matches (id, winner_id, loser_id, tournament_id, result,
+                     rating_period, round)
+SELECT id, winner_id, loser_id, tournament_id, result, rating_period, round
+FROM unpartitioned_matches;
+
+DROP TABLE unpartitioned_matches;
+
+
+-- views
+-- View: played_matches
+CREATE VIEW played_matches AS
+select players.id, players.tournament_id, players.name,
+       count(matches.id) as total_count
+        from players left join matches
+            on matches.tournament_id = players.tournament_id
+                and (matches.winner_id = players.id
+                     or matches.loser_id = players.id)
+        group by players.id;
+
+
+-- View: won_matches
+CREATE VIEW won_matches AS
+select players.id, players.tournament_id, players.name,
+       count(matches.id) as win_count
+        from players left join matches
+             on matches.tournament_id = players.tournament_id
+                and matches.winner_id = players.id
+                and matches.result <> 'draw'
+        group by players.id;
+
+
+-- View: match_results
+CREATE VIEW match_results AS
+select matches.id as match_id, matches.tournament_id, matches.result,
+       matches.winner_id as player_id, matches.loser_id as opponent_id,
+       case matches.result when 'draw' then 0.5 else 1 end as share,
+       case matches.result when 'draw' then tournaments.draw_points
+                           when 'bye' then tournaments.bye_points
+                           else tournaments.win_points end as points
+        from matches join tournaments
+             on tournaments.id = matches.tournament_id
+union all
+select matches.id, matches.tournament_id, matches.result,
+       matches.loser_id, matches.winner_id,
+       case matches.result when 'draw' then 0.5 else 0 end,
+       case matches.result when 'draw' then tournaments.draw_points
+                           else tournaments.loss_points end
+        from matches join tournaments
+             on tournaments.id = matches.tournament_id
+        where matches.loser_id is not null;
+
+
+-- indexes
+CREATE INDEX matches_tournament_winner ON matches (tournament_id, winner_id);
+
+CREATE INDEX matches_tournament_loser ON matches (tournament_id, loser_id);
+
+CREATE UNIQUE INDEX matches_round_pairing
+    ON matches (tournament_id, round, least(winner_id, loser_id),
+                greatest(winner_id, loser_id));
+
+
+-- foreign keys
+ALTER TABLE matches ADD CONSTRAINT match_winner
+    FOREIGN KEY (winner_id)
+    REFERENCES players (id)
+    NOT DEFERRABLE
+;
+
+ALTER TABLE matches ADD CONSTRAINT match_loser
+    FOREIGN KEY (loser_id)
+    REFERENCES players (id)
+    NOT DEFERRABLE
+;
+
+ALTER TABLE matches ADD CONSTRAINT match_tournament
+    FOREIGN KEY (tournament_id)
+    REFERENCES tournaments (id)
+    NOT DEFERRABLE
+;
+
+ALTER TABLE matches ADD CONSTRAINT match_round
+    FOREIGN KEY (tournament_id, round)
+    REFERENCES rounds (tournament_id, number)
+    NOT DEFERRABLE
+;
+
+
+-- functions
+-- Function: refresh_standings
+-- Runs once per tournament involved, so the other matches partitions are
+-- pruned; with the tournament taken from standings they would all be read.
+CREATE OR REPLACE FUNCTION refresh_standings(changed int[])
+RETURNS void AS $$
+DECLARE
+    tournament int;
+BEGIN
+    FOR tournament IN
+        SELECT DISTINCT tournament_id FROM standings
+        WHERE player_id = ANY(changed)
+    LOOP
+        UPDATE standings
+        SET (wins, matches, points) = (
+            SELECT count(*) FILTER (WHERE share = 1), count(*),
+                   coalesce(sum(points), 0)
+            FROM match_results
+            WHERE tournament_id = tournament
+              AND player_id = standings.player_id)
+        WHERE tournament_id = tournament AND player_id = ANY(changed);
+
+        UPDATE standings
+        SET opponent_points = coalesce((
+            SELECT sum((SELECT points FROM standings opponent
+                        WHERE opponent.player_id = played.opponent_id))
+            FROM match_results played
+            WHERE tournament_id = tournament
+              AND player_id = standings.player_id), 0)
+        WHERE tournament_id = tournament
+          AND player_id = ANY(ARRAY(SELECT unnest(changed)
+                                    UNION
+                                    SELECT opponent_id FROM match_results
+                                    WHERE tournament_id = tournament
+                                      AND player_id = ANY(changed)));
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Function: rebuild_standings
+CREATE OR REPLACE FUNCTION rebuild_standings(tournament int)
+RETURNS void AS $$
+    INSERT INTO standings (player_id, tournament_id)
+    SELECT id, tournament_id FROM players
+    WHERE (tournament IS NULL OR tournament_id = tournament)
+      AND tournament_id NOT IN (SELECT id FROM tournaments WHERE archived)
+      AND id NOT IN (SELECT player_id FROM standings);
+
+    SELECT refresh_standings(array_agg(player_id))
+    FROM standings
+    WHERE (tournament IS NULL OR tournament_id = tournament)
+      AND tournament_id NOT IN (SELECT id FROM tournaments WHERE archived);
+$$ LANGUAGE sql;
+
+
+-- Function: archive_matches
+CREATE FUNCTION archive_matches(tournament int) RETURNS void AS $$
+DECLARE
+    partition text := 'matches_' || tournament;
+    foreign_key text;
+BEGIN
+    FOR foreign_key IN
+        SELECT conname FROM pg_constraint
+        WHERE conrelid = partition::regclass AND contype = 'f'
+    LOOP
+        EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I',
+                       partition, foreign_key);
+    END LOOP;
+    EXECUTE format('ALTER TABLE %I SET SCHEMA archive', partition);
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Function: matches_partition_create
+CREATE FUNCTION matches_partition_create() RETURNS trigger AS $$
+BEGIN
+    EXECUTE format('CREATE TABLE %I PARTITION OF matches FOR VALUES IN (%s)',
+                   'matches_' || NEW.id, NEW.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Function: matches_partition_drop
+CREATE FUNCTION matches_partition_drop() RETURNS trigger AS $$
+BEGIN
+    EXECUTE format('DROP TABLE IF EXISTS %I', 'matches_' || OLD.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Function: matches_archive_drop
+CREATE FUNCTION matches_archive_drop() RETURNS trigger AS $$
+BEGIN
+    EXECUTE format('DROP TABLE IF EXISTS archive.%I', 'matches_' || OLD.id);
+    DELETE FROM brackets WHERE tournament_id = OLD.id;
+    DELETE FROM rounds WHERE tournament_id = OLD.id;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- triggers
+CREATE TRIGGER matches_standings_insert
+    AFTER INSERT ON matches
+    REFERENCING NEW TABLE AS inserted_matches
+    FOR EACH STATEMENT EXECUTE PROCEDURE standings_matches_inserted();
+
+CREATE TRIGGER matches_standings_delete
+    AFTER DELETE ON matches
+    REFERENCING OLD TABLE AS deleted_matches
+    FOR EACH STATEMENT EXECUTE PROCEDURE standings_matches_deleted();
+
+CREATE TRIGGER tournaments_partition_create
+    AFTER INSERT ON tournaments
+    FOR EACH ROW EXECUTE PROCEDURE matches_partition_create();
+
+CREATE TRIGGER tournaments_partition_drop
+    AFTER DELETE ON tournaments
+    FOR EACH ROW EXECUTE PROCEDURE matches_partition_drop();
+
+CREATE TRIGGER tournaments_archive_drop
+    BEFORE DELETE ON tournaments
+    FOR EACH ROW WHEN (OLD.archived)
+    EXECUTE PROCEDURE matches_archive_drop();
+
+COMMIT;
+-- End of file.
@@ -0,0 +1,131 @@
+-- Migrates a tournament database set up by an earlier tournament.sql, whose
+-- standings triggers recomputed the standings under a per-tournament lock,
+-- to triggers adding each match to its two players' standings. The stored
+-- opponent_points column makes way for the opponent_points view.
+--
+-- Run it once, from psql, after migrate_partitioned_matches.sql if that
+-- one is needed too:
+--
+--     \i migrate_standings_deltas.sql
+--
+-- Everything happens in one transaction, so a failed migration leaves the
+-- database as it was.
+
+\c "tournament";
+
+BEGIN;
+
+-- functions
+-- Function: refresh_standings
+-- See tournament.sql; rebuild_standings() is unchanged.
+CREATE OR REPLACE FUNCTION refresh_standings(changed int[])
+RETURNS void AS $$
+DECLARE
+    tournament int;
+BEGIN
+    FOR tournament IN
+        SELECT DISTINCT tournament_id FROM standings
+        WHERE player_id = ANY(changed)
+    LOOP
+        UPDATE standings
+        SET (wins, matches, points) = (
+            SELECT count(*) FILTER (WHERE share = 1), count(*),
+                   coalesce(sum(points), 0)
+            FROM match_results
+            WHERE tournament_id = tournament
+              AND player_id = standings.player_id)
+        WHERE tournament_id = tournament AND player_id = ANY(changed);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Function: standings_matches_changed
+-- See tournament.sql. The triggers switch over before the old function,
+-- taking the changed players only, is dropped.
+CREATE FUNCTION standings_matches_changed(tournaments int[], winners int[],
+                                          losers int[], results text[],
+                                          direction int)
+RETURNS void AS $$
+BEGIN
+    PERFORM 1 FROM standings
+    WHERE player_id = ANY(winners || losers)
+    ORDER BY player_id
+    FOR UPDATE;
+
+    UPDATE standings
+    SET wins = standings.wins + direction * delta.wins,
+        matches = standings.matches + direction * delta.matches,
+        points = standings.points + direction * delta.points
+    FROM (
+        SELECT played.player_id,
+               count(*) FILTER (WHERE played.share = 1) AS wins,
+               count(*) AS matches, sum(played.points) AS points
+        FROM unnest(tournaments, winners, losers, results)
+            AS changed (tournament_id, winner_id, loser_id, result)
+        JOIN tournaments event ON event.id = changed.tournament_id
+        CROSS JOIN LATERAL (VALUES
+            (changed.winner_id,
+             CASE changed.result WHEN 'draw' THEN 0.5 ELSE 1 END,
+             CASE changed.result WHEN 'draw' THEN event.draw_points
+                                 WHEN 'bye' THEN event.bye_points
+                                 ELSE event.win_points END),
+            (changed.loser_id,
+             CASE changed.result WHEN 'draw' THEN 0.5 ELSE 0 END,
+             CASE changed.result WHEN 'draw' THEN event.draw_points
+                                 ELSE event.loss_points END))
+            AS played (player_id, share, points)
+        WHERE played.player_id IS NOT NULL
+        GROUP BY played.player_id
+    ) delta
+    WHERE standings.player_id = delta.player_id;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Function: standings_matches_inserted
+CREATE OR REPLACE FUNCTION standings_matches_inserted() RETURNS trigger AS $$
+BEGIN
+    PERFORM standings_matches_changed(
+        array_agg(tournament_id), array_agg(winner_id),
+        array_agg(loser_id), array_agg(result), 1)
+    FROM inserted_matches;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Function: standings_matches_deleted
+CREATE OR REPLACE FUNCTION standings_matches_deleted() RETURNS trigger AS $$
+BEGIN
+    PERFORM standings_matches_changed(
+        array_agg(tournament_id), array_agg(winner_id),
+        array_agg(loser_id), array_agg(result), -1)
+    FROM deleted_matches;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP FUNCTION standings_matches_changed(int[], int[]);
+
+
+-- tables
+DROP INDEX standings_rank;
+ALTER TABLE standings DROP COLUMN opponent_points;
+
+
+-- views
+-- View: opponent_points
+CREATE VIEW opponent_points AS
+select played.tournament_id, played.player_id,
+       sum(opponent.points) as points
+        from match_results played
+        join standings opponent on opponent.player_id = played.opponent_id
+        group by played.tournament_id, played.player_id;
+
+
+-- indexes
+CREATE INDEX standings_rank ON standings (tournament_id, points DESC);
+
+COMMIT;
+-- End of file.
@@ -0,0 +1,25 @@
+-- Migrates a tournament database set up by an earlier tournament.sql to
+-- matches that may carry the submission key of their report, see
+-- reportMatch(). Existing matches have none.
+--
+-- Run it once, from psql, after migrate_partitioned_matches.sql if that
+-- one is needed too:
+--
+--     \i migrate_submission_keys.sql
+--
+-- Everything happens in one transaction, so a failed migration leaves the
+-- database as it was.
+
+\c "tournament";
+
+BEGIN;
+
+-- tables
+ALTER TABLE matches ADD COLUMN submission text  NULL;
+
+
+-- indexes
+CREATE UNIQUE INDEX matches_submission ON matches (tournament_id, submission);
+
+COMMIT;
+-- End of file.
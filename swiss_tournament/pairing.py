@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+#
+# pairing.py -- Swiss pairing engine behind tournament.swissPairings()
+#
+# Players are paired score group by score group, best placed first. Inside
+# a group (plus anybody who floated down from the group above) a maximum
+# matching over the "have not met yet" graph is found with Edmonds' blossom
+# algorithm, seeded with the usual top half against bottom half pairing so
+# that an unavoidable float is the lowest placed player. Whoever is left over
+# floats down to the next group. If the bottom of the field cannot be paired
+# without rematches, groups are merged from the bottom up until it can.
+
+
+def _bracketMatching(pool, history):
+    """Maximum matching of the players in pool (best placed first) whose
+    edges are the pairs that have not met before.
+
+    Returns a list holding, for every index in pool, the index of its
+    partner or None.
+    """
+    size = len(pool)
+    conflicts = [history.get(player, ()) for player in pool]
+
+    def compatible(v, u):
+        return u != v and pool[u] not in conflicts[v]
+
+    # Top half against bottom half, then first compatible partner
+    match = [None] * size
+    half = size // 2
+    for top in range(half):
+        if compatible(top, half + top):
+            match[top], match[half + top] = half + top, top
+    for v in range(size):
+        if match[v] is None:
+            for u in range(v + 1, size):
+                if match[u] is None and compatible(v, u):
+                    match[v], match[u] = u, v
+                    break
+
+    def augment(root):
+        # Edmonds' blossom search for an augmenting path starting at root,
+        # flipping the matching along it when one is found
+        base = list(range(size))
+        parent = [None] * size
+        used = [False] * size
+        used[root] = True
+        queue = [root]
+
+        def lca(a, b):
+            seen = [False] * size
+            while True:
+                a = base[a]
+                seen[a] = True
+                if match[a] is None:
+                    break
+                a = parent[match[a]]
+            while True:
+                b = base[b]
+                if seen[b]:
+                    return b
+                b = parent[match[b]]
+
+        def markPath(v, blossom_base, child, blossom):
+            while base[v] != blossom_base:
+                blossom[base[v]] = blossom[base[match[v]]] = True
+                parent[v] = child
+                child = match[v]
+                v = parent[match[v]]
+
+        head = 0
+        while head < len(queue):
+            v = queue[head]
+            head += 1
+            for u in range(size):
+                if base[v] == base[u] or match[v] == u or \
+                        not compatible(v, u):
+                    continue
+                if u == root or (match[u] is not None and
+                                 parent[match[u]] is not None):
+                    blossom_base = lca(v, u)
+                    blossom = [False] * size
+                    markPath(v, blossom_base, u, blossom)
+                    markPath(u, blossom_base, v, blossom)
+                    for w in range(size):
+                        if blossom[base[w]]:
+                            base[w] = blossom_base
+                            if not used[w]:
+                                used[w] = True
+                                queue.append(w)
+                elif parent[u] is None:
+                    parent[u] = v
+                    if match[u] is None:
+                        while u is not None:
+                            previous = match[parent[u]]
+                            match[u], match[parent[u]] = parent[u], u
+                            u = previous
+                        return
+                    used[match[u]] = True
+                    queue.append(match[u])
+
+    for root in range(size):
+        if match[root] is None:
+            augment(root)
+    return match
+
+
+def _pairGroups(groups, history):
+    """Pair score groups top down. Returns (pairs, floaters) where floaters
+    are the players left unpaired at the bottom."""
+    pairs = []
+    floaters = []
+    for group in groups:
+        pool = floaters + group
+        match = _bracketMatching(pool, history)
+        floaters = []
+        for index, partner in enumerate(match):
+            if partner is None:
+                floaters.append(pool[index])
+            elif index < partner:
+                pairs.append((pool[index], pool[partner]))
+    return pairs, floaters
+
+
+# noinspection PyPep8Naming
+def pairPlayers(standings, history, byes=()):
+    """Pairs the players of the next round.
+
+    Args:
+      standings: list of (id, score) tuples, best placed player first
+      history: dict mapping a player id to the set of ids they already met
+      byes: ids of the players who already received a bye
+
+    Returns:
+      A tuple (pairs, bye): pairs is a list of (id1, id2) tuples, top board
+      first, and bye is the id of the player sitting out this round, or None
+      when the number of players is even. Rematches only happen when the
+      field cannot be paired otherwise.
+    """
+    standings = list(standings)
+    bye = None
+    if len(standings) % 2:
+        # The lowest placed player without a bye sits out
+        candidates = [row for row in reversed(standings)
+                      if row[0] not in byes] or [standings[-1]]
+        bye = candidates[0][0]
+        standings.remove(candidates[0])
+
+    groups = []
+    score = None
+    for player, player_score in standings:
+        if not groups or player_score != score:
+            groups.append([])
+            score = player_score
+        groups[-1].append(player)
+
+    # Nobody to pair when the bye took the only player
+    pairs, floaters = [], []
+    for merged in range(1, len(groups) + 1):
+        cut = len(groups) - merged
+        tail = [player for group in groups[cut:] for player in group]
+        pairs, floaters = _pairGroups(groups[:cut] + [tail], history)
+        if not floaters:
+            return pairs, bye
+
+    # Rematches are unavoidable, pair whoever is left in standings order
+    pairs.extend(zip(floaters[::2], floaters[1::2]))
+    return pairs, bye
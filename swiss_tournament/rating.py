@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+#
+# rating.py -- Elo and Glicko-2 rating engine behind tournament.py
+#
+# A player's rating is a (rating, deviation, volatility) tuple; Elo only
+# uses the first element. Results are rated one rating period at a time:
+# every reportMatch() call, or reportMatches() batch (usually a whole
+# round), is a period. Elo applies the games of a period one after the
+# other, Glicko-2 rates them all against the ratings from before the
+# period. Byes and forfeits are not rated, and Glicko-2 only updates the
+# players who played in a period.
+
+import itertools
+import math
+
+ELO = 'elo'
+GLICKO2 = 'glicko2'
+SYSTEMS = (ELO, GLICKO2)
+
+# Rating of a new player
+INITIAL = (1500.0, 350.0, 0.06)
+
+# Elo K-factor, and the Glicko-2 constant limiting how fast volatility moves
+ELO_K = 32
+GLICKO2_TAU = 0.5
+
+# Glicko-2 rates on this scale internally
+_SCALE = 173.7178
+
+
+# noinspection PyPep8Naming
+def expectedScore(rating, opponent_rating):
+    """Elo expectation of a player scoring against an opponent."""
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / 400.0))
+
+
+# noinspection PyPep8Naming
+def ratedGames(results):
+    """Yields a (winner, loser, share) tuple for every rated one of the given
+    (winner, loser, result) tuples; share is the winner's score, 1 or 0.5."""
+    for winner, loser, result in results:
+        if result == 'win':
+            yield winner, loser, 1
+        elif result == 'draw':
+            yield winner, loser, 0.5
+
+
+def _elo(ratings, games):
+    # Apply games in order to a dict of plain Elo ratings, in place. Kept to
+    # one flat loop as it carries full-history replays.
+    get = ratings.get
+    initial = INITIAL[0]
+    for winner, loser, share in games:
+        first = get(winner, initial)
+        second = get(loser, initial)
+        delta = ELO_K * (share - 1 / (1 + 10 ** ((second - first) / 400.0)))
+        ratings[winner] = first + delta
+        ratings[loser] = second - delta
+
+
+def _glicko2(state, results):
+    """New Glicko-2 state of a player after one period, given a list of
+    (opponent state, score) tuples; see Glickman, "Example of the Glicko-2
+    system"."""
+    rating, deviation, volatility = state
+    mu = (rating - 1500) / _SCALE
+    phi = deviation / _SCALE
+
+    variance = improvement = 0.0
+    for (opponent_rating, opponent_deviation, _), score in results:
+        g = 1 / math.sqrt(1 + 3 * (opponent_deviation / _SCALE) ** 2 /
+                          math.pi ** 2)
+        expected = 1 / (1 + math.exp(
+            -g * (mu - (opponent_rating - 1500) / _SCALE)))
+        variance += g ** 2 * expected * (1 - expected)
+        improvement += g * (score - expected)
+    variance = 1 / variance
+    delta = variance * improvement
+
+    # New volatility, by the Illinois algorithm
+    alpha = math.log(volatility ** 2)
+    spread = phi ** 2 + variance
+    excess = delta ** 2 - spread
+    tau_squared = GLICKO2_TAU ** 2
+    exp = math.exp
+
+    def f(x):
+        e = exp(x)
+        return (e * (excess - e) / (2 * (spread + e) ** 2) -
+                (x - alpha) / tau_squared)
+
+    a = alpha
+    if excess > 0:
+        b = math.log(excess)
+    else:
+        k = 1
+        while f(alpha - k * GLICKO2_TAU) < 0:
+            k += 1
+        b = alpha - k * GLICKO2_TAU
+    f_a, f_b = f(a), f(b)
+    while abs(b - a) > 0.000001:
+        c = a + (a - b) * f_a / (f_b - f_a)
+        f_c = f(c)
+        if f_c * f_b <= 0:
+            a, f_a = b, f_b
+        else:
+            f_a /= 2
+        b, f_b = c, f_c
+    volatility = math.exp(a / 2)
+
+    phi = 1 / math.sqrt(1 / (phi ** 2 + volatility ** 2) + 1 / variance)
+    mu += phi ** 2 * improvement
+    return 1500 + _SCALE * mu, _SCALE * phi, volatility
+
+
+# noinspection PyPep8Naming
+def ratePeriod(system, ratings, games):
+    """Rates one period of games.
+
+    Args:
+      system: ELO or GLICKO2
+      ratings: dict mapping every player in games to their rating tuple
+      games: list of (winner, loser, share) tuples, see ratedGames()
+
+    Returns:
+      A dict with the new rating tuple of every player in games.
+    """
+    if system == ELO:
+        elo = dict((player, ratings[player][0])
+                   for game in games for player in game[:2])
+        _elo(elo, games)
+        return dict((player, (value,) + tuple(ratings[player][1:]))
+                    for player, value in elo.items())
+
+    results = {}
+    for winner, loser, share in games:
+        results.setdefault(winner, []).append((ratings[loser], share))
+        results.setdefault(loser, []).append((ratings[winner], 1 - share))
+    return dict((player, _glicko2(ratings[player], played))
+                for player, played in results.items())
+
+
+# noinspection PyPep8Naming
+def replay(system, matches):
+    """Rates a whole match history from scratch.
+
+    Args:
+      system: ELO or GLICKO2
+      matches: iterable of (period, winner, loser, result) tuples ordered by
+        period, e.g. a cursor; it is consumed as it is iterated
+
+    Returns:
+      A dict mapping every player who played a rated game to their rating
+      tuple. Everybody else is still at INITIAL.
+    """
+    if system == ELO:
+        # Periods only matter to Glicko-2
+        elo = {}
+        _elo(elo, ratedGames(match[1:] for match in matches))
+        return dict((player, (value,) + INITIAL[1:])
+                    for player, value in elo.items())
+
+    ratings = {}
+    for _, period in itertools.groupby(matches, lambda match: match[0]):
+        games = list(ratedGames(match[1:] for match in period))
+        for winner, loser, _ in games:
+            ratings.setdefault(winner, INITIAL)
+            ratings.setdefault(loser, INITIAL)
+        ratings.update(ratePeriod(system, ratings, games))
+    return ratings
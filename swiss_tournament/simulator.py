@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#
+# simulator.py -- Monte-Carlo simulation of Swiss tournaments
+#
+# Plays many tournaments with swissPairings() and reportMatches() on the
+# in-memory backend, deciding each match with an Elo-style outcome model
+# from the players' hidden true ratings, and reports how well the final
+# standings recover the true order of strength. Events are spread over a
+# process pool.
+#
+#     python simulator.py --events 10000 --players 256
+
+import argparse
+import math
+import multiprocessing
+import random
+
+import rating
+from memory_backend import MemoryBackend
+
+
+def _playEvent(backend, rng, players, rounds, spread, draw_rate):
+    """Play one event and return the final place of every player, indexed
+    by true strength rank (0 is the strongest)."""
+    tournament_id = backend.createTournament("Simulation", None)
+    ratings = [rng.gauss(1500, spread) for _ in range(players)]
+    ids = backend.registerPlayers(("Player %d" % n for n in range(players)),
+                                  tournament_id)
+    rating_of = dict(zip(ids, ratings))
+    for _ in range(rounds):
+        results = []
+        for first, _, second, _ in backend.swissPairings(tournament_id):
+            if second is None:
+                results.append((first, None, 'bye'))
+            elif rng.random() < draw_rate:
+                results.append((first, second, 'draw'))
+            elif rng.random() < rating.expectedScore(rating_of[first],
+                                                     rating_of[second]):
+                results.append((first, second))
+            else:
+                results.append((second, first))
+        backend.reportMatches(results, tournament_id)
+
+    place = dict((row[0], index) for index, row
+                 in enumerate(backend.playerStandings(tournament_id)))
+    by_strength = sorted(ids, key=lambda player: -rating_of[player])
+    return [place[player] for player in by_strength]
+
+
+def _playEvents(task):
+    """Worker: play a chunk of events and return their summed statistics as
+    (events, summed place per true rank, winners, summed rank correlation)."""
+    seed, events, players, rounds, spread, draw_rate = task
+    rng = random.Random(seed)
+    places = [0] * players
+    winners = 0
+    correlation = 0.0
+    for _ in range(events):
+        final = _playEvent(MemoryBackend(), rng, players, rounds, spread,
+                           draw_rate)
+        for rank, place in enumerate(final):
+            places[rank] += place
+        winners += final[0] == 0
+        squares = sum((place - rank) ** 2 for rank, place in enumerate(final))
+        correlation += 1 - 6.0 * squares / (players * (players ** 2 - 1))
+    return events, places, winners, correlation
+
+
+def simulate(events=1000, players=256, rounds=None, processes=None, seed=0,
+             spread=200, draw_rate=0.0):
+    """Simulates many Swiss tournaments in parallel.
+
+    Args:
+      events: number of tournaments to play
+      players: number of players per tournament
+      rounds: rounds per tournament; defaults to log2(players) rounded up
+      processes: size of the process pool; defaults to the number of CPUs
+      seed: seed of the random number generators, for repeatable runs
+      spread: standard deviation of the players' true ratings
+      draw_rate: probability that a match is drawn
+
+    Returns:
+      A tuple (mean_places, winner_rate, correlation):
+        mean_places: the average final place (0 is first) of the players,
+          listed by true strength, strongest first
+        winner_rate: how often the strongest player won the event
+        correlation: the average Spearman rank correlation between the
+          final standings and the true order of strength
+    """
+    if events < 1:
+        raise ValueError("at least one event must be played")
+    if players < 2:
+        raise ValueError("an event needs at least two players")
+    if rounds is None:
+        rounds = int(math.ceil(math.log(players, 2)))
+    processes = processes or multiprocessing.cpu_count()
+    chunks = min(events, processes * 4)
+    tasks = [(seed * chunks + chunk, events // chunks +
+              (chunk < events % chunks), players, rounds, spread, draw_rate)
+             for chunk in range(chunks)]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_playEvents, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    places = [0] * players
+    winners = 0
+    correlation = 0.0
+    for _, chunk_places, chunk_winners, chunk_correlation in results:
+        places = [total + part for total, part in zip(places, chunk_places)]
+        winners += chunk_winners
+        correlation += chunk_correlation
+    return ([total / float(events) for total in places],
+            winners / float(events), correlation / events)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Monte-Carlo simulation of Swiss tournaments.")
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--players', type=int, default=256)
+    parser.add_argument('--rounds', type=int)
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--spread', type=float, default=200)
+    parser.add_argument('--draw-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    mean_places, winner_rate, correlation = simulate(
+        args.events, args.players, args.rounds, args.processes, args.seed,
+        args.spread, args.draw_rate)
+    print("strongest player wins: %.1f%%" % (winner_rate * 100))
+    print("rank correlation: %.3f" % correlation)
+    print("true rank  mean final place")
+    for rank in sorted(set([0, 1, 2, 3, 7, 15, 31, 63, args.players - 1])):
+        if rank < args.players:
+            print("%9d  %.1f" % (rank + 1, mean_places[rank] + 1))
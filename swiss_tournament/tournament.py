@@ -3,69 +3,1010 @@
 # tournament.py -- implementation of a Swiss-system tournament
 #
 
+import contextlib
+import csv
+import functools
+import inspect
+import itertools
+import json
+import logging
+import threading
+import time
+
 import psycopg2
+import psycopg2.errorcodes
+import psycopg2.extensions
+import psycopg2.pool
 
+import bracket
+import pairing
+import rating
 
-def connect():
-    """Connect to the PostgresSQL database.  Returns a database connection."""
-    return psycopg2.connect("dbname=tournament")
+DSN = "dbname=tournament"
+
+# Connection pool bounds. The pool opens POOL_MIN_SIZE connections up front
+# and never holds more than POOL_MAX_SIZE at once; callers beyond that wait
+# up to POOL_TIMEOUT seconds for one to be handed back.
+POOL_MIN_SIZE = 1
+POOL_MAX_SIZE = 10
+POOL_TIMEOUT = 30
+
+# How long archiveTournament() lets a statement wait for a lock on a table
+# other calls use, in seconds, before it backs off so that the queries
+# queued behind it can run, and how many times it tries
+ARCHIVE_LOCK_TIMEOUT = 0.1
+ARCHIVE_LOCK_ATTEMPTS = 50
+
+# Match results reportMatch() accepts. A bye has no loser.
+RESULTS = ('win', 'draw', 'forfeit', 'bye')
+
+# Fields of the rows iterStandings() yields, and of the standings exports
+STANDINGS_FIELDS = ('tournament_id', 'id', 'name', 'wins', 'matches',
+                    'points')
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_ping = False
+_pool_prepare = True
+
+# Statements every call of the hot tournament functions runs, by name, as
+# (parameter names, parameter types, query). Pooled connections PREPARE one
+# the first time they run it and EXECUTE it by name from then on, so the
+# server parses and plans it once per connection; see _execute().
+_STATEMENTS = {
+    'tournament_ids': ((), (), "select id from tournaments limit 2"),
+    'register_player': (
+        ('id', 'name'), ('int', 'text'),
+        """
+        insert into players (tournament_id, name)
+        values (%(id)s, %(name)s)
+        returning id
+        """),
+    # Inserts nothing unless both players are the tournament's, and two
+    # different players, so that reportMatch() only looks into why on the
+    # rare calls that record no match
+    'report_match': (
+        ('tournament_id', 'winner_id', 'loser_id', 'result', 'round',
+         'submission'),
+        ('int', 'int', 'int', 'text', 'int', 'text'),
+        """
+        insert into matches (tournament_id, winner_id, loser_id, result,
+                             round, submission)
+        select %(tournament_id)s, %(winner_id)s, %(loser_id)s, %(result)s,
+               coalesce(%(round)s, (select max(number) from rounds
+                                    where tournament_id = %(tournament_id)s)),
+               %(submission)s
+        where (select count(*) from players
+               where tournament_id = %(tournament_id)s
+                 and id in (%(winner_id)s, %(loser_id)s))
+              = case when %(loser_id)s is null then 1 else 2 end
+        on conflict do nothing
+        returning id
+        """),
+    # Locked in id order, so concurrent reporters cannot deadlock
+    'lock_ratings': (
+        ('tournament_id', 'ids'), ('int', 'int[]'),
+        """
+        select ratings.player_id, ratings.rating, ratings.deviation,
+               ratings.volatility, tournaments.rating_system
+        from ratings
+        join tournaments on tournaments.id = ratings.tournament_id
+        where ratings.tournament_id = %(tournament_id)s
+          and ratings.player_id = any(%(ids)s)
+        order by ratings.player_id
+        for update of ratings
+        """),
+    'update_ratings': (
+        ('ids', 'ratings', 'deviations', 'volatilities'),
+        ('int[]', 'float[]', 'float[]', 'float[]'),
+        """
+        update ratings
+        set rating = new.rating, deviation = new.deviation,
+            volatility = new.volatility
+        from unnest(%(ids)s, %(ratings)s, %(deviations)s, %(volatilities)s)
+            as new (player_id, rating, deviation, volatility)
+        where ratings.player_id = new.player_id
+        """),
+    'standings': (
+        ('id',), ('int',),
+        """
+        select players.id, players.name,
+               standings.wins, standings.matches, standings.points
+        from standings
+        join players on players.id = standings.player_id
+        join ratings on ratings.player_id = standings.player_id
+        left join opponent_points opponents
+            on opponents.tournament_id = standings.tournament_id
+           and opponents.player_id = standings.player_id
+        where standings.tournament_id = %(id)s
+        order by standings.points desc,
+                 coalesce(opponents.points, 0) desc, ratings.rating desc
+        """),
+}
+
+
+def _preparedForms(name):
+    """The PREPARE statement of one of the _STATEMENTS, and the EXECUTE
+    statement taking the same parameters as the statement itself."""
+    parameters, types, query = _STATEMENTS[name]
+    if not parameters:
+        return "prepare %s as %s" % (name, query), "execute %s" % name
+    positions = dict((parameter, "$%d" % (index + 1))
+                     for index, parameter in enumerate(parameters))
+    return ("prepare %s (%s) as %s" % (name, ", ".join(types),
+                                       query % positions),
+            "execute %s (%s)" % (name, ", ".join(
+                "%%(%s)s" % parameter for parameter in parameters)))
+
+
+_PREPARED_FORMS = dict((name, _preparedForms(name)) for name in _STATEMENTS)
+
+# Storage backend the tournament functions are routed to; None is the
+# PostgreSQL database. See setBackend().
+_backend = None
+
+# (log, hook) while query instrumentation is on, see setInstrumentation().
+# Routed calls only test it against None when it is off.
+_instrumentation = None
+_stats = {}
+_stats_lock = threading.Lock()
+_traced_calls = threading.local()
+_logger = logging.getLogger('tournament')
+
+# Standings cache, see setStandingsCache(). While it is on, _standings_cache
+# maps the tournament_id playerStandings() was called with to its rows, and
+# _standings_listen_dsn is set when other processes' changes are listened
+# for. _standings_version is bumped whenever entries are dropped, so a read
+# racing a write does not cache what it read.
+_standings_cache = None
+_standings_version = 0
+_standings_listen_dsn = None
+_standings_listener = None
+_standings_lock = threading.Lock()
+_uncommitted = threading.local()
+
+# Fields of the queryStats() entries and of the per-call instrumentation
+# records
+STATS_FIELDS = ('calls', 'queries', 'rows', 'wall_time', 'db_time')
+
+
+# noinspection PyPep8Naming
+def setBackend(backend=None):
+    """Routes the tournament functions to another storage backend, such as
+    memory_backend.MemoryBackend, or back to PostgreSQL when backend is None.
+
+    A backend implements every function decorated with _routed below as a
+    method of the same name and signature.
+    """
+    global _backend
+    _backend = backend
+
+
+def _routed(function):
+    """Send calls of a tournament function to the active backend, and trace
+    them while instrumentation is on."""
+    name = function.__name__
+    generator = inspect.isgeneratorfunction(function)
+
+    @functools.wraps(function)
+    def route(*args, **kwargs):
+        if _backend is None:
+            target = function
+        else:
+            target = getattr(_backend, name)
+        if _instrumentation is None:
+            return target(*args, **kwargs)
+        if generator:
+            return _tracedIter(name, target(*args, **kwargs))
+        return _traced(name, target, args, kwargs)
+    return route
+
+
+# noinspection PyPep8Naming
+def setInstrumentation(enabled=True, log=False, hook=None):
+    """Turns query instrumentation of the tournament functions on or off.
+
+    While it is on, every call of a tournament function records the queries
+    it sends, the rows they return and the time it takes, summed per
+    function in queryStats(). Queries of a function called from another one
+    count towards the inner function only.
+
+    Args:
+      enabled: False turns instrumentation off again
+      log: log every call as a line of JSON to the 'tournament' logger, at
+        INFO level
+      hook: callable given every call's record, a dict of the function name
+        under 'function' and the STATS_FIELDS of that single call
+    """
+    global _instrumentation
+    _instrumentation = (log, hook) if enabled else None
 
 
 # noinspection PyPep8Naming
-def createTournament(name, info):
-    db = connect()
-    cursor = db.cursor()
+def queryStats():
+    """Returns a dict mapping the name of every tournament function called
+    while instrumentation was on to a dict of its STATS_FIELDS: calls,
+    queries sent, rows returned, and seconds spent in the function and
+    waiting on the database."""
+    with _stats_lock:
+        return dict((name, dict(stats)) for name, stats in _stats.items())
+
+
+# noinspection PyPep8Naming
+def resetQueryStats():
+    """Forget the statistics gathered so far."""
+    with _stats_lock:
+        _stats.clear()
+
+
+class _Call(object):
+    """Queries, rows and database time of one traced call."""
+    __slots__ = ('queries', 'rows', 'db_time')
+
+    def __init__(self):
+        self.queries = self.rows = 0
+        self.db_time = 0.0
+
+
+def _callStack():
+    stack = getattr(_traced_calls, 'stack', None)
+    if stack is None:
+        stack = _traced_calls.stack = []
+    return stack
+
+
+def _traced(name, target, args, kwargs):
+    stack = _callStack()
+    call = _Call()
+    stack.append(call)
+    start = time.time()
+    try:
+        return target(*args, **kwargs)
+    finally:
+        stack.pop()
+        _record(name, call, time.time() - start)
+
+
+def _tracedIter(name, iterable):
+    # A generator's queries run while it is iterated, so trace every step
+    # and record the call once it is exhausted or closed.
+    call = _Call()
+    iterator = iter(iterable)
+    wall_time = 0.0
+    try:
+        while True:
+            stack = _callStack()
+            stack.append(call)
+            start = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                wall_time += time.time() - start
+                stack.pop()
+            yield item
+    finally:
+        _record(name, call, wall_time)
+
+
+def _record(name, call, wall_time):
+    with _stats_lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = dict.fromkeys(STATS_FIELDS, 0)
+        stats['calls'] += 1
+        stats['queries'] += call.queries
+        stats['rows'] += call.rows
+        stats['wall_time'] += wall_time
+        stats['db_time'] += call.db_time
+    instrumentation = _instrumentation
+    if instrumentation is None:
+        return
+    log, hook = instrumentation
+    record = {'function': name, 'calls': 1, 'queries': call.queries,
+              'rows': call.rows, 'wall_time': wall_time,
+              'db_time': call.db_time}
+    if log:
+        _logger.info(json.dumps(record, sort_keys=True))
+    if hook is not None:
+        hook(record)
+
+
+# noinspection PyPep8Naming
+def setStandingsCache(enabled=True, listen=False, dsn=DSN):
+    """Turns the process-level cache of playerStandings() on or off.
+
+    While it is on, the standings of a tournament are read from the
+    database once and served from memory until a tournament function
+    changes them in this process. Changes made by other processes, e.g.
+    tournament_async.py, are only seen with listen set: the database then
+    announces every change to the standings on the 'standings' channel (see
+    tournament.sql), and each read applies the announcements received so far
+    without a query. The cache applies to the PostgreSQL backend only.
+
+    Args:
+      enabled: False turns the cache off and drops it
+      listen: LISTEN for changes made by other processes
+      dsn: libpq connection string of the tournament database, for the
+        listening connection
+    """
+    global _standings_cache, _standings_version, _standings_listen_dsn, \
+        _standings_listener
+    with _standings_lock:
+        if _standings_listener is not None:
+            _standings_listener.close()
+            _standings_listener = None
+        _standings_cache = {} if enabled else None
+        _standings_listen_dsn = dsn if enabled and listen else None
+        _standings_version += 1
+
+
+def _standingsChanged(tournament_id=None):
+    """Drop the cached standings of a tournament, or of all of them, when
+    the transaction of the current connect() block ends."""
+    if _standings_cache is not None:
+        changed = getattr(_uncommitted, 'standings', None)
+        if changed is None:
+            changed = _uncommitted.standings = set()
+        changed.add(tournament_id)
+
+
+def _dropStandings(tournament_ids):
+    # Called once the transaction that changed the standings has ended;
+    # dropping them earlier would let a read cache the old rows again.
+    global _standings_version
+    with _standings_lock:
+        if _standings_cache is None:
+            return
+        _standings_version += 1
+        if None in tournament_ids:
+            _standings_cache.clear()
+            return
+        for tournament_id in tournament_ids:
+            _standings_cache.pop(tournament_id, None)
+        # Standings read without a tournament_id may be any tournament's
+        _standings_cache.pop(None, None)
+
+
+def _listenForStandings():
+    """Apply the changes other processes announced. Returns False when they
+    cannot be known, in which case the cache must not be used. Called with
+    _standings_lock held."""
+    global _standings_listener, _standings_version
+    if _standings_listen_dsn is None:
+        return True
+    try:
+        if _standings_listener is None:
+            listener = psycopg2.connect(_standings_listen_dsn)
+            listener.autocommit = True
+            listener.cursor().execute("listen standings")
+            _standings_listener = listener
+            # Nothing was heard while the listener was down
+            _standings_cache.clear()
+            _standings_version += 1
+        _standings_listener.poll()
+    except psycopg2.Error:
+        if _standings_listener is not None:
+            _standings_listener.close()
+            _standings_listener = None
+        _standings_cache.clear()
+        _standings_version += 1
+        return False
+    notifies = _standings_listener.notifies
+    if notifies:
+        # As in _dropStandings(), so that a read that started before the
+        # announced change cannot cache what it read
+        _standings_version += 1
+        for notify in notifies:
+            _standings_cache.pop(int(notify.payload), None)
+        _standings_cache.pop(None, None)
+        del notifies[:]
+    return True
+
+
+def _cachedStandings(tournament_id):
+    """Returns the cached standings rows of a tournament, or None, and the
+    version to hand _cacheStandings() with the rows read instead."""
+    with _standings_lock:
+        if _standings_cache is None or not _listenForStandings():
+            return None, None
+        return _standings_cache.get(tournament_id), _standings_version
+
+
+def _cacheStandings(tournament_id, rows, version):
+    with _standings_lock:
+        if _standings_cache is not None and version == _standings_version:
+            _standings_cache[tournament_id] = rows
+
+
+class _TracedCursor(psycopg2.extensions.cursor):
+    """Cursor crediting its queries, rows and time to the traced call it
+    runs in. connect() hands these out while instrumentation is on."""
+
+    def _credit(self, start, rows):
+        stack = getattr(_traced_calls, 'stack', None)
+        if stack:
+            call = stack[-1]
+            call.queries += 1
+            call.rows += rows
+            call.db_time += time.time() - start
+
+    def execute(self, query, vars=None):
+        start = time.time()
+        try:
+            return super(_TracedCursor, self).execute(query, vars)
+        finally:
+            # A named cursor only returns its rows as they are fetched
+            if self.name is None and self.description is not None:
+                self._credit(start, max(self.rowcount, 0))
+            else:
+                self._credit(start, 0)
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.time()
+        try:
+            return super(_TracedCursor, self).copy_expert(sql, file, size)
+        finally:
+            self._credit(start, 0)
+
+    def fetchmany(self, size=None):
+        if self.name is None:
+            return super(_TracedCursor, self).fetchmany(size)
+        start = time.time()
+        rows = super(_TracedCursor, self).fetchmany(
+            self.arraysize if size is None else size)
+        self._credit(start, len(rows))
+        return rows
+
+    def __iter__(self):
+        if self.name is None:
+            return super(_TracedCursor, self).__iter__()
+        return self._iterChunks()
+
+    def _iterChunks(self):
+        # Fetch a named cursor itersize rows at a time, as iterating it does
+        while True:
+            rows = self.fetchmany(self.itersize)
+            if not rows:
+                return
+            for row in rows:
+                yield row
+
+
+class _WaitingPool(psycopg2.pool.ThreadedConnectionPool):
+    """Connection pool making callers wait for a connection once maxconn
+    are handed out, where ThreadedConnectionPool raises PoolError at once."""
+
+    def __init__(self, minconn, maxconn, timeout, *args, **kwargs):
+        self.timeout = timeout
+        self._free = maxconn
+        self._slots = threading.Condition(threading.Lock())
+        super(_WaitingPool, self).__init__(minconn, maxconn, *args, **kwargs)
+
+    def getconn(self, key=None):
+        deadline = time.time() + self.timeout
+        with self._slots:
+            while self._free == 0:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise psycopg2.pool.PoolError(
+                        "no connection free after %s seconds" % self.timeout)
+                self._slots.wait(remaining)
+            self._free -= 1
+        try:
+            return super(_WaitingPool, self).getconn(key)
+        except Exception:
+            self._release()
+            raise
+
+    def putconn(self, conn, key=None, close=False):
+        try:
+            super(_WaitingPool, self).putconn(conn, key, close)
+        finally:
+            self._release()
+
+    def _release(self):
+        with self._slots:
+            self._free += 1
+            self._slots.notify()
+
+
+# noinspection PyPep8Naming
+def configurePool(min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE, dsn=DSN,
+                  ping=False, prepare=True, timeout=POOL_TIMEOUT):
+    """(Re)create the connection pool used by every function in this module.
+
+    Args:
+      min_size: number of connections opened eagerly and kept around
+      max_size: maximum number of connections handed out at the same time;
+        further callers wait for one to be handed back
+      dsn: libpq connection string of the tournament database
+      ping: run a round trip on checkout to make sure the server is alive,
+        on top of the free client-side health check
+      prepare: prepare the hot statements once per connection; turn it off
+        behind a pooler that does not keep sessions, such as PgBouncer in
+        transaction mode
+      timeout: seconds a caller waits for a free connection before
+        psycopg2.pool.PoolError is raised
+    """
+    global _pool, _pool_ping, _pool_prepare
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+        _pool = _WaitingPool(min_size, max_size, timeout, dsn,
+                             connection_factory=_Connection)
+        _pool_ping = ping
+        _pool_prepare = prepare
+
+
+# noinspection PyPep8Naming
+def closePool():
+    """Close every pooled connection. The pool is rebuilt on next use."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+def _getPool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = _WaitingPool(POOL_MIN_SIZE, POOL_MAX_SIZE,
+                                     POOL_TIMEOUT, DSN,
+                                     connection_factory=_Connection)
+    return _pool
+
+
+class _Connection(psycopg2.extensions.connection):
+    """Pooled connection remembering the statements prepared on it. They
+    outlive rolled back transactions, and go away with the connection."""
+
+    def __init__(self, *args, **kwargs):
+        super(_Connection, self).__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def _execute(cursor, name, params=None):
+    """Run one of the _STATEMENTS with a dict of its parameters, prepared
+    on the cursor's connection unless preparing is turned off."""
+    prepared = getattr(cursor.connection, 'prepared', None)
+    if prepared is None or not _pool_prepare:
+        cursor.execute(_STATEMENTS[name][2], params)
+        return
+    prepare, execute = _PREPARED_FORMS[name]
+    if name not in prepared:
+        cursor.execute(prepare)
+        prepared.add(name)
+    cursor.execute(execute, params)
+
+
+def _isHealthy(db):
+    """Check a pooled connection before handing it out."""
+    if db.closed:
+        return False
+    status = db.get_transaction_status()
+    if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        # Left over from a caller that did not finish its transaction
+        db.rollback()
+    if _pool_ping:
+        try:
+            cursor = db.cursor()
+            cursor.execute("select 1")
+            cursor.close()
+            db.rollback()
+        except psycopg2.Error:
+            return False
+    return True
+
+
+def _checkout(pool):
+    # Retry once per pooled slot so a burst of dead connections (e.g. after
+    # a server restart) is drained instead of failing the caller.
+    for _ in range(pool.maxconn + 1):
+        db = pool.getconn()
+        if _isHealthy(db):
+            return db
+        pool.putconn(db, close=True)
+    raise psycopg2.OperationalError("no healthy connection available")
+
+
+@contextlib.contextmanager
+def connect():
+    """Borrow a connection to the PostgresSQL database from the pool.
+
+    Used as a context manager: the transaction is committed when the block
+    exits normally, rolled back if it raises, and the connection is handed
+    back to the pool either way.
+    """
+    pool = _getPool()
+    db = _checkout(pool)
+    db.cursor_factory = None if _instrumentation is None else _TracedCursor
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        if not db.closed:
+            db.rollback()
+        raise
+    finally:
+        pool.putconn(db, close=bool(db.closed))
+        changed = getattr(_uncommitted, 'standings', None)
+        if changed:
+            _uncommitted.standings = None
+            _dropStandings(changed)
+
+
+@contextlib.contextmanager
+def _autocommit():
+    """Borrow a connection from the pool outside of any transaction, for
+    statements that cannot run in one."""
+    pool = _getPool()
+    db = _checkout(pool)
+    db.autocommit = True
+    try:
+        yield db
+    finally:
+        if not db.closed:
+            db.autocommit = False
+        pool.putconn(db, close=bool(db.closed))
+
+
+def _runWithLockTimeout(statement, params=None):
+    """Run a statement taking strong table locks in a transaction of its
+    own. It waits ARCHIVE_LOCK_TIMEOUT at most for them, since every query
+    on the tables queues up behind it meanwhile, and is retried until it
+    gets them."""
+    for attempt in range(ARCHIVE_LOCK_ATTEMPTS):
+        try:
+            with connect() as db:
+                cursor = db.cursor()
+                cursor.execute("set local lock_timeout = %s",
+                               ("%dms" % (ARCHIVE_LOCK_TIMEOUT * 1000),))
+                cursor.execute(statement, params)
+            return
+        except psycopg2.OperationalError as e:
+            if e.pgcode != psycopg2.errorcodes.LOCK_NOT_AVAILABLE or \
+                    attempt == ARCHIVE_LOCK_ATTEMPTS - 1:
+                raise
+        time.sleep(ARCHIVE_LOCK_TIMEOUT)
+
+
+def _tournamentId(cursor, tournament_id=None):
+    """Return tournament_id, or look the tournament up when none is given,
+    which is only unambiguous while the database holds a single one."""
+    if tournament_id is None:
+        _execute(cursor, 'tournament_ids')
+        rows = cursor.fetchall()
+        if len(rows) != 1:
+            raise ValueError("tournament_id is required unless exactly one "
+                             "tournament exists")
+        tournament_id = rows[0][0]
+    return tournament_id
+
+
+def _resultError(winner, loser, result, registered):
+    """Return why a reported result is invalid, or None if it is valid.
+    registered is the set of ids of the tournament's players."""
+    if result not in RESULTS:
+        return "unknown result %r" % (result,)
+    if (result == 'bye') != (loser is None):
+        return "a bye, and only a bye, has no loser"
+    if winner == loser:
+        return "player cannot play themselves"
+    if winner not in registered:
+        return "unknown winner %s" % winner
+    if loser is not None and loser not in registered:
+        return "unknown loser %s" % loser
+    return None
+
+
+def _pairKey(winner, loser):
+    """The pairing of a match regardless of who won, as matched by the
+    matches_round_pairing index; a bye pairs the player with themselves."""
+    if loser is None:
+        return winner, winner
+    return min(winner, loser), max(winner, loser)
+
+
+def _sameResult(match, winner, loser, result):
+    """Whether a stored (id, winner, loser, result) match records the given
+    result. The players of a draw may come in either order."""
+    if match[3] != result:
+        return False
+    if result == 'draw':
+        return _pairKey(*match[1:3]) == _pairKey(winner, loser)
+    return tuple(match[1:3]) == (winner, loser)
+
+
+def _submittedBefore(match, winner, loser, result):
+    """Resolve a result reported under a submission key that is already
+    taken by the stored (id, winner, loser, result) match. Returns a
+    (match_id, error) tuple as _reportedBefore() does."""
+    if _sameResult(match, winner, loser, result):
+        return match[0], None
+    return None, "a different result was already reported under this " \
+                 "submission key"
+
+
+def _reportedBefore(cursor, tournament_id, round_number, results):
+    """Resolve results, (winner, loser, result) tuples whose insert hit a
+    pairing already reported in the round, against the stored matches.
+
+    Returns a (match_id, error) tuple per result: the stored match when it
+    records the same result, so resubmitting a result is harmless, or an
+    error when it records a different one.
+    """
     cursor.execute("""
-                   insert into tournaments (name,information)
-                   values(%(name)s,%(info)s)
-                   """, {'name': name, 'info': info})
-    db.commit()
-    db.close()
+                   select matches.id, matches.winner_id, matches.loser_id,
+                          matches.result
+                   from matches
+                   join unnest(%(winners)s::int[], %(losers)s::int[])
+                       as reported (winner, loser)
+                     on least(matches.winner_id, matches.loser_id)
+                        = least(reported.winner, reported.loser)
+                    and greatest(matches.winner_id, matches.loser_id)
+                        = greatest(reported.winner, reported.loser)
+                   where matches.tournament_id = %(tournament_id)s
+                     and matches.round = coalesce(%(round)s, (
+                         select max(number) from rounds
+                         where tournament_id = %(tournament_id)s))
+                   """, {'tournament_id': tournament_id,
+                         'round': round_number,
+                         'winners': [row[0] for row in results],
+                         'losers': [row[1] for row in results]})
+    stored = dict((_pairKey(*row[1:3]), row) for row in cursor.fetchall())
+    outcomes = []
+    for winner, loser, result in results:
+        match = stored[_pairKey(winner, loser)]
+        if _sameResult(match, winner, loser, result):
+            outcomes.append((match[0], None))
+        else:
+            outcomes.append((None, "a different result was already "
+                                   "reported for this pairing"))
+    return outcomes
+
+
+def _deleteFrom(table, tournament_id):
+    """Delete the rows of table belonging to a tournament, or all of them."""
+    with connect() as db:
+        cursor = db.cursor()
+        _standingsChanged(tournament_id)
+        if tournament_id is None:
+            cursor.execute("delete from %s" % table)
+        else:
+            cursor.execute("delete from %s where %s = %%(id)s" %
+                           (table, 'id' if table == 'tournaments'
+                            else 'tournament_id'),
+                           {'id': tournament_id})
+
+
+def _insertMany(cursor, statement, template, rows, page_size=1000):
+    """Insert rows with multi-row VALUES statements, page_size rows per
+    round trip. statement holds a single %s for the VALUES list and may end
+    with a RETURNING clause, whose rows are returned in insertion order.
+    An update joined to a VALUES list works the same way."""
+    returned = []
+    for start in range(0, len(rows), page_size):
+        values = ",".join(cursor.mogrify(template, row).decode()
+                          for row in rows[start:start + page_size])
+        cursor.execute(statement % values)
+        if cursor.description is not None:
+            returned.extend(cursor.fetchall())
+    return returned
+
+
+def _rateMatches(cursor, tournament_id, results):
+    """Update the ratings of the players in results, a list of (winner,
+    loser, result) tuples making up one rating period."""
+    games = list(rating.ratedGames(results))
+    if not games:
+        return
+    player_ids = set(player for game in games for player in game[:2])
+    _execute(cursor, 'lock_ratings',
+             {'tournament_id': tournament_id, 'ids': list(player_ids)})
+    rows = cursor.fetchall()
+    if len(rows) != len(player_ids):
+        raise ValueError("players %s are not registered for tournament %s" %
+                         (sorted(player_ids - set(row[0] for row in rows)),
+                          tournament_id))
+    states = dict((row[0], row[1:4]) for row in rows)
+    _updateRatings(cursor, rating.ratePeriod(rows[0][4], states, games))
+
+
+def _updateRatings(cursor, states, page_size=1000):
+    """Store a dict mapping player ids to rating tuples."""
+    states = list(states.items())
+    for start in range(0, len(states), page_size):
+        page = states[start:start + page_size]
+        _execute(cursor, 'update_ratings', {
+            'ids': [player for player, _ in page],
+            'ratings': [state[0] for _, state in page],
+            'deviations': [state[1] for _, state in page],
+            'volatilities': [state[2] for _, state in page]})
+
+
+class _CopyStream(object):
+    """Read-only file object that feeds single-column rows from an iterable
+    to COPY FROM STDIN in text format, pulling rows only as COPY asks for
+    more data."""
+
+    def __init__(self, values):
+        self._lines = (self._escape(value) + "\n" for value in values)
+        self._buffer = ""
+
+    @staticmethod
+    def _escape(value):
+        return (value.replace("\\", "\\\\").replace("\t", "\\t")
+                .replace("\n", "\\n").replace("\r", "\\r"))
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        for line in self._lines:
+            chunks.append(line)
+            length += len(line)
+            if 0 <= size <= length:
+                break
+        data = "".join(chunks)
+        if size < 0:
+            size = len(data)
+        self._buffer = data[size:]
+        return data[:size]
 
 
 # noinspection PyPep8Naming
-def deleteTournaments():
-    """Remove all the tournament records from the database."""
-    db = connect()
-    cursor = db.cursor()
-    cursor.execute("delete from tournaments")
-    db.commit()
-    db.close()
+@_routed
+def createTournament(name, info, win_points=1, draw_points=0.5,
+                     loss_points=0, bye_points=1, rating_system=rating.ELO):
+    """Adds a tournament to the database and returns its id.
+
+    The *_points arguments set what each result is worth in the standings;
+    a forfeit scores like a win for the winner and a loss for the loser.
+    rating_system is one of rating.SYSTEMS.
+    """
+    if rating_system not in rating.SYSTEMS:
+        raise ValueError("unknown rating system %r" % (rating_system,))
+    with connect() as db:
+        cursor = db.cursor()
+        cursor.execute("""
+                       insert into tournaments (name,information,
+                           win_points,draw_points,loss_points,bye_points,
+                           rating_system)
+                       values(%(name)s,%(info)s,
+                           %(win)s,%(draw)s,%(loss)s,%(bye)s,%(system)s)
+                       returning id
+                       """, {'name': name, 'info': info, 'win': win_points,
+                             'draw': draw_points, 'loss': loss_points,
+                             'bye': bye_points, 'system': rating_system})
+        tournament_id = cursor.fetchone()[0]
+        _standingsChanged(tournament_id)
+        return tournament_id
 
 
 # noinspection PyPep8Naming
-def deleteMatches():
-    """Remove all the match records from the database."""
-    db = connect()
-    cursor = db.cursor()
-    cursor.execute("delete from matches")
-    db.commit()
-    db.close()
+@_routed
+def deleteTournaments(tournament_id=None):
+    """Remove a tournament record, or all of them, from the database."""
+    _deleteFrom('tournaments', tournament_id)
 
 
 # noinspection PyPep8Naming
-def deletePlayers():
-    """Remove all the player records from the database."""
-    db = connect()
-    cursor = db.cursor()
-    cursor.execute("delete from players")
-    db.commit()
-    db.close()
+@_routed
+def archiveTournament(tournament_id=None):
+    """Archives a finished tournament. Its matches partition is detached
+    from the matches table and kept as archive.matches_<id>, so the
+    partitions of running events are all that is left to query. Standings,
+    ratings and bracket stay as they are, but no further matches can be
+    reported, and deleteMatches(), rebuildStandings() and rebuildRatings()
+    leave the tournament alone.
+
+    Queries on running tournaments are not held up meanwhile: from
+    PostgreSQL 14 on the partition is detached concurrently, and before
+    that, or for the locks archive_matches() takes, each attempt only waits
+    ARCHIVE_LOCK_TIMEOUT for its locks. An archive interrupted half way is
+    finished by calling archiveTournament() again.
+    """
+    with connect() as db:
+        cursor = db.cursor()
+        tournament_id = _tournamentId(cursor, tournament_id)
+        partition = 'matches_%d' % tournament_id
+        cursor.execute("""
+                       update tournaments set archived = true
+                       where id = %s and to_regclass(%s) is not null
+                       returning id
+                       """, (tournament_id, 'public.' + partition))
+        if cursor.fetchone() is None:
+            raise ValueError("tournament %s does not exist or is archived "
+                             "already" % tournament_id)
+        concurrently = db.server_version >= 140000
+        cursor.execute("""
+                       select %s from pg_inherits
+                       where inhrelid = %%s::regclass
+                       """ % ('inhdetachpending' if concurrently else 'false'),
+                       (partition,))
+        attached = cursor.fetchone()
+    if attached is not None:
+        detach = "alter table matches detach partition %s" % partition
+        if attached[0]:
+            # A concurrent detach that was interrupted
+            with _autocommit() as db:
+                db.cursor().execute(detach + " finalize")
+        elif concurrently:
+            with _autocommit() as db:
+                db.cursor().execute(detach + " concurrently")
+        else:
+            _runWithLockTimeout(detach)
+    _runWithLockTimeout("select archive_matches(%s)", (tournament_id,))
+
+
+# noinspection PyPep8Naming
+@_routed
+def deleteMatches(tournament_id=None):
+    """Remove the match records, rounds and bracket of a tournament, or of
+    all of them, and reset the ratings of its players. Archived tournaments
+    are left alone; their matches go with deleteTournaments()."""
+    with connect() as db:
+        cursor = db.cursor()
+        _standingsChanged(tournament_id)
+        cursor.execute("""
+                       delete from matches
+                       where %(id)s is null or tournament_id = %(id)s
+                       """, {'id': tournament_id})
+        cursor.execute("""
+                       delete from brackets
+                       where (%(id)s is null or tournament_id = %(id)s)
+                         and tournament_id not in (
+                             select id from tournaments where archived)
+                       """, {'id': tournament_id})
+        cursor.execute("""
+                       delete from rounds
+                       where (%(id)s is null or tournament_id = %(id)s)
+                         and tournament_id not in (
+                             select id from tournaments where archived)
+                       """, {'id': tournament_id})
+        cursor.execute("""
+                       update ratings
+                       set rating = default, deviation = default,
+                           volatility = default
+                       where (%(id)s is null or tournament_id = %(id)s)
+                         and tournament_id not in (
+                             select id from tournaments where archived)
+                       """, {'id': tournament_id})
 
 
 # noinspection PyPep8Naming
-def countPlayers():
-    """Returns the number of players currently registered."""
-    db = connect()
-    cursor = db.cursor()
-    cursor.execute("select count(*) as number from players")
-    count = cursor.fetchone()[0]
-    db.close()
-    return count
+@_routed
+def deletePlayers(tournament_id=None):
+    """Remove the player records of a tournament, or all of them."""
+    _deleteFrom('players', tournament_id)
 
 
 # noinspection PyPep8Naming
-def registerPlayer(name):
+@_routed
+def countPlayers(tournament_id=None):
+    """Returns the number of players registered for a tournament, or for
+    all tournaments when none is given."""
+    with connect() as db:
+        cursor = db.cursor()
+        if tournament_id is None:
+            cursor.execute("select count(*) as number from players")
+        else:
+            cursor.execute("""
+                           select count(*) as number from players
+                           where tournament_id = %(id)s
+                           """, {'id': tournament_id})
+        return cursor.fetchone()[0]
+
+
+# noinspection PyPep8Naming
+@_routed
+def registerPlayer(name, tournament_id=None):
     """Adds a player to the tournament database.
 
     The database assigns a unique serial id number for the player.  (This
@@ -73,26 +1014,76 @@ def registerPlayer(name):
 
     Args:
       name: the player's full name (need not be unique).
+      tournament_id: the tournament the player registers for; may be left
+        out while the database holds a single tournament.
+
+    Returns:
+      The id assigned to the player.
     """
-    db = connect()
-    cursor = db.cursor()
+    with connect() as db:
+        cursor = db.cursor()
+        tournament_id = _tournamentId(cursor, tournament_id)
+        _standingsChanged(tournament_id)
 
-    # Get tournament id. We should have only now for this demo project
-    cursor.execute("select id from tournaments")
-    tournament_id = cursor.fetchone()[0]
+        # Register player on DB
+        _execute(cursor, 'register_player',
+                 {'id': tournament_id, 'name': name})
+        return cursor.fetchone()[0]
 
-    # Register player on DB
-    cursor.execute("""
-                   insert into players (tournament_id,name)
-                   values( %(id)s, %(name)s)
-                   """, {'id': tournament_id, 'name': name})
-    db.commit()
-    db.close()
+
+# noinspection PyPep8Naming
+@_routed
+def registerPlayers(names, tournament_id=None):
+    """Adds many players to the tournament database at once.
+
+    Names are streamed to the server with COPY FROM STDIN, so the input is
+    never held in memory as a whole.
+
+    Args:
+      names: an iterable of player names, or an open CSV file whose first
+        column holds the names
+      tournament_id: the tournament the players register for
+
+    Returns:
+      The ids assigned to the players, in the order the names were given.
+    """
+    if hasattr(names, 'read'):
+        names = (row[0] for row in csv.reader(names) if row)
+    with connect() as db:
+        cursor = db.cursor()
+        tournament_id = _tournamentId(cursor, tournament_id)
+        _standingsChanged(tournament_id)
+
+        # Stage the names, remembering their order, then move them into
+        # players in one statement. Serial ids are handed out in that order.
+        cursor.execute("""
+                       create temporary table player_import (
+                           position serial, name text not null
+                       ) on commit drop
+                       """)
+        cursor.copy_expert("copy player_import (name) from stdin",
+                           _CopyStream(names))
+        cursor.execute("""
+                       insert into players (tournament_id, name)
+                       select %(id)s, name from player_import
+                       order by position
+                       returning id
+                       """, {'id': tournament_id})
+        return sorted(row[0] for row in cursor.fetchall())
 
 
 # noinspection PyPep8Naming
-def playerStandings():
-    """Returns a list of the players and their win records, sorted by wins.
+@_routed
+def playerStandings(tournament_id=None):
+    """Returns a list of the players and their win records, sorted by points.
+
+    Wins, draws, forfeits and byes score the points configured for the
+    tournament. Players on equal points are ordered by the summed points of
+    their opponents (Buchholz), then by rating, which seeds the first round;
+    playerTiebreakers() reports the full set of tie-breakers.
+
+    Only players of the given tournament are listed; tournament_id may be
+    left out while the database holds a single tournament.
 
     The first entry in the list should be the player in first place,
     or a player tied for first place if there is currently a tie.
@@ -101,59 +1092,506 @@ def playerStandings():
       A list of tuples, each of which contains (id, name, wins, matches):
         id: the player's unique id (assigned by the database)
         name: the player's full name (as registered)
-        wins: the number of matches the player has won
-        matches: the number of matches the player has played
+        wins: the number of matches the player has won, byes and forfeits
+          included
+        matches: the number of matches the player has played, byes included
+
+    Served from memory while the standings cache is on and the tournament's
+    standings have not changed since the last call; see setStandingsCache().
     """
-    db = connect()
-    cursor = db.cursor()
-    # Get total matches count and won count from predefined views
-    cursor.execute(
-        """
-        select played_matches.id, played_matches.name,
-               won_matches.win_count, played_matches.total_count
-        from played_matches, won_matches
-        where played_matches.id = won_matches.id
-        order by won_matches.win_count desc
-        """
-    )
-    standings = cursor.fetchall()
-    db.close()
-    return standings
+    rows, version = _cachedStandings(tournament_id)
+    if rows is None:
+        with connect() as db:
+            cursor = db.cursor()
+            rows = tuple(row[:4] for row in _standings(
+                cursor, _tournamentId(cursor, tournament_id)))
+        _cacheStandings(tournament_id, rows, version)
+    return list(rows)
+
+
+def _standings(cursor, tournament_id):
+    # Read the aggregates maintained by the standings triggers. Returns
+    # (id, name, wins, matches, points) rows.
+    _execute(cursor, 'standings', {'id': tournament_id})
+    return cursor.fetchall()
 
 
 # noinspection PyPep8Naming
-def reportMatch(winner, loser):
+@_routed
+def iterStandings(tournament_id=None, chunk_size=1000):
+    """Yields the standings of a tournament, or of every tournament one
+    after the other, without holding them in memory.
+
+    Rows are read through a server-side cursor chunk_size at a time, so
+    exporting a large history takes constant memory. A pooled connection
+    is held until the generator is exhausted or closed.
+
+    Yields:
+      Tuples of STANDINGS_FIELDS, best placed player of each tournament
+      first, in playerStandings() order.
+    """
+    with connect() as db:
+        cursor = db.cursor('standings_export')
+        cursor.itersize = chunk_size
+        try:
+            cursor.execute(
+                """
+                select standings.tournament_id, players.id, players.name,
+                       standings.wins, standings.matches, standings.points
+                from standings
+                join players on players.id = standings.player_id
+                join ratings on ratings.player_id = standings.player_id
+                left join opponent_points opponents
+                    on opponents.tournament_id = standings.tournament_id
+                   and opponents.player_id = standings.player_id
+                where %(id)s is null or standings.tournament_id = %(id)s
+                order by standings.tournament_id, standings.points desc,
+                         coalesce(opponents.points, 0) desc,
+                         ratings.rating desc
+                """, {'id': tournament_id}
+            )
+            for row in cursor:
+                yield row
+        finally:
+            cursor.close()
+
+
+# noinspection PyPep8Naming
+def exportStandingsCsv(output, tournament_id=None, chunk_size=1000):
+    """Writes the standings of a tournament, or of all tournaments, to an
+    open file as CSV with a header row, one row at a time; see
+    iterStandings()."""
+    writer = csv.writer(output)
+    writer.writerow(STANDINGS_FIELDS)
+    for row in iterStandings(tournament_id, chunk_size):
+        writer.writerow(row)
+
+
+# noinspection PyPep8Naming
+def exportStandingsJsonLines(output, tournament_id=None, chunk_size=1000):
+    """Writes the standings of a tournament, or of all tournaments, to an
+    open file as JSON Lines, one object per player; see iterStandings()."""
+    for row in iterStandings(tournament_id, chunk_size):
+        output.write(json.dumps(dict(zip(STANDINGS_FIELDS, row))) + "\n")
+
+
+# noinspection PyPep8Naming
+@_routed
+def playerTiebreakers(tournament_id=None):
+    """Returns the standings with tie-breakers, computed for the whole field
+    in a single query over the tournament's matches.
+
+    Returns:
+      A list of tuples sorted by points and then by the tie-breakers in the
+      order listed, each of which contains (id, name, wins, matches, points,
+      omw, buchholz, sonneborn_berger):
+        omw: average match-win percentage (points scored out of the points
+          of winning every match) of the player's opponents, each counted as
+          at least one third; 0 for a player who met nobody yet
+        buchholz: the summed points of the player's opponents
+        sonneborn_berger: the summed points of the opponents the player
+          beat, plus half of those of the opponents they drew with
+    """
+    with connect() as db:
+        cursor = db.cursor()
+        tournament_id = _tournamentId(cursor, tournament_id)
+        cursor.execute(
+            """
+            select players.id, players.name, standings.wins,
+                   standings.matches, standings.points,
+                   coalesce(avg(case when opponent.player_id is not null
+                       then greatest(
+                           opponent.points::float /
+                           nullif(opponent.matches * tournaments.win_points,
+                                  0),
+                           1 / 3.0)
+                       end), 0) as omw,
+                   coalesce(sum(opponent.points), 0) as buchholz,
+                   coalesce(sum(results.share * opponent.points),
+                            0) as sonneborn_berger
+            from standings
+            join players on players.id = standings.player_id
+            join tournaments on tournaments.id = standings.tournament_id
+            left join match_results results
+                on results.tournament_id = standings.tournament_id
+               and results.player_id = standings.player_id
+               and results.opponent_id is not null
+            left join standings opponent
+                on opponent.player_id = results.opponent_id
+            where standings.tournament_id = %(id)s
+            group by players.id, standings.wins, standings.matches,
+                     standings.points
+            order by standings.points desc, omw desc, buchholz desc,
+                     sonneborn_berger desc
+            """, {'id': tournament_id}
+        )
+        return cursor.fetchall()
+
+
+# noinspection PyPep8Naming
+@_routed
+def playerRatings(tournament_id=None):
+    """Returns the players of a tournament by rating, highest first.
+
+    Returns:
+      A list of tuples, each of which contains (id, name, rating,
+      deviation):
+        rating: the player's Elo or Glicko-2 rating, see rating.py
+        deviation: the player's Glicko-2 rating deviation; it stays at its
+          initial value under Elo
+    """
+    with connect() as db:
+        cursor = db.cursor()
+        cursor.execute("""
+                       select players.id, players.name,
+                              ratings.rating, ratings.deviation
+                       from ratings
+                       join players on players.id = ratings.player_id
+                       where ratings.tournament_id = %(id)s
+                       order by ratings.rating desc, players.id
+                       """, {'id': _tournamentId(cursor, tournament_id)})
+        return cursor.fetchall()
+
+
+def _matchHistory(cursor, tournament_id):
+    """Load every pairing of a tournament in one query. Returns a tuple
+    (history, byes): a dict mapping each player id to the set of ids they
+    have played, and the set of players who had a bye."""
+    cursor.execute("""
+                   select winner_id, loser_id from matches
+                   where tournament_id = %(id)s
+                   """, {'id': tournament_id})
+    history = {}
+    byes = set()
+    for winner, loser in cursor:
+        if loser is None:
+            byes.add(winner)
+            continue
+        history.setdefault(winner, set()).add(loser)
+        history.setdefault(loser, set()).add(winner)
+    return history, byes
+
+
+# noinspection PyPep8Naming
+@_routed
+def rebuildStandings(tournament_id=None):
+    """Recomputes the standings of a tournament, or of all tournaments, from
+    the matches table."""
+    with connect() as db:
+        cursor = db.cursor()
+        _standingsChanged(tournament_id)
+        cursor.execute("select rebuild_standings(%(id)s)",
+                       {'id': tournament_id})
+
+
+# noinspection PyPep8Naming
+@_routed
+def rebuildRatings(tournament_id=None):
+    """Recomputes the ratings of a tournament, or of all tournaments, by
+    replaying their matches rating period by rating period. Archived
+    tournaments keep the ratings they were archived with.
+
+    Matches are streamed from a server-side cursor, so memory use follows
+    the number of players rather than the length of the history.
+    """
+    with connect() as db:
+        cursor = db.cursor()
+        _standingsChanged(tournament_id)
+        cursor.execute("""
+                       update ratings
+                       set rating = default, deviation = default,
+                           volatility = default
+                       where (%(id)s is null or tournament_id = %(id)s)
+                         and tournament_id not in (
+                             select id from tournaments where archived)
+                       """, {'id': tournament_id})
+        matches = db.cursor('rating_replay')
+        matches.itersize = 10000
+        matches.execute("""
+                        select matches.tournament_id,
+                               tournaments.rating_system,
+                               matches.rating_period, matches.winner_id,
+                               matches.loser_id, matches.result
+                        from matches
+                        join tournaments
+                            on tournaments.id = matches.tournament_id
+                        where %(id)s is null
+                           or matches.tournament_id = %(id)s
+                        order by matches.tournament_id,
+                                 matches.rating_period, matches.id
+                        """, {'id': tournament_id})
+        for (_, system), rows in itertools.groupby(
+                matches, lambda row: row[:2]):
+            _updateRatings(cursor, rating.replay(
+                system, (row[2:] for row in rows)))
+        matches.close()
+
+
+# noinspection PyPep8Naming
+@_routed
+def checkStandings(tournament_id=None):
+    """Compares the standings table against the played_matches and
+    won_matches views and the match_results view, which aggregate the
+    matches table directly. Only the given tournament is checked, or all of
+    them when none is given; archived tournaments are skipped.
+
+    Returns:
+      A list of tuples, one per player whose stored standings disagree,
+      each of which contains (id, stored, expected); stored and expected are
+      (wins, matches, points, opponent_points) tuples, the stored
+      opponent_points being summed from the opponents' stored points. An
+      empty list means the standings table is consistent.
+    """
+    with connect() as db:
+        cursor = db.cursor()
+        cursor.execute(
+            """
+            with totals as (
+                select played.id, won.win_count, played.total_count,
+                       coalesce(sum(results.points), 0) as points
+                from played_matches played
+                join won_matches won
+                    on won.tournament_id = played.tournament_id
+                   and won.id = played.id
+                left join match_results results
+                    on results.tournament_id = played.tournament_id
+                   and results.player_id = played.id
+                where (%(id)s is null or played.tournament_id = %(id)s)
+                  and played.tournament_id not in (
+                      select id from tournaments where archived)
+                group by played.id, won.win_count, played.total_count
+            ), opponents as (
+                select results.player_id, sum(totals.points) as points
+                from match_results results
+                join totals on totals.id = results.opponent_id
+                where %(id)s is null or results.tournament_id = %(id)s
+                group by results.player_id
+            )
+            select totals.id,
+                   standings.wins, standings.matches, standings.points,
+                   coalesce(stored.points, 0),
+                   totals.win_count, totals.total_count, totals.points,
+                   coalesce(opponents.points, 0)
+            from totals
+            left join standings on standings.player_id = totals.id
+            left join opponent_points stored
+                on stored.tournament_id = standings.tournament_id
+               and stored.player_id = totals.id
+            left join opponents on opponents.player_id = totals.id
+            where (standings.wins, standings.matches, standings.points,
+                   coalesce(stored.points, 0))
+                  is distinct from
+                  (totals.win_count, totals.total_count, totals.points,
+                   coalesce(opponents.points, 0))
+            """, {'id': tournament_id}
+        )
+        return [(row[0], row[1:5], row[5:9]) for row in cursor.fetchall()]
+
+
+# noinspection PyPep8Naming
+@_routed
+def startRound(tournament_id=None):
+    """Opens the next round of a tournament and returns its number.
+
+    Results reported from then on belong to this round. A pairing is only
+    recorded once per round, so judges may safely resubmit a result.
+    """
+    with connect() as db:
+        cursor = db.cursor()
+        cursor.execute("""
+                       insert into rounds (tournament_id, number)
+                       select %(id)s, coalesce(max(number), 0) + 1
+                       from rounds where tournament_id = %(id)s
+                       returning number
+                       """, {'id': _tournamentId(cursor, tournament_id)})
+        return cursor.fetchone()[0]
+
+
+# noinspection PyPep8Naming
+@_routed
+def reportMatch(winner, loser, tournament_id=None, result='win',
+                round_number=None, submission=None):
     """Records the outcome of a single match between two players.
 
+    Reporting a pairing again in the same round is idempotent: the match
+    recorded first is kept, and a different result for it is rejected.
+    Before the first round is started the same players may meet more than
+    once, so only reports under the same submission key are recognised as
+    repeats. This holds for concurrent submissions too. Only the rows of
+    the two players are locked, so reports of other matches go ahead
+    meanwhile.
+
     Args:
       winner:  the id number of the player who won
-      loser:  the id number of the player who lost
+      loser:  the id number of the player who lost, None for a bye
+      tournament_id: the tournament the match belongs to; may be left out
+        while the database holds a single tournament.
+      result: one of RESULTS; for a draw the order of the players does not
+        matter
+      round_number: the round the match was played in; defaults to the
+        tournament's latest round, see startRound()
+      submission: a key the client chose for this report, such as the
+        number of the score sheet, so that it can safely send the report
+        again; unique within the tournament
+
+    Returns:
+      The id of the recorded match.
     """
-    db = connect()
-    cursor = db.cursor()
+    if result not in RESULTS:
+        raise ValueError("unknown result %r" % (result,))
+    if (result == 'bye') != (loser is None):
+        raise ValueError("a bye, and only a bye, has no loser")
+    with connect() as db:
+        cursor = db.cursor()
+        tournament_id = _tournamentId(cursor, tournament_id)
+        _standingsChanged(tournament_id)
 
-    # Get tournament id. We should have only now for this demo project
-    cursor.execute("select id from tournaments")
-    tournament_id = cursor.fetchone()[0]
+        # Store the match data now, unless the pairing was already reported
+        # in this round
+        _execute(cursor, 'report_match',
+                 {'winner_id': winner, 'loser_id': loser,
+                  'tournament_id': tournament_id, 'result': result,
+                  'round': round_number, 'submission': submission})
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute("""
+                           select id from players
+                           where tournament_id = %s and id = any(%s)
+                           """, (tournament_id, [winner, loser]))
+            error = _resultError(winner, loser, result,
+                                 set(row[0] for row in cursor.fetchall()))
+            match = None
+            if error is None and submission is not None:
+                cursor.execute("""
+                               select id, winner_id, loser_id, result
+                               from matches
+                               where tournament_id = %s and submission = %s
+                               """, (tournament_id, submission))
+                match = cursor.fetchone()
+            if match is not None:
+                match_id, error = _submittedBefore(match, winner, loser,
+                                                   result)
+            elif error is None:
+                [(match_id, error)] = _reportedBefore(
+                    cursor, tournament_id, round_number,
+                    [(winner, loser, result)])
+            if error is not None:
+                raise ValueError(error)
+            return match_id
+        _rateMatches(cursor, tournament_id, [(winner, loser, result)])
+        return row[0]
 
-    # Store the match data now
-    cursor.execute("""
-                   insert into matches (tournament_id, winner_id, loser_id)
-                   values( %(tournament_id)s, %(winner_id)s, %(loser_id)s)
-                   """, {'winner_id': winner, 'loser_id': loser,
-                         'tournament_id': tournament_id})
-    db.commit()
-    db.close()
+
+# noinspection PyPep8Naming
+@_routed
+def reportMatches(results, tournament_id=None, round_number=None):
+    """Records the outcome of a batch of matches in a single transaction.
+
+    The whole batch is validated up front and the valid matches are written
+    with multi-row inserts, so a round's worth of results costs a handful of
+    round trips instead of two per match. The batch is rated as a single
+    rating period, see rating.py. Pairings already reported in the round
+    are handled as in reportMatch().
+
+    Args:
+      results: iterable of (winner, loser) player id pairs, or of
+        (winner, loser, result) tuples to report anything but a win; see
+        reportMatch()
+      tournament_id: the tournament the matches belong to
+      round_number: the round the matches were played in; defaults to the
+        tournament's latest round
+
+    Returns:
+      A list with one (match_id, error) tuple per input pair, in order.
+      match_id is the id of the recorded match, or None if the pair was
+      rejected, in which case error says why.
+    """
+    results = [tuple(row) if len(row) == 3 else tuple(row) + ('win',)
+               for row in results]
+    outcomes = [None] * len(results)
+    with connect() as db:
+        cursor = db.cursor()
+        tournament_id = _tournamentId(cursor, tournament_id)
+        _standingsChanged(tournament_id)
+
+        # Fetch every player referenced by the batch in one query
+        player_ids = set()
+        for winner, loser, _ in results:
+            player_ids.update((winner, loser))
+        player_ids.discard(None)
+        cursor.execute("""
+                       select id from players
+                       where tournament_id = %(tournament_id)s
+                         and id = any(%(ids)s)
+                       """, {'tournament_id': tournament_id,
+                             'ids': list(player_ids)})
+        registered = set(row[0] for row in cursor.fetchall())
+
+        valid = []
+        for index, (winner, loser, result) in enumerate(results):
+            error = _resultError(winner, loser, result, registered)
+            if error is None:
+                valid.append(index)
+            else:
+                outcomes[index] = (None, error)
+
+        cursor.execute("""
+                       select nextval('rating_periods'),
+                              coalesce(%(round)s, (
+                                  select max(number) from rounds
+                                  where tournament_id = %(tournament_id)s))
+                       """, {'tournament_id': tournament_id,
+                             'round': round_number})
+        period, round_number = cursor.fetchone()
+        inserted = _insertMany(
+            cursor,
+            """
+            insert into matches (tournament_id, winner_id, loser_id, result,
+                                 rating_period, round)
+            values %s
+            on conflict do nothing
+            returning id, winner_id, loser_id
+            """,
+            "(%s, %s, %s, %s, %s, %s)",
+            [(tournament_id,) + tuple(results[index]) + (period, round_number)
+             for index in valid])
+
+        # Rows hitting a pairing already reported in the round return
+        # nothing; the others come back in order
+        recorded = []
+        duplicates = []
+        for index in valid:
+            if len(recorded) < len(inserted) and \
+                    tuple(inserted[len(recorded)][1:]) == results[index][:2]:
+                outcomes[index] = (inserted[len(recorded)][0], None)
+                recorded.append(index)
+            else:
+                duplicates.append(index)
+        if duplicates:
+            for index, outcome in zip(duplicates, _reportedBefore(
+                    cursor, tournament_id, round_number,
+                    [results[index] for index in duplicates])):
+                outcomes[index] = outcome
+        _rateMatches(cursor, tournament_id,
+                     [results[index] for index in recorded])
+    return outcomes
 
 
 # noinspection PyPep8Naming
-def swissPairings():
+@_routed
+def swissPairings(tournament_id=None):
     """Returns a list of pairs of players for the next round of a match.
 
-    Assuming that there are an even number of players registered, each player
-    appears exactly once in the pairing.py.  Each player is paired with another
-    player with an equal or nearly-equal win record, that is, a player adjacent
-    to him or her in the standings.
+    Players are paired within their score group, best placed first, and
+    never meet a previous opponent again unless the field cannot be paired
+    otherwise; see pairing.py. With an odd number of players the lowest
+    placed player who has not had one yet gets a bye and appears in a final
+    (id, name, None, None) entry; record it with reportMatch(id, None,
+    result='bye').
+
+    Args:
+      tournament_id: the tournament to pair; may be left out while the
+        database holds a single tournament.
 
     Returns:
       A list of tuples, each of which contains (id1, name1, id2, name2)
@@ -162,14 +1600,176 @@ def swissPairings():
         id2: the second player's unique id
         name2: the second player's name
     """
-    pairings = []
-    standings = playerStandings()
+    with connect() as db:
+        cursor = db.cursor()
+        tournament_id = _tournamentId(cursor, tournament_id)
+        standings = _standings(cursor, tournament_id)
+        history, byes = _matchHistory(cursor, tournament_id)
+
+    names = dict((row[0], row[1]) for row in standings)
+    pairs, bye = pairing.pairPlayers(
+        [(row[0], row[4]) for row in standings], history, byes)
+    pairings = [(first, names[first], second, names[second])
+                for first, second in pairs]
+    if bye is not None:
+        pairings.append((bye, names[bye], None, None))
+    return pairings
+
 
-    # loop through the sorted standings and push each 2 adjacent
-    # players to their own match
-    for index in range(0, len(standings), 2):
-        player_id, name, _, _ = standings[index]
-        oponnent_id, oponnent_name, _, _ = standings[index + 1]
-        pairings.append((player_id, name, oponnent_id, oponnent_name))
+def _bracketMatches(bracket_format, seeds, first_round, matches):
+    """Yields the matches of a bracket as bracketMatches() returns them,
+    given the tournament's reported (round, winner, loser, result) matches
+    from first_round on."""
+    offset = first_round - 1
+    results = dict(((round_number - offset,) + _pairKey(winner, loser),
+                    (winner, result))
+                   for round_number, winner, loser, result in matches
+                   if loser is not None)
+    for row in bracket.resolve(bracket.schedule(bracket_format, len(seeds)),
+                               seeds, results):
+        yield row[:2] + (row[2] + offset,) + row[3:]
 
+
+def _bracketPairings(matches):
+    """The (round, id1, id2) of the undecided matches, both of whose
+    players are known, of the earliest round holding any."""
+    pairings = []
+    for _, _, round_number, home, away, _, decided in matches:
+        if pairings and round_number > pairings[0][0]:
+            break
+        if home is not None and away is not None and not decided:
+            pairings.append((round_number, home, away))
     return pairings
+
+
+def _bracket(cursor, tournament_id):
+    """Return the format, seeds and first round of a tournament's bracket,
+    and its (round, winner, loser, result) matches from that round on."""
+    cursor.execute("""
+                   select format, seeds, first_round from brackets
+                   where tournament_id = %(id)s
+                   """, {'id': tournament_id})
+    row = cursor.fetchone()
+    if row is None:
+        raise ValueError("tournament %s has no bracket" % tournament_id)
+    cursor.execute("""
+                   select round, winner_id, loser_id, result from matches
+                   where tournament_id = %(id)s and round >= %(first)s
+                   """, {'id': tournament_id, 'first': row[2]})
+    return row + (cursor.fetchall(),)
+
+
+# noinspection PyPep8Naming
+@_routed
+def createBracket(bracket_format, size=None, tournament_id=None):
+    """Opens a playoff bracket seeded from the current standings, e.g. a
+    top-8 cut after the Swiss rounds, and returns its first round.
+
+    The bracket takes the rounds after the tournament's latest one, all
+    laid out at once, and only its seeds are stored; see bracket.py.
+    Matches are handed out by bracketPairings() and reported with
+    reportMatch(winner, loser, tournament_id, round_number=round). Byes are
+    decided without being reported, and a draw does not decide an
+    elimination match. A tournament has at most one bracket.
+
+    Args:
+      bracket_format: one of bracket.FORMATS
+      size: number of players seeded from the top of the standings;
+        everybody when left out
+      tournament_id: the tournament to seed the bracket from; may be left
+        out while the database holds a single tournament.
+    """
+    if bracket_format not in bracket.FORMATS:
+        raise ValueError("unknown bracket format %r" % (bracket_format,))
+    with connect() as db:
+        cursor = db.cursor()
+        tournament_id = _tournamentId(cursor, tournament_id)
+        seeds = [row[0] for row in _standings(cursor, tournament_id)][:size]
+        if len(seeds) < 2:
+            raise ValueError("a bracket needs at least two players")
+        cursor.execute("""
+                       insert into brackets (tournament_id, format, seeds,
+                                             first_round)
+                       select %(id)s, %(format)s, %(seeds)s,
+                              coalesce(max(number), 0) + 1
+                       from rounds where tournament_id = %(id)s
+                       on conflict do nothing
+                       returning first_round
+                       """, {'id': tournament_id, 'format': bracket_format,
+                             'seeds': seeds})
+        row = cursor.fetchone()
+        if row is None:
+            raise ValueError("tournament %s already has a bracket" %
+                             tournament_id)
+        first_round = row[0]
+        cursor.execute("""
+                       insert into rounds (tournament_id, number)
+                       select %(id)s, generate_series(%(first)s, %(last)s)
+                       """, {'id': tournament_id, 'first': first_round,
+                             'last': first_round - 1 + bracket.roundCount(
+                                 bracket_format, len(seeds))})
+        return first_round
+
+
+# noinspection PyPep8Naming
+@_routed
+def bracketMatches(tournament_id=None):
+    """Returns every match of a tournament's bracket as it stands.
+
+    Returns:
+      A list of (number, stage, round, id1, id2, winner, decided) tuples
+      ordered by round, see bracket.resolve(); round is the tournament's
+      round number. The winner of the last match won the bracket.
+    """
+    with connect() as db:
+        cursor = db.cursor()
+        bracket_format, seeds, first_round, matches = _bracket(
+            cursor, _tournamentId(cursor, tournament_id))
+    return list(_bracketMatches(bracket_format, seeds, first_round, matches))
+
+
+# noinspection PyPep8Naming
+@_routed
+def bracketPairings(tournament_id=None):
+    """Returns the bracket matches to play next: the undecided ones of the
+    earliest round whose players are both known. Empty once the bracket is
+    decided.
+
+    Returns:
+      A list of tuples, each of which contains (round, id1, name1, id2,
+      name2). Report the result with reportMatch(winner, loser,
+      tournament_id, round_number=round).
+    """
+    with connect() as db:
+        cursor = db.cursor()
+        tournament_id = _tournamentId(cursor, tournament_id)
+        bracket_format, seeds, first_round, matches = _bracket(
+            cursor, tournament_id)
+        cursor.execute("select id, name from players where id = any(%s)",
+                       (seeds,))
+        names = dict(cursor.fetchall())
+    return [(round_number, first, names[first], second, names[second])
+            for round_number, first, second in _bracketPairings(
+                _bracketMatches(bracket_format, seeds, first_round, matches))]
+
+
+if __name__ == '__main__':
+    import sys
+
+    commands = {
+        'archive': archiveTournament,
+        'rebuild-standings': rebuildStandings,
+        'rebuild-ratings': rebuildRatings,
+        'check-standings': checkStandings,
+        'export-csv': functools.partial(exportStandingsCsv, sys.stdout),
+        'export-jsonl': functools.partial(exportStandingsJsonLines,
+                                          sys.stdout),
+    }
+    if len(sys.argv) not in (2, 3) or sys.argv[1] not in commands:
+        sys.exit("usage: tournament.py {%s} [tournament_id]" %
+                 ",".join(sorted(commands)))
+    result = commands[sys.argv[1]](*[int(arg) for arg in sys.argv[2:]])
+    if result:
+        for row in result:
+            print(row)
+        sys.exit(1)
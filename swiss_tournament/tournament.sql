@@ -11,15 +11,59 @@ DROP DATABASE IF EXISTS "tournament";
 CREATE DATABASE "tournament";
 \c "tournament";
 
+-- schemas
+-- Schema: archive
+-- Holds the detached matches partitions of archived tournaments.
+CREATE SCHEMA archive;
+
+
+-- sequences
+-- Sequence: rating_periods
+-- Numbers the rating periods of rating.py; every reportMatch() call and
+-- reportMatches() batch takes one.
+CREATE SEQUENCE rating_periods;
+
+
 -- tables
+-- Table: brackets
+-- The playoff bracket of a tournament, opened by createBracket(). Its
+-- matches follow from the format and the seeds, player ids best first (see
+-- bracket.py), and are played in the rounds from first_round on.
+CREATE TABLE brackets (
+    tournament_id int  NOT NULL,
+    format text  NOT NULL,
+    seeds int[]  NOT NULL,
+    first_round int  NOT NULL,
+    CONSTRAINT brackets_pk PRIMARY KEY (tournament_id),
+    CONSTRAINT brackets_format
+        CHECK (format IN ('single', 'double', 'round_robin'))
+);
+
+
 -- Table: matches
+-- result is one of 'win', 'draw', 'forfeit' or 'bye'. For a draw the two
+-- players are stored in either order; a bye has no loser. round is null
+-- for matches reported before the tournament's first round was started.
+-- submission is the key a client may report a match under, see
+-- reportMatch().
+-- Partitioned by tournament, one matches_<id> partition each, created and
+-- dropped with the tournament by the triggers below; every query names its
+-- tournament, so it only ever reads that event's partition. Finished
+-- tournaments are detached by archive_matches().
 CREATE TABLE matches (
     id serial  NOT NULL,
     winner_id int  NOT NULL,
-    loser_id int  NOT NULL,
+    loser_id int  NULL,
     tournament_id int  NOT NULL,
-    CONSTRAINT matches_pk PRIMARY KEY (id)
-);
+    result text  NOT NULL DEFAULT 'win',
+    rating_period int  NOT NULL DEFAULT nextval('rating_periods'),
+    round int  NULL,
+    submission text  NULL,
+    CONSTRAINT matches_pk PRIMARY KEY (tournament_id, id),
+    CONSTRAINT matches_result
+        CHECK (result IN ('win', 'draw', 'forfeit', 'bye')),
+    CONSTRAINT matches_bye CHECK ((result = 'bye') = (loser_id IS NULL))
+) PARTITION BY LIST (tournament_id);
 
 
 -- Table: players
@@ -32,33 +76,150 @@ CREATE TABLE players (
 );
 
 
+-- Table: ratings
+-- One row per player with their rating under the tournament's rating
+-- system; deviation and volatility are only used by Glicko-2. Updated by
+-- reportMatch() and reportMatches() in the same transaction as the match.
+CREATE TABLE ratings (
+    player_id int  NOT NULL,
+    tournament_id int  NOT NULL,
+    rating float  NOT NULL DEFAULT 1500,
+    deviation float  NOT NULL DEFAULT 350,
+    volatility float  NOT NULL DEFAULT 0.06,
+    CONSTRAINT ratings_pk PRIMARY KEY (player_id)
+);
+
+
+-- Table: rounds
+-- The rounds of a tournament, numbered from 1 and opened by startRound().
+-- Results are reported into the latest round unless told otherwise.
+CREATE TABLE rounds (
+    tournament_id int  NOT NULL,
+    number int  NOT NULL,
+    CONSTRAINT rounds_pk PRIMARY KEY (tournament_id, number)
+);
+
+
+-- Table: standings
+-- One row per player holding the aggregates playerStandings() reports.
+-- Kept current by the triggers on players and matches below, which add
+-- each match to the rows of its two players only.
+CREATE TABLE standings (
+    player_id int  NOT NULL,
+    tournament_id int  NOT NULL,
+    wins int  NOT NULL DEFAULT 0,
+    matches int  NOT NULL DEFAULT 0,
+    points float  NOT NULL DEFAULT 0,
+    CONSTRAINT standings_pk PRIMARY KEY (player_id)
+);
+
+
 -- Table: tournaments
+-- The *_points columns configure how many points each result is worth.
+-- A forfeit scores like a win for the winner and a loss for the loser.
+-- rating_system is 'elo' or 'glicko2', see rating.py. An archived
+-- tournament's matches were moved to archive.matches_<id>; it is read-only.
 CREATE TABLE tournaments (
     id serial  NOT NULL,
     name text  NOT NULL,
     information text  NULL,
-    CONSTRAINT tournaments_pk PRIMARY KEY (id)
+    win_points float  NOT NULL DEFAULT 1,
+    draw_points float  NOT NULL DEFAULT 0.5,
+    loss_points float  NOT NULL DEFAULT 0,
+    bye_points float  NOT NULL DEFAULT 1,
+    rating_system text  NOT NULL DEFAULT 'elo',
+    archived boolean  NOT NULL DEFAULT false,
+    CONSTRAINT tournaments_pk PRIMARY KEY (id),
+    CONSTRAINT tournaments_rating_system
+        CHECK (rating_system IN ('elo', 'glicko2'))
 );
 
 
 -- views
 -- View: played_matches
 CREATE VIEW played_matches AS
-select players.id, players.name, count(matches.id) as total_count
+select players.id, players.tournament_id, players.name,
+       count(matches.id) as total_count
         from players left join matches
-            on matches.winner_id = players.id
-                or matches.loser_id = players.id
+            on matches.tournament_id = players.tournament_id
+                and (matches.winner_id = players.id
+                     or matches.loser_id = players.id)
         group by players.id;
 
 
 -- View: won_matches
+-- Byes and forfeits count as wins, draws do not.
 CREATE VIEW won_matches AS
-select players.id, players.name, count(matches.id) as win_count
+select players.id, players.tournament_id, players.name,
+       count(matches.id) as win_count
         from players left join matches
-             on matches.winner_id = players.id
+             on matches.tournament_id = players.tournament_id
+                and matches.winner_id = players.id
+                and matches.result <> 'draw'
         group by players.id;
 
 
+-- View: match_results
+-- One row per player and match, with the share of the game the player won
+-- (1, 0.5 or 0) and the points it earned them. Filtering on tournament_id
+-- and player_id is answered from the two matches indexes.
+CREATE VIEW match_results AS
+select matches.id as match_id, matches.tournament_id, matches.result,
+       matches.winner_id as player_id, matches.loser_id as opponent_id,
+       case matches.result when 'draw' then 0.5 else 1 end as share,
+       case matches.result when 'draw' then tournaments.draw_points
+                           when 'bye' then tournaments.bye_points
+                           else tournaments.win_points end as points
+        from matches join tournaments
+             on tournaments.id = matches.tournament_id
+union all
+select matches.id, matches.tournament_id, matches.result,
+       matches.loser_id, matches.winner_id,
+       case matches.result when 'draw' then 0.5 else 0 end,
+       case matches.result when 'draw' then tournaments.draw_points
+                           else tournaments.loss_points end
+        from matches join tournaments
+             on tournaments.id = matches.tournament_id
+        where matches.loser_id is not null;
+
+
+-- View: opponent_points
+-- The summed points of each player's opponents (Buchholz), which orders
+-- players on equal points. Summed when read rather than stored: a result
+-- changes it for every earlier opponent of both players, and keeping it
+-- stored had concurrent reporters wait on each other's rows.
+CREATE VIEW opponent_points AS
+select played.tournament_id, played.player_id,
+       sum(opponent.points) as points
+        from match_results played
+        join standings opponent on opponent.player_id = played.opponent_id
+        group by played.tournament_id, played.player_id;
+
+
+-- indexes
+-- Every query is scoped by tournament, so its cost follows the size of one
+-- event rather than the whole match history.
+CREATE INDEX matches_tournament_winner ON matches (tournament_id, winner_id);
+
+CREATE INDEX matches_tournament_loser ON matches (tournament_id, loser_id);
+
+CREATE INDEX players_tournament ON players (tournament_id);
+
+-- A pairing is reported at most once per round, in either order; a bye is
+-- the player paired with nobody, which least() and greatest() skip over.
+-- reportMatch() relies on it to make concurrent submissions idempotent.
+CREATE UNIQUE INDEX matches_round_pairing
+    ON matches (tournament_id, round, least(winner_id, loser_id),
+                greatest(winner_id, loser_id));
+
+-- The index above leaves matches without a round alone, as the same
+-- players may meet again; reports under a submission key are recorded
+-- once per tournament, whether a round was started or not.
+CREATE UNIQUE INDEX matches_submission ON matches (tournament_id, submission);
+
+CREATE INDEX standings_rank ON standings (tournament_id, points DESC);
+
+
 -- foreign keys
 -- Reference:  match_winner (table: matches)
 ALTER TABLE matches ADD CONSTRAINT match_winner
@@ -89,4 +250,300 @@ ALTER TABLE matches ADD CONSTRAINT match_tournament
     REFERENCES tournaments (id)
     NOT DEFERRABLE
 ;
+
+-- Reference:  match_round (table: matches)
+ALTER TABLE matches ADD CONSTRAINT match_round
+    FOREIGN KEY (tournament_id, round)
+    REFERENCES rounds (tournament_id, number)
+    NOT DEFERRABLE
+;
+
+-- Reference:  round_tournament (table: rounds)
+ALTER TABLE rounds ADD CONSTRAINT round_tournament
+    FOREIGN KEY (tournament_id)
+    REFERENCES tournaments (id)
+    NOT DEFERRABLE
+;
+
+-- Reference:  bracket_tournament (table: brackets)
+ALTER TABLE brackets ADD CONSTRAINT bracket_tournament
+    FOREIGN KEY (tournament_id)
+    REFERENCES tournaments (id)
+    NOT DEFERRABLE
+;
+
+-- Reference:  standings_player (table: standings)
+ALTER TABLE standings ADD CONSTRAINT standings_player
+    FOREIGN KEY (player_id)
+    REFERENCES players (id)
+    ON DELETE CASCADE
+    NOT DEFERRABLE
+;
+
+-- Reference:  ratings_player (table: ratings)
+ALTER TABLE ratings ADD CONSTRAINT ratings_player
+    FOREIGN KEY (player_id)
+    REFERENCES players (id)
+    ON DELETE CASCADE
+    NOT DEFERRABLE
+;
+
+
+-- functions
+-- Function: refresh_standings
+-- Recomputes wins, matches and points of the changed players with one
+-- aggregate over match_results. Every lookup goes through the
+-- (tournament_id, player) indexes on matches, so the cost does not grow
+-- with the size of the tournament. It runs once per tournament involved,
+-- so the partitions of all other tournaments are pruned before anything is
+-- read.
+CREATE FUNCTION refresh_standings(changed int[])
+RETURNS void AS $$
+DECLARE
+    tournament int;
+BEGIN
+    FOR tournament IN
+        SELECT DISTINCT tournament_id FROM standings
+        WHERE player_id = ANY(changed)
+    LOOP
+        UPDATE standings
+        SET (wins, matches, points) = (
+            SELECT count(*) FILTER (WHERE share = 1), count(*),
+                   coalesce(sum(points), 0)
+            FROM match_results
+            WHERE tournament_id = tournament
+              AND player_id = standings.player_id)
+        WHERE tournament_id = tournament AND player_id = ANY(changed);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Function: rebuild_standings
+-- Recomputes the standings of one tournament, or of all of them when the
+-- argument is null, from scratch. Archived tournaments are left alone:
+-- their matches are no longer there to recompute from.
+CREATE FUNCTION rebuild_standings(tournament int) RETURNS void AS $$
+    INSERT INTO standings (player_id, tournament_id)
+    SELECT id, tournament_id FROM players
+    WHERE (tournament IS NULL OR tournament_id = tournament)
+      AND tournament_id NOT IN (SELECT id FROM tournaments WHERE archived)
+      AND id NOT IN (SELECT player_id FROM standings);
+
+    SELECT refresh_standings(array_agg(player_id))
+    FROM standings
+    WHERE (tournament IS NULL OR tournament_id = tournament)
+      AND tournament_id NOT IN (SELECT id FROM tournaments WHERE archived);
+$$ LANGUAGE sql;
+
+
+-- Function: archive_matches
+-- Moves the matches partition of a finished tournament to
+-- archive.matches_<id> once archiveTournament() has marked the tournament
+-- archived and detached the partition, so the live partitions only hold
+-- running events. The detach happens outside of this function, as
+-- DETACH PARTITION CONCURRENTLY cannot run in a transaction. The archived
+-- table keeps its rows but drops its foreign keys, which would otherwise pin
+-- the players and rounds it mentions.
+CREATE FUNCTION archive_matches(tournament int) RETURNS void AS $$
+DECLARE
+    partition text := 'matches_' || tournament;
+    foreign_key text;
+BEGIN
+    FOR foreign_key IN
+        SELECT conname FROM pg_constraint
+        WHERE conrelid = partition::regclass AND contype = 'f'
+    LOOP
+        EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I',
+                       partition, foreign_key);
+    END LOOP;
+    EXECUTE format('ALTER TABLE %I SET SCHEMA archive', partition);
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Function: matches_partition_create
+-- Opens the matches partition of a new tournament.
+CREATE FUNCTION matches_partition_create() RETURNS trigger AS $$
+BEGIN
+    EXECUTE format('CREATE TABLE %I PARTITION OF matches FOR VALUES IN (%s)',
+                   'matches_' || NEW.id, NEW.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Function: matches_partition_drop
+-- Drops the matches partition of a deleted tournament. Runs after the
+-- foreign key checks, so a tournament with matches still cannot be
+-- deleted.
+CREATE FUNCTION matches_partition_drop() RETURNS trigger AS $$
+BEGIN
+    EXECUTE format('DROP TABLE IF EXISTS %I', 'matches_' || OLD.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Function: matches_archive_drop
+-- Clears out an archived tournament about to be deleted: its archived
+-- matches, and the rounds and bracket deleteMatches() leaves alone.
+CREATE FUNCTION matches_archive_drop() RETURNS trigger AS $$
+BEGIN
+    EXECUTE format('DROP TABLE IF EXISTS archive.%I', 'matches_' || OLD.id);
+    DELETE FROM brackets WHERE tournament_id = OLD.id;
+    DELETE FROM rounds WHERE tournament_id = OLD.id;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Function: standings_players_inserted
+-- Gives new players their standings row and an initial rating.
+CREATE FUNCTION standings_players_inserted() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO standings (player_id, tournament_id)
+    SELECT id, tournament_id FROM inserted_players;
+    INSERT INTO ratings (player_id, tournament_id)
+    SELECT id, tournament_id FROM inserted_players;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Function: standings_matches_changed
+-- Shared body of the matches triggers: adds the given matches to the
+-- standings of their players (direction 1), or takes them off again
+-- (direction -1), scored as in match_results. Only the players' own rows
+-- are locked, in player order so that reporters sharing players cannot
+-- deadlock; reports of other players' matches go ahead at the same time.
+CREATE FUNCTION standings_matches_changed(tournaments int[], winners int[],
+                                          losers int[], results text[],
+                                          direction int)
+RETURNS void AS $$
+BEGIN
+    PERFORM 1 FROM standings
+    WHERE player_id = ANY(winners || losers)
+    ORDER BY player_id
+    FOR UPDATE;
+
+    UPDATE standings
+    SET wins = standings.wins + direction * delta.wins,
+        matches = standings.matches + direction * delta.matches,
+        points = standings.points + direction * delta.points
+    FROM (
+        SELECT played.player_id,
+               count(*) FILTER (WHERE played.share = 1) AS wins,
+               count(*) AS matches, sum(played.points) AS points
+        FROM unnest(tournaments, winners, losers, results)
+            AS changed (tournament_id, winner_id, loser_id, result)
+        JOIN tournaments event ON event.id = changed.tournament_id
+        CROSS JOIN LATERAL (VALUES
+            (changed.winner_id,
+             CASE changed.result WHEN 'draw' THEN 0.5 ELSE 1 END,
+             CASE changed.result WHEN 'draw' THEN event.draw_points
+                                 WHEN 'bye' THEN event.bye_points
+                                 ELSE event.win_points END),
+            (changed.loser_id,
+             CASE changed.result WHEN 'draw' THEN 0.5 ELSE 0 END,
+             CASE changed.result WHEN 'draw' THEN event.draw_points
+                                 ELSE event.loss_points END))
+            AS played (player_id, share, points)
+        WHERE played.player_id IS NOT NULL
+        GROUP BY played.player_id
+    ) delta
+    WHERE standings.player_id = delta.player_id;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Function: standings_matches_inserted
+CREATE FUNCTION standings_matches_inserted() RETURNS trigger AS $$
+BEGIN
+    PERFORM standings_matches_changed(
+        array_agg(tournament_id), array_agg(winner_id),
+        array_agg(loser_id), array_agg(result), 1)
+    FROM inserted_matches;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Function: standings_matches_deleted
+CREATE FUNCTION standings_matches_deleted() RETURNS trigger AS $$
+BEGIN
+    PERFORM standings_matches_changed(
+        array_agg(tournament_id), array_agg(winner_id),
+        array_agg(loser_id), array_agg(result), -1)
+    FROM deleted_matches;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Function: standings_notify
+-- Announces the tournaments whose standings or ratings changed on the
+-- standings channel, for the standings cache of tournament.py (see
+-- setStandingsCache). Notifications are delivered on commit, once per
+-- tournament and transaction.
+CREATE FUNCTION standings_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('standings', tournament_id::text)
+    FROM (SELECT DISTINCT tournament_id FROM changed_rows) changed;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- triggers
+-- Statement level, so bulk inserts (reportMatches, registerPlayers) update
+-- the standings once per statement rather than once per row.
+CREATE TRIGGER players_standings
+    AFTER INSERT ON players
+    REFERENCING NEW TABLE AS inserted_players
+    FOR EACH STATEMENT EXECUTE PROCEDURE standings_players_inserted();
+
+CREATE TRIGGER matches_standings_insert
+    AFTER INSERT ON matches
+    REFERENCING NEW TABLE AS inserted_matches
+    FOR EACH STATEMENT EXECUTE PROCEDURE standings_matches_inserted();
+
+CREATE TRIGGER matches_standings_delete
+    AFTER DELETE ON matches
+    REFERENCING OLD TABLE AS deleted_matches
+    FOR EACH STATEMENT EXECUTE PROCEDURE standings_matches_deleted();
+
+CREATE TRIGGER tournaments_partition_create
+    AFTER INSERT ON tournaments
+    FOR EACH ROW EXECUTE PROCEDURE matches_partition_create();
+
+CREATE TRIGGER tournaments_partition_drop
+    AFTER DELETE ON tournaments
+    FOR EACH ROW EXECUTE PROCEDURE matches_partition_drop();
+
+CREATE TRIGGER tournaments_archive_drop
+    BEFORE DELETE ON tournaments
+    FOR EACH ROW WHEN (OLD.archived)
+    EXECUTE PROCEDURE matches_archive_drop();
+
+-- Ratings order players tied on points, so they count as standings here
+CREATE TRIGGER standings_notify_insert
+    AFTER INSERT ON standings
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE standings_notify();
+
+CREATE TRIGGER standings_notify_update
+    AFTER UPDATE ON standings
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE standings_notify();
+
+CREATE TRIGGER standings_notify_delete
+    AFTER DELETE ON standings
+    REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE standings_notify();
+
+CREATE TRIGGER ratings_notify_update
+    AFTER UPDATE ON ratings
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE standings_notify();
 -- End of file.
\ No newline at end of file
@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+#
+# tournament_async.py -- asyncio variant of tournament.py
+#
+# The tournament functions as coroutines on an asyncpg connection pool, for
+# servers taking results from many clients at once:
+#
+#     await tournament_async.reportMatch(winner, loser, tournament_id)
+#
+# Semantics are those of tournament.py: standings are kept by the triggers
+# of tournament.sql, and pairings, ratings and result validation use the
+# same Python code. Needs Python 3.7 or later and asyncpg.
+
+import contextlib
+import csv
+
+import asyncpg
+
+import pairing
+import rating
+from tournament import (POOL_MAX_SIZE, POOL_MIN_SIZE, RESULTS, _pairKey,
+                        _resultError, _sameResult, _submittedBefore)
+
+# Keyword arguments for asyncpg.connect(). Host, user and password come
+# from the usual PG* environment variables.
+CONNECT_ARGS = {'database': 'tournament'}
+
+_pool = None
+
+
+# noinspection PyPep8Naming
+async def configurePool(min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                        **connect_args):
+    """(Re)create the connection pool used by every function in this module.
+
+    Args:
+      min_size: number of connections opened eagerly and kept around
+      max_size: maximum number of connections handed out at the same time
+      connect_args: arguments for asyncpg.connect(), CONNECT_ARGS by default
+    """
+    global _pool
+    await closePool()
+    _pool = await asyncpg.create_pool(min_size=min_size, max_size=max_size,
+                                      **(connect_args or CONNECT_ARGS))
+
+
+# noinspection PyPep8Naming
+async def closePool():
+    """Close every pooled connection. The pool is rebuilt on next use."""
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        await pool.close()
+
+
+async def _getPool():
+    global _pool
+    if _pool is None:
+        pool = await asyncpg.create_pool(min_size=POOL_MIN_SIZE,
+                                         max_size=POOL_MAX_SIZE,
+                                         **CONNECT_ARGS)
+        # Another task may have won the race while this one was connecting
+        if _pool is None:
+            _pool = pool
+        else:
+            await pool.close()
+    return _pool
+
+
+@contextlib.asynccontextmanager
+async def connect():
+    """Borrow a connection from the pool for one transaction, committed when
+    the block exits normally and rolled back if it raises."""
+    pool = await _getPool()
+    async with pool.acquire() as connection:
+        async with connection.transaction():
+            yield connection
+
+
+async def _tournamentId(connection, tournament_id=None):
+    """See tournament._tournamentId()."""
+    if tournament_id is None:
+        rows = await connection.fetch("select id from tournaments limit 2")
+        if len(rows) != 1:
+            raise ValueError("tournament_id is required unless exactly one "
+                             "tournament exists")
+        tournament_id = rows[0][0]
+    return tournament_id
+
+
+async def _reportedBefore(connection, tournament_id, round_number, results):
+    """See tournament._reportedBefore()."""
+    rows = await connection.fetch("""
+                                  select matches.id, matches.winner_id,
+                                         matches.loser_id, matches.result
+                                  from matches
+                                  join unnest($3::int[], $4::int[])
+                                      as reported (winner, loser)
+                                    on least(matches.winner_id,
+                                             matches.loser_id)
+                                       = least(reported.winner,
+                                               reported.loser)
+                                   and greatest(matches.winner_id,
+                                                matches.loser_id)
+                                       = greatest(reported.winner,
+                                                  reported.loser)
+                                  where matches.tournament_id = $1
+                                    and matches.round = coalesce($2, (
+                                        select max(number) from rounds
+                                        where tournament_id = $1))
+                                  """, tournament_id, round_number,
+                                  [row[0] for row in results],
+                                  [row[1] for row in results])
+    stored = dict((_pairKey(row[1], row[2]), tuple(row)) for row in rows)
+    outcomes = []
+    for winner, loser, result in results:
+        match = stored[_pairKey(winner, loser)]
+        if _sameResult(match, winner, loser, result):
+            outcomes.append((match[0], None))
+        else:
+            outcomes.append((None, "a different result was already "
+                                   "reported for this pairing"))
+    return outcomes
+
+
+async def _deleteFrom(table, tournament_id):
+    async with connect() as connection:
+        if tournament_id is None:
+            await connection.execute("delete from %s" % table)
+        else:
+            await connection.execute(
+                "delete from %s where %s = $1" %
+                (table, 'id' if table == 'tournaments' else 'tournament_id'),
+                tournament_id)
+
+
+async def _rateMatches(connection, tournament_id, results):
+    """See tournament._rateMatches()."""
+    games = list(rating.ratedGames(results))
+    if not games:
+        return
+    player_ids = set(player for game in games for player in game[:2])
+    rows = await connection.fetch("""
+                                  select ratings.player_id, ratings.rating,
+                                         ratings.deviation,
+                                         ratings.volatility,
+                                         tournaments.rating_system
+                                  from ratings
+                                  join tournaments
+                                      on tournaments.id = ratings.tournament_id
+                                  where ratings.tournament_id = $1
+                                    and ratings.player_id = any($2::int[])
+                                  order by ratings.player_id
+                                  for update of ratings
+                                  """, tournament_id, list(player_ids))
+    if len(rows) != len(player_ids):
+        raise ValueError("players %s are not registered for tournament %s" %
+                         (sorted(player_ids - set(row[0] for row in rows)),
+                          tournament_id))
+    states = rating.ratePeriod(
+        rows[0][4], dict((row[0], tuple(row[1:4])) for row in rows), games)
+    await connection.execute("""
+                             update ratings
+                             set rating = new.rating,
+                                 deviation = new.deviation,
+                                 volatility = new.volatility
+                             from unnest($1::int[], $2::float8[],
+                                         $3::float8[], $4::float8[])
+                                 as new (player_id, rating, deviation,
+                                         volatility)
+                             where ratings.player_id = new.player_id
+                             """, *zip(*[(player,) + tuple(state)
+                                         for player, state in states.items()]))
+
+
+# noinspection PyPep8Naming
+async def createTournament(name, info, win_points=1, draw_points=0.5,
+                           loss_points=0, bye_points=1,
+                           rating_system=rating.ELO):
+    """See tournament.createTournament()."""
+    if rating_system not in rating.SYSTEMS:
+        raise ValueError("unknown rating system %r" % (rating_system,))
+    async with connect() as connection:
+        return await connection.fetchval("""
+                                         insert into tournaments (
+                                             name, information, win_points,
+                                             draw_points, loss_points,
+                                             bye_points, rating_system)
+                                         values ($1, $2, $3, $4, $5, $6, $7)
+                                         returning id
+                                         """, name, info, win_points,
+                                         draw_points, loss_points,
+                                         bye_points, rating_system)
+
+
+# noinspection PyPep8Naming
+async def deleteTournaments(tournament_id=None):
+    """See tournament.deleteTournaments()."""
+    await _deleteFrom('tournaments', tournament_id)
+
+
+# noinspection PyPep8Naming
+async def deleteMatches(tournament_id=None):
+    """See tournament.deleteMatches()."""
+    async with connect() as connection:
+        await connection.execute("""
+                                 delete from matches
+                                 where $1::int is null or tournament_id = $1
+                                 """, tournament_id)
+        await connection.execute("""
+                                 delete from brackets
+                                 where ($1::int is null or tournament_id = $1)
+                                   and tournament_id not in (
+                                       select id from tournaments
+                                       where archived)
+                                 """, tournament_id)
+        await connection.execute("""
+                                 delete from rounds
+                                 where ($1::int is null or tournament_id = $1)
+                                   and tournament_id not in (
+                                       select id from tournaments
+                                       where archived)
+                                 """, tournament_id)
+        await connection.execute("""
+                                 update ratings
+                                 set rating = default, deviation = default,
+                                     volatility = default
+                                 where ($1::int is null or tournament_id = $1)
+                                   and tournament_id not in (
+                                       select id from tournaments
+                                       where archived)
+                                 """, tournament_id)
+
+
+# noinspection PyPep8Naming
+async def deletePlayers(tournament_id=None):
+    """See tournament.deletePlayers()."""
+    await _deleteFrom('players', tournament_id)
+
+
+# noinspection PyPep8Naming
+async def countPlayers(tournament_id=None):
+    """See tournament.countPlayers()."""
+    async with connect() as connection:
+        return await connection.fetchval("""
+                                         select count(*) from players
+                                         where $1::int is null
+                                            or tournament_id = $1
+                                         """, tournament_id)
+
+
+# noinspection PyPep8Naming
+async def registerPlayer(name, tournament_id=None):
+    """See tournament.registerPlayer()."""
+    async with connect() as connection:
+        return await connection.fetchval(
+            """
+            insert into players (tournament_id, name) values ($1, $2)
+            returning id
+            """, await _tournamentId(connection, tournament_id), name)
+
+
+# noinspection PyPep8Naming
+async def registerPlayers(names, tournament_id=None):
+    """See tournament.registerPlayers(). The names are sent as one array
+    parameter rather than streamed."""
+    if hasattr(names, 'read'):
+        names = (row[0] for row in csv.reader(names) if row)
+    async with connect() as connection:
+        rows = await connection.fetch(
+            """
+            insert into players (tournament_id, name)
+            select $1, name
+            from unnest($2::text[]) with ordinality as import (name, position)
+            order by position
+            returning id
+            """, await _tournamentId(connection, tournament_id), list(names))
+        return sorted(row[0] for row in rows)
+
+
+async def _standings(connection, tournament_id):
+    # See tournament._standings()
+    return await connection.fetch("""
+                                  select players.id, players.name,
+                                         standings.wins, standings.matches,
+                                         standings.points
+                                  from standings
+                                  join players
+                                      on players.id = standings.player_id
+                                  join ratings
+                                      on ratings.player_id = standings.player_id
+                                  left join opponent_points opponents
+                                      on opponents.tournament_id
+                                         = standings.tournament_id
+                                     and opponents.player_id
+                                         = standings.player_id
+                                  where standings.tournament_id = $1
+                                  order by standings.points desc,
+                                           coalesce(opponents.points, 0) desc,
+                                           ratings.rating desc
+                                  """, tournament_id)
+
+
+# noinspection PyPep8Naming
+async def playerStandings(tournament_id=None):
+    """See tournament.playerStandings()."""
+    async with connect() as connection:
+        rows = await _standings(
+            connection, await _tournamentId(connection, tournament_id))
+        return [tuple(row)[:4] for row in rows]
+
+
+# noinspection PyPep8Naming
+async def playerRatings(tournament_id=None):
+    """See tournament.playerRatings()."""
+    async with connect() as connection:
+        rows = await connection.fetch(
+            """
+            select players.id, players.name,
+                   ratings.rating, ratings.deviation
+            from ratings
+            join players on players.id = ratings.player_id
+            where ratings.tournament_id = $1
+            order by ratings.rating desc, players.id
+            """, await _tournamentId(connection, tournament_id))
+        return [tuple(row) for row in rows]
+
+
+# noinspection PyPep8Naming
+async def startRound(tournament_id=None):
+    """See tournament.startRound()."""
+    async with connect() as connection:
+        return await connection.fetchval(
+            """
+            insert into rounds (tournament_id, number)
+            select $1, coalesce(max(number), 0) + 1
+            from rounds where tournament_id = $1
+            returning number
+            """, await _tournamentId(connection, tournament_id))
+
+
+# noinspection PyPep8Naming
+async def reportMatch(winner, loser, tournament_id=None, result='win',
+                      round_number=None, submission=None):
+    """See tournament.reportMatch()."""
+    if result not in RESULTS:
+        raise ValueError("unknown result %r" % (result,))
+    if (result == 'bye') != (loser is None):
+        raise ValueError("a bye, and only a bye, has no loser")
+    async with connect() as connection:
+        tournament_id = await _tournamentId(connection, tournament_id)
+        match_id = await connection.fetchval(
+            """
+            insert into matches (tournament_id, winner_id, loser_id, result,
+                                 round, submission)
+            select $1, $2, $3, $4, coalesce($5, (
+                select max(number) from rounds where tournament_id = $1)), $6
+            where (select count(*) from players
+                   where tournament_id = $1 and id in ($2, $3))
+                  = case when $3 is null then 1 else 2 end
+            on conflict do nothing
+            returning id
+            """, tournament_id, winner, loser, result, round_number,
+            submission)
+        if match_id is None:
+            registered = await connection.fetch("""
+                select id from players
+                where tournament_id = $1 and id = any($2::int[])
+                """, tournament_id, [winner, loser])
+            error = _resultError(winner, loser, result,
+                                 set(row['id'] for row in registered))
+            match = None
+            if error is None and submission is not None:
+                match = await connection.fetchrow("""
+                    select id, winner_id, loser_id, result from matches
+                    where tournament_id = $1 and submission = $2
+                    """, tournament_id, submission)
+            if match is not None:
+                match_id, error = _submittedBefore(tuple(match), winner,
+                                                   loser, result)
+            elif error is None:
+                [(match_id, error)] = await _reportedBefore(
+                    connection, tournament_id, round_number,
+                    [(winner, loser, result)])
+            if error is not None:
+                raise ValueError(error)
+            return match_id
+        await _rateMatches(connection, tournament_id,
+                           [(winner, loser, result)])
+        return match_id
+
+
+# noinspection PyPep8Naming
+async def reportMatches(results, tournament_id=None, round_number=None):
+    """See tournament.reportMatches(). The valid matches are inserted with a
+    single statement."""
+    results = [tuple(row) if len(row) == 3 else tuple(row) + ('win',)
+               for row in results]
+    outcomes = [None] * len(results)
+    async with connect() as connection:
+        tournament_id = await _tournamentId(connection, tournament_id)
+        player_ids = set(player for row in results for player in row[:2])
+        player_ids.discard(None)
+        rows = await connection.fetch("""
+                                      select id from players
+                                      where tournament_id = $1
+                                        and id = any($2::int[])
+                                      """, tournament_id, list(player_ids))
+        registered = set(row[0] for row in rows)
+
+        valid = []
+        for index, (winner, loser, result) in enumerate(results):
+            error = _resultError(winner, loser, result, registered)
+            if error is None:
+                valid.append(index)
+            else:
+                outcomes[index] = (None, error)
+
+        round_number = await connection.fetchval("""
+                                                 select coalesce($2, (
+                                                     select max(number)
+                                                     from rounds
+                                                     where tournament_id = $1))
+                                                 """, tournament_id,
+                                                 round_number)
+        recorded = []
+        duplicates = []
+        if valid:
+            winners, losers, kinds = zip(*[results[index] for index in valid])
+            inserted = await connection.fetch(
+                """
+                with period as (select nextval('rating_periods') as id)
+                insert into matches (tournament_id, winner_id, loser_id,
+                                     result, rating_period, round)
+                select $1, new.winner, new.loser, new.result, period.id,
+                       $5::int
+                from unnest($2::int[], $3::int[], $4::text[])
+                    with ordinality as new (winner, loser, result, position),
+                    period
+                order by new.position
+                on conflict do nothing
+                returning id, winner_id, loser_id
+                """, tournament_id, winners, losers, kinds, round_number)
+            # See tournament.reportMatches()
+            for index in valid:
+                if len(recorded) < len(inserted) and \
+                        tuple(inserted[len(recorded)][1:]) == \
+                        results[index][:2]:
+                    outcomes[index] = (inserted[len(recorded)][0], None)
+                    recorded.append(index)
+                else:
+                    duplicates.append(index)
+        if duplicates:
+            for index, outcome in zip(duplicates, await _reportedBefore(
+                    connection, tournament_id, round_number,
+                    [results[index] for index in duplicates])):
+                outcomes[index] = outcome
+        await _rateMatches(connection, tournament_id,
+                           [results[index] for index in recorded])
+    return outcomes
+
+
+async def _matchHistory(connection, tournament_id):
+    """See tournament._matchHistory()."""
+    history = {}
+    byes = set()
+    for winner, loser in await connection.fetch("""
+                                                select winner_id, loser_id
+                                                from matches
+                                                where tournament_id = $1
+                                                """, tournament_id):
+        if loser is None:
+            byes.add(winner)
+            continue
+        history.setdefault(winner, set()).add(loser)
+        history.setdefault(loser, set()).add(winner)
+    return history, byes
+
+
+# noinspection PyPep8Naming
+async def swissPairings(tournament_id=None):
+    """See tournament.swissPairings()."""
+    async with connect() as connection:
+        tournament_id = await _tournamentId(connection, tournament_id)
+        standings = await _standings(connection, tournament_id)
+        history, byes = await _matchHistory(connection, tournament_id)
+
+    names = dict((row[0], row[1]) for row in standings)
+    pairs, bye = pairing.pairPlayers(
+        [(row[0], row[4]) for row in standings], history, byes)
+    pairings = [(first, names[first], second, names[second])
+                for first, second in pairs]
+    if bye is not None:
+        pairings.append((bye, names[bye], None, None))
+    return pairings
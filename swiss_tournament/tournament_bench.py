@@ -0,0 +1,614 @@
+#!/usr/bin/env python
+#
+# Benchmarks for tournament.py. Run against a local, throwaway tournament
+# database (see tournament.sql); every benchmark wipes the tables first.
+#
+#     python tournament_bench.py --sizes 16,256,4096,100000 --memory \
+#         --output bench.jsonl --profile bench.prof
+#
+# times single calls of the hot tournament functions in events of each
+# size, with the number of queries they send (see setInstrumentation() in
+# tournament.py), and writes one JSON record per backend, size and
+# function, so runs can be compared for regressions.
+
+import argparse
+import contextlib
+import cProfile
+import json
+import logging
+import math
+import os
+import random
+import resource
+import sys
+import time
+import timeit
+from multiprocessing.pool import ThreadPool
+
+import psycopg2
+
+import bracket
+import pairing
+import rating
+import tournament
+from memory_backend import MemoryBackend
+
+
+@contextlib.contextmanager
+def unpooledConnect():
+    """Drop-in replacement for tournament.connect() that reconnects per call,
+    which is how the module behaved before connections were pooled."""
+    db = psycopg2.connect(tournament.DSN)
+    try:
+        yield db
+        db.commit()
+    finally:
+        db.close()
+
+
+def seed(players):
+    """Start a fresh tournament with the given number of players and return
+    their ids."""
+    tournament.deleteMatches()
+    tournament.deletePlayers()
+    tournament.deleteTournaments()
+    tournament.createTournament(name="Bench", info="tournament_bench.py")
+    for index in range(players):
+        tournament.registerPlayer("Player %d" % index)
+    return [row[0] for row in tournament.playerStandings()]
+
+
+def timeReportMatch(ids, matches):
+    """Return reportMatch calls per second for the given number of matches."""
+    pairs = [(ids[i % len(ids)], ids[(i + 1) % len(ids)])
+             for i in range(matches)]
+
+    def run():
+        for winner, loser in pairs:
+            tournament.reportMatch(winner, loser)
+
+    return matches / timeit.timeit(run, number=1)
+
+
+def benchPool(players=64, matches=1000):
+    ids = seed(players)
+    pooled = timeReportMatch(ids, matches)
+
+    pooled_connect = tournament.connect
+    tournament.connect = unpooledConnect
+    try:
+        unpooled = timeReportMatch(ids, matches)
+    finally:
+        tournament.connect = pooled_connect
+
+    print("reportMatch x%d: pooled %.0f/s, unpooled %.0f/s (%.1fx)" %
+          (matches, pooled, unpooled, pooled / unpooled))
+
+
+def benchReportMatches(players=256, matches=10000):
+    ids = seed(players)
+    pairs = [(ids[i % len(ids)], ids[(i + 1) % len(ids)])
+             for i in range(matches)]
+    looped = timeReportMatch(ids, matches)
+    batched = matches / timeit.timeit(
+        lambda: tournament.reportMatches(pairs), number=1)
+    print("%d matches: reportMatches %.0f/s, reportMatch loop %.0f/s "
+          "(%.1fx)" % (matches, batched, looped, batched / looped))
+
+
+def benchRegisterPlayers(players=20000):
+    seed(0)
+    names = ["Player %d" % index for index in range(players)]
+    batched = players / timeit.timeit(
+        lambda: tournament.registerPlayers(names), number=1)
+    seed(0)
+    looped = players / timeit.timeit(
+        lambda: [tournament.registerPlayer(name) for name in names], number=1)
+    print("%d players: registerPlayers %.0f/s, registerPlayer loop %.0f/s "
+          "(%.1fx)" % (players, batched, looped, batched / looped))
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def benchTournaments(tournaments=1000, players=16, rounds=4, workers=16):
+    """Play many small tournaments concurrently, one round at a time, and
+    report how long each event's round of pairing and reporting takes."""
+    seed(0)
+    tournament.configurePool(max_size=workers)
+    pool = ThreadPool(workers)
+
+    def register(index):
+        tournament_id = tournament.createTournament(
+            name="Bench %d" % index, info="tournament_bench.py")
+        tournament.registerPlayers(
+            ("Player %d" % n for n in range(players)), tournament_id)
+        return tournament_id
+
+    def play(tournament_id):
+        start = time.time()
+        pairings = tournament.swissPairings(tournament_id)
+        tournament.reportMatches([(pair[0], pair[2]) for pair in pairings],
+                                 tournament_id)
+        return time.time() - start
+
+    try:
+        ids = pool.map(register, range(tournaments))
+        start = time.time()
+        latencies = []
+        for _ in range(rounds):
+            latencies.extend(pool.map(play, ids))
+        elapsed = time.time() - start
+    finally:
+        pool.close()
+        tournament.configurePool()
+    print("%d concurrent tournaments x %d rounds: %.1fs, round p50 %.1fms "
+          "p99 %.1fms" % (tournaments, rounds, elapsed,
+                          percentile(latencies, 0.5) * 1000,
+                          percentile(latencies, 0.99) * 1000))
+
+
+def benchPairing(sizes=(16, 64, 256, 1024, 2048), rounds=11):
+    """Time the pairing engine alone over a simulated event per size."""
+    random.seed(0)
+    for players in sizes:
+        wins = dict((player, 0) for player in range(players))
+        history = dict((player, set()) for player in range(players))
+        slowest = 0
+        for _ in range(rounds):
+            standings = sorted(wins.items(), key=lambda row: -row[1])
+            start = time.time()
+            pairs, bye = pairing.pairPlayers(standings, history)
+            slowest = max(slowest, time.time() - start)
+            for first, second in pairs:
+                history[first].add(second)
+                history[second].add(first)
+                wins[random.choice((first, second))] += 1
+        print("pairPlayers, %d players x %d rounds: slowest round %.1fms" %
+              (players, rounds, slowest * 1000))
+
+
+def playEvent(players, rounds, tournament_id=None):
+    """Seed a tournament and play it out with swissPairings() and random
+    results."""
+    random.seed(0)
+    tournament.registerPlayers(("Player %d" % n for n in range(players)),
+                               tournament_id)
+    for _ in range(rounds):
+        pairings = tournament.swissPairings(tournament_id)
+        tournament.reportMatches(
+            [random.choice(((p[0], p[2]), (p[2], p[0])))
+             if p[2] is not None else (p[0], None, 'bye')
+             for p in pairings], tournament_id)
+
+
+def benchTiebreakers(players=5000, rounds=9, repeat=10):
+    seed(0)
+    playEvent(players, rounds)
+    elapsed = timeit.timeit(tournament.playerTiebreakers, number=repeat)
+    print("playerTiebreakers, %d players x %d rounds: %.1fms" %
+          (players, rounds, elapsed / repeat * 1000))
+
+
+def benchRatings(players=5000, rounds=9, history=10000000, period=5000):
+    """Time rebuildRatings() over a played event, then the replay engine
+    alone over a long synthetic history."""
+    seed(0)
+    playEvent(players, rounds)
+    elapsed = timeit.timeit(tournament.rebuildRatings, number=1)
+    print("rebuildRatings, %d players x %d rounds: %.1fms" %
+          (players, rounds, elapsed * 1000))
+
+    def matches(count):
+        for index in range(count):
+            winner = index * 7919 % players
+            yield (index // period, winner,
+                   (winner + 1 + index % (players - 1)) % players, 'win')
+
+    for system, count in ((rating.ELO, history),
+                          (rating.GLICKO2, history // 10)):
+        elapsed = timeit.timeit(
+            lambda: rating.replay(system, matches(count)), number=1)
+        print("rating.replay, %s, %d matches: %.1fs" %
+              (system, count, elapsed))
+
+
+def peakMemory():
+    """Peak resident set size of this process so far, in megabytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def benchExport(players=1000000, tournaments=100):
+    """Export a large history of standings, then load the same rows as
+    lists, and report how much each grows the peak memory of the process."""
+    seed(0)
+    tournament.deleteTournaments()
+    ids = []
+    for index in range(tournaments):
+        ids.append(tournament.createTournament(
+            name="Bench %d" % index, info="tournament_bench.py"))
+        tournament.registerPlayers(
+            ("Player %d" % n for n in range(players // tournaments)), ids[-1])
+
+    for name, export in (("CSV", tournament.exportStandingsCsv),
+                         ("JSON Lines", tournament.exportStandingsJsonLines)):
+        before = peakMemory()
+        start = time.time()
+        with open(os.devnull, 'w') as output:
+            export(output)
+        print("export %d standings as %s: %.1fs, peak memory +%.0fMB" %
+              (players, name, time.time() - start, peakMemory() - before))
+
+    before = peakMemory()
+    start = time.time()
+    rows = [tournament.playerStandings(tournament_id) for tournament_id in ids]
+    print("playerStandings for the same %d rows: %.1fs, peak memory +%.0fMB"
+          % (sum(len(chunk) for chunk in rows), time.time() - start,
+             peakMemory() - before))
+
+
+# Functions timed by benchCalls()
+CALLS = ('registerPlayer', 'reportMatch', 'playerStandings', 'swissPairings')
+
+
+def timeCall(samples, calls, function, *args, **kwargs):
+    """Call a tournament function, appending its (seconds, queries) to
+    samples[function name], and return its result. calls is the list the
+    instrumentation hook appends to."""
+    del calls[:]
+    result = function(*args, **kwargs)
+    call = calls[-1]
+    samples.setdefault(call['function'], []).append(
+        (call['wall_time'], call['queries']))
+    return result
+
+
+def benchCalls(players, rounds, sample=100):
+    """Play an event of the given size, timing sample registerPlayer() calls
+    and sample reportMatch() calls per round, and playerStandings() and
+    swissPairings() once per round. Everything else goes through the batch
+    functions. Returns a dict mapping each of CALLS to its samples."""
+    samples = {}
+    calls = []
+    seed(0)
+    tournament.setInstrumentation(hook=calls.append)
+    try:
+        for index in range(min(players, sample)):
+            timeCall(samples, calls, tournament.registerPlayer,
+                     "Player %d" % index)
+        tournament.registerPlayers(
+            "Player %d" % index for index in range(sample, players))
+        random.seed(0)
+        for _ in range(rounds):
+            pairings = timeCall(samples, calls, tournament.swissPairings)
+            results = [random.choice(((p[0], p[2], 'win'),
+                                      (p[2], p[0], 'win')))
+                       if p[2] is not None else (p[0], None, 'bye')
+                       for p in pairings]
+            for winner, loser, result in results[:sample]:
+                timeCall(samples, calls, tournament.reportMatch, winner,
+                         loser, result=result)
+            tournament.reportMatches(results[sample:])
+            timeCall(samples, calls, tournament.playerStandings)
+    finally:
+        tournament.setInstrumentation(False)
+    return samples
+
+
+def summarize(samples, **fields):
+    """Yield one record per function of samples, with the given fields."""
+    for name in CALLS:
+        seconds = [elapsed for elapsed, _ in samples[name]]
+        record = dict(fields)
+        record.update({
+            'function': name,
+            'calls': len(seconds),
+            'mean_ms': sum(seconds) / len(seconds) * 1000,
+            'p50_ms': percentile(seconds, 0.5) * 1000,
+            'p99_ms': percentile(seconds, 0.99) * 1000,
+            'queries_per_call': sum(queries for _, queries in samples[name]) /
+            float(len(seconds)),
+        })
+        yield record
+
+
+def benchSizes(sizes, rounds=None, sample=100, memory=False, output=None,
+               profile=None):
+    """Run benchCalls() for every size against PostgreSQL, and the
+    in-memory backend too if memory is set. Prints a line per record and
+    writes the records to output, an open file, as JSON Lines.
+
+    rounds defaults to log2 of the number of players, rounded up. With
+    profile set, cProfile statistics of the runs are saved to that file.
+    """
+    backends = [('postgresql', None)]
+    if memory:
+        backends.append(('memory', MemoryBackend))
+    profiler = cProfile.Profile() if profile else None
+    for backend, factory in backends:
+        for players in sizes:
+            event_rounds = rounds or int(math.ceil(math.log(players, 2)))
+            tournament.setBackend(factory and factory())
+            try:
+                if profiler:
+                    profiler.enable()
+                try:
+                    samples = benchCalls(players, event_rounds, sample)
+                finally:
+                    if profiler:
+                        profiler.disable()
+            finally:
+                tournament.setBackend(None)
+            for record in summarize(samples, backend=backend,
+                                    players=players, rounds=event_rounds):
+                print("%(function)s, %(backend)s, %(players)d players x "
+                      "%(rounds)d rounds: p50 %(p50_ms).2fms p99 "
+                      "%(p99_ms).2fms, %(queries_per_call).1f queries/call"
+                      % record)
+                if output is not None:
+                    output.write(json.dumps(record, sort_keys=True) + "\n")
+    if profiler:
+        profiler.dump_stats(profile)
+
+
+def pacedLatencies(function, calls, rate):
+    """Call function at a steady rate per second, as a server fielding that
+    many requests would, and return the latency of every call."""
+    latencies = []
+    due = time.time()
+    for _ in range(calls):
+        delay = due - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        start = time.time()
+        function()
+        latencies.append(time.time() - start)
+        due += 1.0 / rate
+    return latencies
+
+
+def benchPreparedStatements(players=256, calls=1000, rate=200, blocks=10):
+    """Latency of the hot calls with and without prepared statements. The
+    two alternate in blocks that each start from the same matches, as the
+    cost of reporting a match grows with the ones already reported."""
+    ids = seed(players)
+    random.seed(0)
+    functions = [
+        ('registerPlayer', lambda: tournament.registerPlayer("Late entry")),
+        ('reportMatch', lambda: tournament.reportMatch(
+            *random.sample(ids, 2))),
+        ('playerStandings', tournament.playerStandings),
+    ]
+    try:
+        for name, function in functions:
+            latencies = {False: [], True: []}
+            for _ in range(blocks):
+                for prepare in (False, True):
+                    tournament.configurePool(prepare=prepare)
+                    tournament.deleteMatches()
+                    latencies[prepare].extend(
+                        pacedLatencies(function, calls // blocks, rate))
+            unprepared, prepared = [percentile(latencies[prepare], 0.5) * 1000
+                                    for prepare in (False, True)]
+            print("%s x%d at %d/s: p50 %.3fms unprepared, %.3fms prepared "
+                  "(%.3fms saved)" % (name, calls, rate, unprepared, prepared,
+                                      unprepared - prepared))
+    finally:
+        tournament.configurePool()
+
+
+def benchStandingsCache(players=5000, polls=1000):
+    """Spectator displays polling playerStandings(), with and without the
+    standings cache."""
+    seed(players)
+    uncached = timeit.timeit(tournament.playerStandings, number=polls)
+    tournament.setStandingsCache(listen=True)
+    try:
+        cached = timeit.timeit(tournament.playerStandings, number=polls)
+    finally:
+        tournament.setStandingsCache(False)
+    print("playerStandings x%d at %d players: uncached %.2fms, cached "
+          "%.3fms" % (polls, players, uncached / polls * 1000,
+                      cached / polls * 1000))
+
+
+def benchInstrumentation(players=16, calls=10000):
+    """Cost of instrumentation on a cheap call, off, on, and logging."""
+    seed(players)
+    logger = logging.getLogger('tournament')
+    logger.addHandler(logging.NullHandler())
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    timings = []
+    for enabled, log in ((False, False), (True, False), (True, True)):
+        tournament.setInstrumentation(enabled, log)
+        try:
+            timings.append(timeit.timeit(tournament.countPlayers,
+                                         number=calls) / calls)
+        finally:
+            tournament.setInstrumentation(False)
+    print("countPlayers x%d: %.3fms uninstrumented, %.3fms instrumented, "
+          "%.3fms logged" % ((calls,) + tuple(t * 1000 for t in timings)))
+
+
+def benchBrackets(players=4096):
+    """Seed 4,096 player brackets from the standings and play them out a
+    round per reportMatches() batch, counting queries per call."""
+    for bracket_format in bracket.FORMATS:
+        seed(0)
+        tournament.registerPlayers("Player %d" % n for n in range(players))
+        tournament.resetQueryStats()
+        tournament.setInstrumentation()
+        try:
+            start = time.time()
+            tournament.createBracket(bracket_format)
+            pairings = tournament.bracketPairings()
+            # Play round robins for a few rounds only
+            rounds = 0
+            while pairings and (rounds < 3 or
+                                bracket_format != bracket.ROUND_ROBIN):
+                tournament.reportMatches(
+                    [(id1, id2) for _, id1, _, id2, _ in pairings],
+                    round_number=pairings[0][0])
+                rounds += 1
+                pairings = tournament.bracketPairings()
+            elapsed = time.time() - start
+        finally:
+            tournament.setInstrumentation(False)
+        stats = tournament.queryStats()
+        print("%s bracket, %d players: %d rounds played in %.1fs, "
+              "createBracket %d queries, bracketPairings %.0fms and %d "
+              "queries per call" %
+              (bracket_format, players, rounds, elapsed,
+               stats['createBracket']['queries'],
+               stats['bracketPairings']['wall_time'] /
+               stats['bracketPairings']['calls'] * 1000,
+               stats['bracketPairings']['queries'] /
+               stats['bracketPairings']['calls']))
+
+
+def timeLiveEvent(players, rounds):
+    """Play an event with swissPairings() and single reportMatch() calls,
+    then check its standings. Returns the mean swissPairings and
+    reportMatch times and the checkStandings time, in seconds."""
+    live = tournament.createTournament(name="Live", info="tournament_bench.py")
+    tournament.registerPlayers(("Player %d" % n for n in range(players)),
+                               live)
+    pairing_time = report_time = 0
+    reports = 0
+    for _ in range(rounds):
+        start = time.time()
+        pairings = tournament.swissPairings(live)
+        pairing_time += time.time() - start
+        for id1, _, id2, _ in pairings:
+            start = time.time()
+            tournament.reportMatch(id1, id2, live,
+                                   'win' if id2 is not None else 'bye')
+            report_time += time.time() - start
+            reports += 1
+    check_time = timeit.timeit(lambda: tournament.checkStandings(live),
+                               number=1)
+    tournament.deleteMatches(live)
+    tournament.deletePlayers(live)
+    tournament.deleteTournaments(live)
+    return pairing_time / rounds, report_time / reports, check_time
+
+
+def benchPartitions(history=50000000, tournaments=500, players=256,
+                    rounds=8):
+    """A live event next to a long history of finished tournaments, first
+    with the history in live matches partitions, then once it has been
+    moved out of the matches table by archiveTournament()."""
+    seed(0)
+    tournament.deleteTournaments()
+    db = psycopg2.connect(tournament.DSN)
+    cursor = db.cursor()
+    finished = []
+    start = time.time()
+    for index in range(tournaments):
+        tournament_id = tournament.createTournament(
+            name="History %d" % index, info="tournament_bench.py")
+        ids = tournament.registerPlayers(
+            ("Player %d" % n for n in range(players)), tournament_id)
+        # Straight into the partition, past the standings triggers on
+        # matches; the standings are rebuilt in one go afterwards
+        cursor.execute("""
+                       insert into matches_%d (tournament_id, winner_id,
+                                               loser_id)
+                       select %%(id)s,
+                              (%%(ids)s)[1 + n * 7919 %%%% %%(players)s],
+                              (%%(ids)s)[1 + (n * 7919 + 1 +
+                                              n %%%% (%%(players)s - 1))
+                                             %%%% %%(players)s]
+                       from generate_series(0, %%(count)s - 1) n
+                       """ % tournament_id,
+                       {'id': tournament_id, 'ids': ids, 'players': players,
+                        'count': history // tournaments})
+        db.commit()
+        tournament.rebuildStandings(tournament_id)
+        finished.append(tournament_id)
+    db.autocommit = True
+    cursor.execute("analyze")
+    db.close()
+    print("%d historical matches in %d tournaments loaded in %.0fs" %
+          (history, tournaments, time.time() - start))
+
+    for label in ("live", "archived"):
+        if label == "archived":
+            start = time.time()
+            for tournament_id in finished:
+                tournament.archiveTournament(tournament_id)
+            print("archiveTournament: %.1fms per tournament" %
+                  ((time.time() - start) / tournaments * 1000))
+        pairings, report, check = timeLiveEvent(players, rounds)
+        check_all = timeit.timeit(tournament.checkStandings, number=1)
+        print("%d player event beside %s history: swissPairings %.1fms, "
+              "reportMatch %.2fms, checkStandings %.1fms, checkStandings "
+              "of every tournament %.1fs" %
+              (players, label, pairings * 1000, report * 1000, check * 1000,
+               check_all))
+
+
+def benchBackends(players=256, rounds=8):
+    """Play the same event against PostgreSQL and the in-memory backend."""
+    timings = []
+    for backend in (None, MemoryBackend()):
+        tournament.setBackend(backend)
+        try:
+            seed(0)
+            timings.append(timeit.timeit(
+                lambda: playEvent(players, rounds), number=1))
+        finally:
+            tournament.setBackend(None)
+    print("%d players x %d rounds: PostgreSQL %.2fs, memory %.2fs (%.0fx)" %
+          (players, rounds, timings[0], timings[1],
+           timings[0] / timings[1]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Benchmarks for tournament.py.")
+    parser.add_argument('--sizes', default="16,256,4096,100000",
+                        help="comma separated player counts to time calls at")
+    parser.add_argument('--rounds', type=int,
+                        help="rounds per event; log2 of the players if unset")
+    parser.add_argument('--sample', type=int, default=100,
+                        help="single calls timed per function and round")
+    parser.add_argument('--memory', action='store_true',
+                        help="time the in-memory backend as well")
+    parser.add_argument('--output',
+                        help="file to write the call timings to as JSON "
+                             "Lines, - for stdout")
+    parser.add_argument('--profile',
+                        help="file to save cProfile statistics of the call "
+                             "timings to")
+    parser.add_argument('--calls-only', action='store_true',
+                        help="skip the other benchmarks")
+    args = parser.parse_args()
+
+    if not args.calls_only:
+        benchPool()
+        benchReportMatches()
+        benchRegisterPlayers()
+        benchTournaments()
+        benchPairing()
+        benchTiebreakers()
+        benchRatings()
+        benchExport()
+        benchPreparedStatements()
+        benchBrackets()
+        benchPartitions()
+        benchStandingsCache()
+        benchInstrumentation()
+        benchBackends()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    if args.output in (None, "-"):
+        benchSizes(sizes, args.rounds, args.sample, args.memory,
+                   args.output and sys.stdout, args.profile)
+    else:
+        with open(args.output, 'w') as output:
+            benchSizes(sizes, args.rounds, args.sample, args.memory, output,
+                       args.profile)
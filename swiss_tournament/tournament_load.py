@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+#
+# Load test for tournament_async.py: the end of a round of a large event,
+# when every table's result arrives at once. Run against a local, throwaway
+# tournament database (see tournament.sql); the tables are wiped first.
+#
+#     python3 tournament_load.py --submissions 5000 --pool 20 --copies 2
+#
+# With --copies, every result is submitted that many times at once, as by
+# several judges, which must still record each match once.
+
+import argparse
+import asyncio
+import time
+
+import tournament_async
+from tournament_bench import percentile
+
+
+async def submit(winner, loser, tournament_id):
+    """Report one result and return how long it took."""
+    start = time.time()
+    await tournament_async.reportMatch(winner, loser, tournament_id)
+    return time.time() - start
+
+
+async def loadTest(submissions, pool_size, copies=1):
+    await tournament_async.configurePool(max_size=pool_size)
+    try:
+        await tournament_async.deleteMatches()
+        await tournament_async.deletePlayers()
+        await tournament_async.deleteTournaments()
+        tournament_id = await tournament_async.createTournament(
+            name="Load", info="tournament_load.py")
+        await tournament_async.registerPlayers(
+            ("Player %d" % n for n in range(submissions * 2)), tournament_id)
+        pairings = await tournament_async.swissPairings(tournament_id)
+        await tournament_async.startRound(tournament_id)
+
+        start = time.time()
+        latencies = await asyncio.gather(
+            *[submit(first, second, tournament_id)
+              for first, _, second, _ in pairings for _ in range(copies)])
+        elapsed = time.time() - start
+
+        standings = await tournament_async.playerStandings(tournament_id)
+        if any(row[3] != 1 for row in standings):
+            raise ValueError("Every player should have exactly one match.")
+    finally:
+        await tournament_async.closePool()
+    print("%d concurrent reportMatch calls over %d connections: %.1fs "
+          "(%.0f/s), p50 %.1fms p99 %.1fms" %
+          (len(latencies), pool_size, elapsed, len(latencies) / elapsed,
+           percentile(latencies, 0.5) * 1000,
+           percentile(latencies, 0.99) * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Fire concurrent result submissions at "
+                    "tournament_async.py.")
+    parser.add_argument('--submissions', type=int, default=5000)
+    parser.add_argument('--pool', type=int, default=20)
+    parser.add_argument('--copies', type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(loadTest(args.submissions, args.pool, args.copies))
@@ -2,7 +2,35 @@
 #
 # Test cases for tournament.py
 
+import json
+import threading
+import time
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import psycopg2
+import psycopg2.pool
+
+import bracket
+import rating
+import simulator
+import tournament as tournament_api
 from tournament import *
+from tournament import _cacheStandings, _cachedStandings
+from memory_backend import MemoryBackend
+
+try:
+    import asyncio
+    import asyncpg
+    import tournament_async
+    DATABASE_ERRORS = (psycopg2.Error, asyncpg.PostgresError)
+except (ImportError, SyntaxError):
+    # tournament_async.py needs Python 3.7 or later and asyncpg
+    tournament_async = None
+    DATABASE_ERRORS = (psycopg2.Error,)
 
 
 # noinspection PyPep8Naming
@@ -150,7 +178,799 @@ def testPairings():
     print("8. After one match, players with one win are paired.")
 
 
-if __name__ == '__main__':
+# noinspection PyPep8Naming
+def testReportMatchesBatch():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    # Create a bogus tournament for testing
+    createTournament(name="WT 2015", info="The one and only Wombat tossing tournament of the gods (TM)")
+    registerPlayer("Rarity")
+    registerPlayer("Rainbow Dash")
+    registerPlayer("Spike")
+    registerPlayer("Starlight Glimmer")
+    standings = playerStandings()
+    [id1, id2, id3, id4] = [row[0] for row in standings]
+    outcomes = reportMatches([(id1, id2), (id3, id3), (id3, id4)])
+    if len(outcomes) != 3:
+        raise ValueError("reportMatches should return one outcome per match.")
+    if outcomes[0][0] is None or outcomes[2][0] is None:
+        raise ValueError("Valid matches should be recorded by reportMatches.")
+    if outcomes[1][0] is not None or outcomes[1][1] is None:
+        raise ValueError("Invalid matches should be rejected with a reason.")
+    standings = playerStandings()
+    for (i, n, w, m) in standings:
+        if m != 1:
+            raise ValueError("Each player should have one match recorded.")
+        if i in (id1, id3) and w != 1:
+            raise ValueError("Each match winner should have one win recorded.")
+    print("9. Batches of matches can be reported at once.")
+
+
+# noinspection PyPep8Naming
+def testRegisterPlayersBatch():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    # Create a bogus tournament for testing
+    createTournament(name="WT 2015", info="The one and only Wombat tossing tournament of the gods (TM)")
+    names = ["Sweetie Belle", "Apple\tBloom", "Scoot\\aloo"]
+    ids = registerPlayers(iter(names))
+    if len(ids) != 3 or countPlayers() != 3:
+        raise ValueError("registerPlayers should register every name given.")
+    registered = dict((i, n) for (i, n, w, m) in playerStandings())
+    if [registered[i] for i in ids] != names:
+        raise ValueError("registerPlayers should return ids in name order.")
+    print("10. Batches of players can be registered at once.")
+
+
+# noinspection PyPep8Naming
+def testStandingsConsistency():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    # Create a bogus tournament for testing
+    createTournament(name="WT 2015", info="The one and only Wombat tossing tournament of the gods (TM)")
+    ids = registerPlayers(["Player %d" % n for n in range(8)])
+    reportMatch(ids[0], ids[1])
+    reportMatch(ids[2], ids[3])
+    reportMatches([(ids[4], ids[5]), (ids[6], ids[7]), (ids[0], ids[2]),
+                   (ids[5], ids[0]), (ids[1], ids[3])])
+    if checkStandings():
+        raise ValueError("Standings should match the played and won views.")
+    rebuildStandings()
+    if checkStandings():
+        raise ValueError("Rebuilding the standings should keep them intact.")
+    print("11. Stored standings agree with the match history.")
+
+
+# noinspection PyPep8Naming
+def testMultipleTournaments():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    first = createTournament(name="WT 2015", info="Wombat tossing")
+    second = createTournament(name="WT 2016", info="More wombat tossing")
+    [id1, id2] = registerPlayers(["Trixie", "Zecora"], first)
+    [id3, id4] = [registerPlayer("Derpy", second),
+                  registerPlayer("Big McIntosh", second)]
+    reportMatch(id1, id2, first)
+    reportMatch(id4, id3, second)
+    if countPlayers(first) != 2 or countPlayers() != 4:
+        raise ValueError("countPlayers should count one or all tournaments.")
+    if set(row[0] for row in playerStandings(second)) != {id3, id4}:
+        raise ValueError("Standings should only list the tournament's players.")
+    if playerStandings(second)[0][:3] != (id4, "Big McIntosh", 1):
+        raise ValueError("Standings should only count the tournament's matches.")
+    deleteMatches(first)
+    if playerStandings(second)[0][2] != 1 or playerStandings(first)[0][2]:
+        raise ValueError("Deleting matches should only affect one tournament.")
+    print("12. Several tournaments can run side by side.")
+
+
+# noinspection PyPep8Naming
+def testPairingsAvoidRematches():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    # Create a bogus tournament for testing
+    createTournament(name="WT 2015", info="The one and only Wombat tossing tournament of the gods (TM)")
+    [id1, id2, id3, id4] = registerPlayers(["Luna", "Celestia", "Cadance",
+                                            "Shining Armor"])
+    reportMatch(id1, id2)
+    reportMatch(id3, id4)
+    reportMatch(id1, id3)
+    reportMatch(id2, id4)
+    pairings = swissPairings()
+    actual_pairs = set(frozenset([p[0], p[2]]) for p in pairings)
+    if actual_pairs != {frozenset([id1, id4]), frozenset([id2, id3])}:
+        raise ValueError("Players should not be paired with an opponent "
+                         "they have already played.")
+    print("13. Players are not paired with an earlier opponent.")
+
+
+# noinspection PyPep8Naming
+def testPairingsOddPlayers():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    # Create a bogus tournament for testing
+    createTournament(name="WT 2015", info="The one and only Wombat tossing tournament of the gods (TM)")
+    [id1, id2, id3] = registerPlayers(["Discord", "Sunset Shimmer", "Tirek"])
+    reportMatch(id1, id2)
+    pairings = swissPairings()
+    if len(pairings) != 2 or pairings[-1][2:] != (None, None):
+        raise ValueError("With an odd number of players, swissPairings should "
+                         "end with a bye.")
+    if pairings[-1][0] == id1:
+        raise ValueError("The bye should go to a low placed player.")
+    tournament = createTournament(name="WT 2016", info="Nobody came")
+    if swissPairings(tournament) != []:
+        raise ValueError("A tournament without players has no pairings.")
+    [id4] = registerPlayers(["Pinkie Pie"], tournament)
+    if swissPairings(tournament) != [(id4, "Pinkie Pie", None, None)]:
+        raise ValueError("A single player should get the bye.")
+    print("14. With an odd number of players, one player gets a bye.")
+
+
+# noinspection PyPep8Naming
+def testTiebreakers():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    # Create a bogus tournament for testing
+    createTournament(name="WT 2015", info="The one and only Wombat tossing tournament of the gods (TM)")
+    [id1, id2, id3, id4] = registerPlayers(["Flim", "Flam", "Iron Will",
+                                            "Cheese Sandwich"])
+    reportMatches([(id1, id2), (id3, id4), (id1, id3), (id4, id2)])
+    rows = dict((row[0], row[2:]) for row in playerTiebreakers())
+    # id3 and id4 both have one win; id3 lost to id1 and beat id4, who beat
+    # id2 (no wins, counted as a third)
+    (w3, m3, p3, omw3, buchholz3, sb3) = rows[id3]
+    (w4, m4, p4, omw4, buchholz4, sb4) = rows[id4]
+    if abs(omw3 - 0.75) > 1e-9 or abs(omw4 - 5.0 / 12) > 1e-9 or \
+            (buchholz3, sb3, buchholz4, sb4) != (3, 1, 1, 0):
+        raise ValueError("Tie-breakers should be computed from opponents' "
+                         "records.")
+    if [row[0] for row in playerTiebreakers()] != [id1, id3, id4, id2]:
+        raise ValueError("Players on equal wins should be ordered by their "
+                         "tie-breakers.")
+    # A player who has not played and one who only had a bye met nobody,
+    # which both backends should score alike
+    tiebreakers = []
+    for backend in (tournament_api, MemoryBackend()):
+        event = backend.createTournament(name="WT 2016", info="Late starters")
+        [id5, id6, id7, id8] = backend.registerPlayers(
+            ["Spitfire", "Soarin", "Fleetfoot", "Misty"], event)
+        backend.reportMatch(id5, id6, event)
+        backend.reportMatch(id7, None, event, result='bye')
+        tiebreakers.append([(row[1],) + tuple(row[2:])
+                            for row in backend.playerTiebreakers(event)])
+    if tiebreakers[0] != tiebreakers[1] or \
+            [row[4] for row in tiebreakers[0] if row[0] in
+             ("Fleetfoot", "Misty")] != [0, 0]:
+        raise ValueError("Players without opponents should have no "
+                         "opponents' match-win percentage.")
+    print("15. Tie-breakers order players on equal wins.")
+
+
+# noinspection PyPep8Naming
+def testDrawsAndByes():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    # Three points for a win, one for a draw, as in many card games
+    createTournament(name="WT 2015", info="Wombat tossing", win_points=3,
+                     draw_points=1, loss_points=0, bye_points=3)
+    [id1, id2, id3] = registerPlayers(["Gilda", "Sombra", "Chrysalis"])
+    reportMatch(id1, id2, result='draw')
+    reportMatch(id3, None, result='bye')
+    reportMatches([(id1, id3, 'forfeit')])
+    rows = dict((row[0], row[2:5]) for row in playerTiebreakers())
+    if rows != {id1: (1, 2, 4), id2: (0, 1, 1), id3: (1, 2, 3)}:
+        raise ValueError("Draws, forfeits and byes should score the "
+                         "tournament's points.")
+    if [row[0] for row in playerStandings()] != [id1, id3, id2]:
+        raise ValueError("Standings should be ordered by points.")
+    if checkStandings():
+        raise ValueError("Standings should match the match history.")
+    if swissPairings()[-1][0] == id3:
+        raise ValueError("A player should not get a second bye.")
+    print("16. Draws, forfeits and byes are scored by points.")
+
+
+# noinspection PyPep8Naming
+def testRatings():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    createTournament(name="Elo 2015", info="Rated with Elo")
+    [id1, id2, id3, id4] = registerPlayers(
+        ["Applejack", "Rarity", "Spike", "Zecora"])
+    reportMatch(id1, id2)
+    reportMatch(id3, id4, result='forfeit')
+    ratings = dict((row[0], row[2]) for row in playerRatings())
+    if ratings != {id1: 1516, id2: 1484, id3: 1500, id4: 1500}:
+        raise ValueError("A win should move 16 Elo points, a forfeit none.")
+    if [row[0] for row in playerStandings()] != [id1, id3, id4, id2]:
+        raise ValueError("Players tied on points and opponent points should "
+                         "be ordered by rating.")
+    reportMatches([(id1, id3), (id4, id2, 'draw')])
+    ratings = playerRatings()
+    rebuildRatings()
+    if playerRatings() != ratings:
+        raise ValueError("Replaying the matches should reproduce the "
+                         "ratings.")
+    deleteMatches()
+    if set(row[2] for row in playerRatings()) != set([1500]):
+        raise ValueError("Deleting matches should reset the ratings.")
+
+    deletePlayers()
+    deleteTournaments()
+    createTournament(name="Glicko 2015", info="Rated with Glicko-2",
+                     rating_system='glicko2')
+    [id1, id2] = registerPlayers(["Applejack", "Rarity"])
+    reportMatch(id1, id2)
+    ratings = dict((row[0], (round(row[2], 1), round(row[3], 1)))
+                   for row in playerRatings())
+    if ratings != {id1: (1662.3, 290.3), id2: (1337.7, 290.3)}:
+        raise ValueError("A win should move the Glicko-2 ratings and "
+                         "shrink their deviations.")
+    # The worked example of Glickman's paper
+    states = rating.ratePeriod(
+        rating.GLICKO2,
+        {1: (1500, 200, 0.06), 2: (1400, 30, 0.06), 3: (1550, 100, 0.06),
+         4: (1700, 300, 0.06)},
+        [(1, 2, 1), (3, 1, 1), (4, 1, 1)])
+    if tuple(round(value, 2) for value in states[1][:2]) != (1464.05,
+                                                             151.52):
+        raise ValueError("Glicko-2 should match the published example.")
+    print("17. Ratings are updated as matches are reported.")
+
+
+# noinspection PyPep8Naming
+def testRounds():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    createTournament(name="Rounds 2015", info="Judges resubmit results")
+    [id1, id2, id3, id4, id5] = registerPlayers(
+        ["Bon Bon", "Lyra", "Derpy", "Octavia", "Vinyl"])
+    if startRound() != 1:
+        raise ValueError("The first round should be round 1.")
+    match_id = reportMatch(id1, id2)
+    if reportMatch(id1, id2) != match_id:
+        raise ValueError("Reporting a result twice should return the "
+                         "recorded match.")
+    try:
+        reportMatch(id2, id1)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A different result for a reported pairing should "
+                         "be rejected.")
+    outcomes = reportMatches([(id3, id4, 'draw'), (id4, id3, 'draw'),
+                              (id2, id1), (id5, None, 'bye')])
+    if outcomes[0][0] is None or outcomes[1] != outcomes[0] or \
+            outcomes[2][0] is not None or outcomes[3][0] is None:
+        raise ValueError("reportMatches() should record each pairing once "
+                         "per round.")
+    if reportMatches([(id5, None, 'bye')]) != [outcomes[3]]:
+        raise ValueError("A bye should be recorded once per round.")
+    standings = dict((row[0], row[3]) for row in playerStandings())
+    if standings != {id1: 1, id2: 1, id3: 1, id4: 1, id5: 1}:
+        raise ValueError("Each player should have one match after round 1.")
+    if startRound() != 2:
+        raise ValueError("Rounds should be numbered in order.")
+    reportMatch(id2, id1)
+    reportMatch(id1, id2, round_number=1)
+    if [row[3] for row in playerStandings() if row[0] == id1] != [2]:
+        raise ValueError("A pairing may be reported again in a new round.")
+    if checkStandings():
+        raise ValueError("Standings should match the match history.")
+    print("18. Each pairing is recorded once per round.")
+
+
+# noinspection PyPep8Naming
+def testExportStandings():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    first = createTournament(name="Export 2015", info="First event")
+    second = createTournament(name="Export 2016", info="Second event")
+    [id1, id2, id3] = registerPlayers(["Cheerilee", "Maud", "Trixie"], first)
+    [id4] = registerPlayers(["Sunburst"], second)
+    reportMatch(id2, id1, first)
+    rows = list(iterStandings(chunk_size=2))
+    if [row[:2] for row in rows] != [(first, id2), (first, id1),
+                                     (first, id3), (second, id4)]:
+        raise ValueError("iterStandings() should yield every tournament's "
+                         "standings in order.")
+    output = StringIO()
+    exportStandingsCsv(output, first)
+    lines = output.getvalue().splitlines()
+    if lines[0] != ",".join(STANDINGS_FIELDS) or len(lines) != 4 or \
+            not lines[1].startswith("%s,%s,Maud,1,1," % (first, id2)):
+        raise ValueError("The CSV export should hold a header and a row per "
+                         "player.")
+    output = StringIO()
+    exportStandingsJsonLines(output, second)
+    if [json.loads(line) for line in output.getvalue().splitlines()] != [
+            {'tournament_id': second, 'id': id4, 'name': "Sunburst",
+             'wins': 0, 'matches': 0, 'points': 0}]:
+        raise ValueError("The JSON Lines export should hold an object per "
+                         "player.")
+    print("19. Standings can be exported a chunk at a time.")
+
+
+# noinspection PyPep8Naming
+def testInstrumentation():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament = createTournament(name="Traced 2015",
+                                  info="Instrumented event")
+    calls = []
+    resetQueryStats()
+    setInstrumentation(hook=calls.append)
+    try:
+        [id1, id2] = registerPlayers(["Starlight", "Sunset"], tournament)
+        reportMatch(id1, id2, tournament)
+        playerStandings(tournament)
+        list(iterStandings(tournament, chunk_size=1))
+    finally:
+        setInstrumentation(False)
+    countPlayers()
+    names = ['registerPlayers', 'reportMatch', 'playerStandings',
+             'iterStandings']
+    stats = queryStats()
+    if sorted(stats) != sorted(names) or \
+            any(entry['calls'] != 1 for entry in stats.values()):
+        raise ValueError("queryStats() should count every call made while "
+                         "instrumentation is on, and no other.")
+    if [call['function'] for call in calls] != names:
+        raise ValueError("The instrumentation hook should see every call.")
+    if any(entry['db_time'] > entry['wall_time'] for entry in calls):
+        raise ValueError("A call cannot wait on the database for longer than "
+                         "it takes.")
+    if stats['playerStandings']['queries'] and (
+            stats['playerStandings']['rows'] != 2 or
+            stats['iterStandings']['rows'] != 2):
+        raise ValueError("queryStats() should count the rows queries "
+                         "return.")
+    resetQueryStats()
+    if queryStats():
+        raise ValueError("resetQueryStats() should forget every call.")
+    print("20. Queries can be counted and timed per function.")
+
+
+# noinspection PyPep8Naming
+def testStandingsCache():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament = createTournament(name="Cached 2015", info="Polled event")
+    [id1, id2, id3, id4] = registerPlayers(
+        ["Applejack", "Rarity", "Fluttershy", "Pinkie"], tournament)
+    setStandingsCache(listen=True)
+    resetQueryStats()
+    setInstrumentation()
+    try:
+        standings = playerStandings(tournament)
+        queries = queryStats()['playerStandings']['queries']
+        if playerStandings(tournament) != standings or \
+                queryStats()['playerStandings']['queries'] != queries:
+            raise ValueError("Unchanged standings should be read from the "
+                             "cache.")
+        reportMatch(id2, id1, tournament)
+        if playerStandings(tournament)[0][0] != id2:
+            raise ValueError("Reporting a match should invalidate the cached "
+                             "standings.")
+        if queries:
+            # Another process reports a match straight to the database
+            other = psycopg2.connect(DSN)
+            other.cursor().execute("""
+                                   insert into matches (tournament_id,
+                                       winner_id, loser_id, result)
+                                   values (%s, %s, %s, 'win')
+                                   """, (tournament, id4, id3))
+            other.commit()
+            other.close()
+            for _ in range(100):
+                if id4 in [row[0] for row in playerStandings(tournament)[:2]]:
+                    break
+                time.sleep(0.01)
+            else:
+                raise ValueError("Changes announced by other processes "
+                                 "should invalidate the cached standings.")
+            # A read started before another process reports a match, and
+            # finishes after the announcement was applied
+            rows, version = _cachedStandings(tournament)
+            other = psycopg2.connect(DSN)
+            other.cursor().execute("""
+                                   insert into matches (tournament_id,
+                                       winner_id, loser_id, result)
+                                   values (%s, %s, %s, 'win')
+                                   """, (tournament, id3, id1))
+            other.commit()
+            other.close()
+            for _ in range(100):
+                if _cachedStandings(tournament)[0] is None:
+                    break
+                time.sleep(0.01)
+            _cacheStandings(tournament, rows, version)
+            if playerStandings(tournament) == list(rows):
+                raise ValueError("Rows read before an announced change "
+                                 "should not be cached.")
+        deleteMatches(tournament)
+        if any(row[3] for row in playerStandings(tournament)):
+            raise ValueError("Deleting matches should invalidate the cached "
+                             "standings.")
+    finally:
+        setInstrumentation(False)
+        setStandingsCache(False)
+    print("21. Standings are cached until they change.")
+
+
+# noinspection PyPep8Naming
+def playBracket(tournament):
+    """Report bracket matches, the first player winning, until it is
+    decided. Returns the number of matches reported."""
+    reported = 0
+    pairings = bracketPairings(tournament)
+    while pairings:
+        for round_number, id1, _, id2, _ in pairings:
+            reportMatch(id1, id2, tournament, round_number=round_number)
+            reported += 1
+        pairings = bracketPairings(tournament)
+    return reported
+
+
+# noinspection PyPep8Naming
+def testBrackets():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    cut = createTournament(name="Cut 2015", info="Top 4 playoff")
+    registerPlayers(["Celestia", "Luna", "Cadance", "Discord", "Tirek"], cut)
+    seeds = [row[0] for row in playerStandings(cut)][:4]
+    first = createBracket(bracket.SINGLE, 4, cut)
+    pairings = bracketPairings(cut)
+    if [(row[0], row[1], row[3]) for row in pairings] != [
+            (first, seeds[0], seeds[3]), (first, seeds[1], seeds[2])]:
+        raise ValueError("The top seed should meet the lowest one in the "
+                         "first round of a bracket.")
+    for round_number, id1, _, id2, _ in pairings:
+        reportMatch(id1, id2, cut, round_number=round_number)
+    [(final, id1, _, id2, _)] = bracketPairings(cut)
+    if final != first + 1 or (id1, id2) != (seeds[0], seeds[1]):
+        raise ValueError("Winners should meet in the next round.")
+    reportMatch(id2, id1, cut, round_number=final)
+    if bracketPairings(cut) or bracketMatches(cut)[-1][5] != seeds[1]:
+        raise ValueError("The winner of the final should win the bracket.")
+    try:
+        createBracket(bracket.SINGLE, tournament_id=cut)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A tournament should have at most one bracket.")
+
+    double = createTournament(name="Double 2015", info="Double elimination")
+    registerPlayers(["Spitfire", "Soarin", "Fleetfoot"], double)
+    seeds = [row[0] for row in playerStandings(double)]
+    createBracket(bracket.DOUBLE, tournament_id=double)
+    if playBracket(double) != 4 or \
+            bracketMatches(double)[-1][3:7] != (seeds[0], None, seeds[0],
+                                                True):
+        raise ValueError("A double elimination bracket should skip byes, "
+                         "and the replayed final when the winners bracket "
+                         "champion wins.")
+
+    robin = createTournament(name="Robin 2015", info="Round robin")
+    registerPlayers(["Zecora", "Gilda", "Iron Will", "Cheese", "Snips"],
+                    robin)
+    createBracket(bracket.ROUND_ROBIN, tournament_id=robin)
+    matches = bracketMatches(robin)
+    if playBracket(robin) != 10 or len(set(
+            frozenset(match[3:5]) for match in matches)) != 10:
+        raise ValueError("A round robin should pair everybody once.")
+    print("22. Playoff brackets are seeded from the standings.")
+
+
+# noinspection PyPep8Naming
+def testArchive():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    finished = createTournament(name="Finals 2014", info="Archived event")
+    running = createTournament(name="Finals 2015", info="Running event")
+    [id1, id2] = registerPlayers(["Twilight", "Spike"], finished)
+    [id3, id4] = registerPlayers(["Celestia", "Luna"], running)
+    startRound(finished)
+    reportMatch(id2, id1, finished)
+    standings = playerStandings(finished)
+    archiveTournament(finished)
+    if playerStandings(finished) != standings:
+        raise ValueError("Archiving should keep the standings.")
+    try:
+        reportMatch(id1, id2, finished, round_number=1)
+    except (ValueError,) + DATABASE_ERRORS:
+        pass
+    else:
+        raise ValueError("Archived tournaments should take no more matches.")
+    try:
+        archiveTournament(finished)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A tournament should only be archived once.")
+    rebuildStandings()
+    rebuildRatings()
+    if playerStandings(finished) != standings or checkStandings():
+        raise ValueError("Rebuilding should leave archived tournaments "
+                         "alone.")
+    reportMatch(id3, id4, running)
+    if playerStandings(running)[0][0] != id3:
+        raise ValueError("Other tournaments should be unaffected.")
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    if countPlayers() != 0:
+        raise ValueError("Archived tournaments should still be deletable.")
+    print("23. Finished tournaments can be archived.")
+
+
+# noinspection PyPep8Naming
+def testPoolWaits():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament = createTournament(name="Busy 2015", info="Crowded event")
+    [id1, id2] = registerPlayers(["Derpy", "Trixie"], tournament)
+    reportMatch(id1, id2, tournament)
+    configurePool(max_size=2)
+    errors = []
+
+    def read():
+        try:
+            for _ in range(5):
+                checkStandings(tournament)
+                playerStandings(tournament)
+        except Exception as e:
+            errors.append(e)
+
+    try:
+        threads = [threading.Thread(target=read) for _ in range(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise ValueError("Callers beyond the pool size should wait for a "
+                             "connection, not fail: %r" % (errors[0],))
+        configurePool(max_size=1, timeout=0.1)
+        with connect():
+            try:
+                with connect():
+                    pass
+            except psycopg2.pool.PoolError:
+                pass
+            else:
+                raise ValueError("Waiting for a connection should time "
+                                 "out.")
+    finally:
+        configurePool()
+    print("24. Callers wait for a pooled connection.")
+
+
+# noinspection PyPep8Naming
+def testInvalidResults():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament = createTournament(name="Strict 2015", info="Refereed event")
+    other = createTournament(name="Other 2015", info="Elsewhere")
+    [id1, id2] = registerPlayers(["Zecora", "Cheerilee"], tournament)
+    [id3] = registerPlayers(["Discord"], other)
+    for winner, loser, result in ((id1, id1, 'win'), (id1, id3, 'win'),
+                                  (id3, id1, 'forfeit'), (id3, None, 'bye')):
+        try:
+            reportMatch(winner, loser, tournament, result=result)
+        except ValueError:
+            pass
+        else:
+            raise ValueError("A match against oneself or a player of another "
+                             "tournament should be rejected.")
+        outcome = reportMatches([(winner, loser, result)], tournament)
+        if outcome[0][0] is not None:
+            raise ValueError("reportMatches should reject what reportMatch "
+                             "rejects.")
+    if any(row[3] for row in playerStandings(tournament)) or \
+            checkStandings():
+        raise ValueError("Rejected matches should not be recorded.")
+    reportMatch(id1, id2, tournament, result='forfeit')
+    print("25. Invalid results are rejected.")
+
+
+# noinspection PyPep8Naming
+def testDeleteBracket():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament = createTournament(name="Replay 2015", info="Replayed cut")
+    registerPlayers(["Maud", "Marble", "Limestone", "Cloudy"], tournament)
+    createBracket(bracket.SINGLE, tournament_id=tournament)
+    playBracket(tournament)
+    deleteMatches(tournament)
+    try:
+        bracketMatches(tournament)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("Deleting the matches should delete the bracket.")
+    createBracket(bracket.SINGLE, tournament_id=tournament)
+    if playBracket(tournament) != 3:
+        raise ValueError("A bracket should be playable again once the "
+                         "matches are deleted.")
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    print("26. Deleting matches deletes the bracket.")
+
+
+# noinspection PyPep8Naming
+def testConcurrentReports():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament = createTournament(name="Rush 2015", info="Busy last round")
+    ids = registerPlayers(["Player %d" % n for n in range(16)], tournament)
+    startRound(tournament)
+    pairs = list(zip(ids[::2], ids[1::2]))
+    if not isinstance(tournament_api._backend, MemoryBackend):
+        # Another judge's report, not committed yet
+        other = psycopg2.connect(DSN)
+        other.cursor().execute("""
+                               insert into matches (tournament_id, winner_id,
+                                                    loser_id, round)
+                               values (%s, %s, %s, 1)
+                               """, (tournament,) + pairs[0])
+        errors = []
+
+        def report(winner, loser):
+            try:
+                reportMatch(winner, loser, tournament)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=report, args=pair)
+                   for pair in pairs[1:]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(2)
+        waiting = any(thread.is_alive() for thread in threads)
+        other.commit()
+        other.close()
+        for thread in threads:
+            thread.join()
+        if waiting or errors:
+            raise ValueError("Reports of different players' matches should "
+                             "not wait for each other: %r" % (errors[:1],))
+    else:
+        for winner, loser in pairs:
+            reportMatch(winner, loser, tournament)
+    if any(row[3] != 1 for row in playerStandings(tournament)) or \
+            checkStandings(tournament):
+        raise ValueError("Concurrent reports should each count once.")
+    deleteMatches(tournament)
+    if any(row[2:] != (0, 0) for row in playerStandings(tournament)) or \
+            checkStandings(tournament):
+        raise ValueError("Deleting matches should take them off the "
+                         "standings.")
+    print("27. Reports of different matches do not wait for each other.")
+
+
+# noinspection PyPep8Naming
+def testSubmissionKeys():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournament = createTournament(name="Casual 2015", info="No rounds")
+    [id1, id2] = registerPlayers(["Big Mac", "Braeburn"], tournament)
+    match_id = reportMatch(id1, id2, tournament, submission="sheet 1")
+    if reportMatch(id1, id2, tournament, submission="sheet 1") != match_id:
+        raise ValueError("A report sent again under its submission key "
+                         "should return the recorded match.")
+    try:
+        reportMatch(id2, id1, tournament, submission="sheet 1")
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A different result under a used submission key "
+                         "should be rejected.")
+    if not isinstance(tournament_api._backend, MemoryBackend):
+        errors = []
+
+        def report():
+            try:
+                reportMatch(id2, id1, tournament, submission="sheet 2")
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=report) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise ValueError("Concurrent reports under one submission key "
+                             "should all succeed: %r" % (errors[0],))
+    else:
+        reportMatch(id2, id1, tournament, submission="sheet 2")
+    reportMatch(id1, id2, tournament)
+    if [row[3] for row in playerStandings(tournament)] != [3, 3] or \
+            checkStandings(tournament):
+        raise ValueError("Before any round, each submission key should be "
+                         "recorded once, and a rematch be recorded.")
+    print("28. Reports are recorded once per submission key.")
+
+
+# noinspection PyPep8Naming
+def testSimulator():
+    for events, players in ((0, 8), (2, 1), (2, 0)):
+        try:
+            simulator.simulate(events, players, processes=1)
+        except ValueError:
+            pass
+        else:
+            raise ValueError("Simulating without events or without two "
+                             "players should be rejected.")
+    runs = [simulator.simulate(6, 8, processes=2, seed=7, draw_rate=0.1)
+            for _ in range(2)]
+    if runs[0] != runs[1]:
+        raise ValueError("A seeded simulation should be repeatable.")
+    mean_places, winner_rate, correlation = runs[0]
+    if len(mean_places) != 8 or abs(sum(mean_places) - 28) > 1e-9 or \
+            not 0 <= winner_rate <= 1 or not -1 <= correlation <= 1:
+        raise ValueError("Every player should finish in one place of "
+                         "each event.")
+    print("29. Seeded simulations are repeatable.")
+
+
+class AsyncBackend(object):
+    """Backend running the coroutines of tournament_async.py on an event loop
+    of its own, so that the tests can call them like the functions of
+    tournament.py. What tournament_async.py leaves out is served by
+    tournament.py on the same database."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __getattr__(self, name):
+        function = getattr(tournament_async, name, None)
+        if function is None:
+            # The PostgreSQL function itself, not the one routed back here
+            return getattr(tournament_api, name).__wrapped__
+
+        def call(*args, **kwargs):
+            return self.run(function(*args, **kwargs))
+        return call
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def close(self):
+        self.run(tournament_async.closePool())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+def runTests():
     testDeleteMatches()
     testDelete()
     testCount()
@@ -159,6 +979,41 @@ if __name__ == '__main__':
     testStandingsBeforeMatches()
     testReportMatches()
     testPairings()
-    print("Success!  All tests pass!")
+    testReportMatchesBatch()
+    testRegisterPlayersBatch()
+    testStandingsConsistency()
+    testMultipleTournaments()
+    testPairingsAvoidRematches()
+    testPairingsOddPlayers()
+    testTiebreakers()
+    testDrawsAndByes()
+    testRatings()
+    testRounds()
+    testExportStandings()
+    testInstrumentation()
+    testStandingsCache()
+    testBrackets()
+    testArchive()
+    testPoolWaits()
+    testInvalidResults()
+    testDeleteBracket()
+    testConcurrentReports()
+    testSubmissionKeys()
 
 
+if __name__ == '__main__':
+    for name, backend in (("PostgreSQL", None), ("memory", MemoryBackend())):
+        print("Testing the %s backend." % name)
+        setBackend(backend)
+        runTests()
+    # The simulator always plays on a memory backend of its own
+    testSimulator()
+    if tournament_async is not None:
+        print("Testing the tournament_async.py backend.")
+        backend = AsyncBackend()
+        setBackend(backend)
+        try:
+            runTests()
+        finally:
+            backend.close()
+    print("Success!  All tests pass!")